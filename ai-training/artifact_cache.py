@@ -0,0 +1,259 @@
+"""
+Content-addressed cache for derived dataset artifacts
+Keys artifacts by a hash of their sources and stage parameters and evicts least recently used ones to a disk budget
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+CACHE_DIR = Path("dataset") / "cache"
+DEFAULT_BUDGET = 20 << 30
+INDEX_NAME = "index.json"
+SOURCES_NAME = "sources.json"
+
+
+def _size(path):
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.rglob("*") if child.is_file())
+    return path.stat().st_size
+
+
+def _remove(path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class ArtifactCache:
+    """
+    Store derived files and directories under keys built from their inputs
+
+    A key hashes the stage name, the content of every source file and the
+    stage parameters, so changing any of them misses while repeating an
+    experiment hits. File contents are hashed once: the digest is
+    remembered against the file's path, size and modification time, so a
+    hit costs a stat and an index lookup. URLs (immutable archive dumps)
+    are keyed by the URL itself.
+
+    The cache belongs to one process at a time; the index is replaced
+    atomically but not locked.
+
+    Example:
+        cache = ArtifactCache()
+        key = cache.key("filter", ["games.pgn"], min_elo=1800)
+        entry = cache.get(key)
+        if entry is None:
+            staged = cache.staging_path(key, "filtered.pgn")
+            ...write staged...
+            entry = cache.put(key, staged, "filter")
+        use(entry["path"])
+
+    Args:
+        root: Cache directory
+        budget: Bytes the stored artifacts may occupy
+    """
+
+    def __init__(self, root=CACHE_DIR, budget=DEFAULT_BUDGET):
+        self.root = Path(root)
+        self.budget = budget
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index = self._load(INDEX_NAME)
+        self.sources = self._load(SOURCES_NAME)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load(self, name):
+        path = self.root / name
+        if not path.exists():
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, name, data):
+        path = self.root / name
+        temp = path.with_suffix(".tmp")
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+        os.replace(temp, path)
+
+    def source_digest(self, source):
+        """
+        Return the content digest of a file, or "url:<url>" for a URL
+        """
+        source = str(source)
+        if "://" in source:
+            return f"url:{source}"
+        path = Path(source).resolve()
+        stat = path.stat()
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        known = self.sources.get(str(path))
+        if known and known["fingerprint"] == fingerprint:
+            return known["sha256"]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self.sources[str(path)] = {"fingerprint": fingerprint, "sha256": digest.hexdigest()}
+        self._save(SOURCES_NAME, self.sources)
+        return digest.hexdigest()
+
+    def key(self, stage, sources, **params):
+        """
+        Return the cache key of a stage run on sources with params
+
+        Args:
+            stage: Stage name, e.g. "filter"
+            sources: Input file paths or URLs
+            **params: JSON-serialisable parameters that change the output
+                      (max_games, min_elo, encoder_version, ...)
+        """
+        description = {
+            "stage": stage,
+            "sources": [self.source_digest(source) for source in sources],
+            "params": params,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Return the index entry of key with its "path", or None on a miss
+        """
+        entry = self.index.get(key)
+        if entry is not None and not (self.root / entry["file"]).exists():
+            # Removed behind the cache's back
+            del self.index[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry["last_used"] = time.time()
+        self._save(INDEX_NAME, self.index)
+        return dict(entry, path=self.root / entry["file"])
+
+    def staging_path(self, key, name):
+        """
+        Return a scratch path on the cache's file system to build an artifact in
+        """
+        directory = self.root / "staging" / key
+        _remove(directory)
+        directory.mkdir(parents=True)
+        return directory / name
+
+    def put(self, key, path, stage, meta=None):
+        """
+        Move a finished file or directory into the cache
+
+        Least recently used artifacts are evicted until the budget holds.
+        An artifact larger than the whole budget is not stored.
+
+        Args:
+            key: Key from key()
+            path: Artifact to store (moved, not copied)
+            stage: Stage name, for reports
+            meta: JSON-serialisable extras returned with the entry (e.g. statistics)
+
+        Returns:
+            The new index entry with its "path", or None when the artifact
+            does not fit (it is then left where it was)
+        """
+        path = Path(path)
+        size = _size(path)
+        if size > self.budget:
+            print(f"⚠️  {stage} artifact ({size / (1024*1024):.1f} MB) exceeds the cache budget; not cached")
+            return None
+
+        file = Path("objects") / key[:2] / key / path.name
+        target = self.root / file
+        _remove(target.parent)
+        target.parent.mkdir(parents=True)
+        shutil.move(str(path), str(target))
+        if path.parent.parent == self.root / "staging":
+            _remove(path.parent)
+
+        now = time.time()
+        self.index[key] = {"stage": stage, "file": file.as_posix(), "size": size, "created": now,
+                           "last_used": now, "meta": meta or {}}
+        self.evict(keep=key)
+        return dict(self.index[key], path=target)
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used artifacts until the total size fits the budget
+        """
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda key: self.index[key]["last_used"]):
+            if total <= self.budget:
+                break
+            if key == keep:
+                continue
+            entry = self.index.pop(key)
+            _remove((self.root / entry["file"]).parent)
+            total -= entry["size"]
+            self.evictions += 1
+        self._save(INDEX_NAME, self.index)
+
+    def clear(self):
+        """
+        Remove every artifact
+        """
+        for entry in self.index.values():
+            _remove((self.root / entry["file"]).parent)
+        self.index = {}
+        self._save(INDEX_NAME, self.index)
+
+    def total_size(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def report(self):
+        """
+        Print usage per stage and this session's hit rate
+        """
+        stages = {}
+        for entry in self.index.values():
+            count, size = stages.get(entry["stage"], (0, 0))
+            stages[entry["stage"]] = (count + 1, size + entry["size"])
+        total = self.total_size()
+        print(f"🗄️  Cache {self.root}: {len(self.index)} artifacts, {total / (1024*1024):.1f} MB "
+              f"of {self.budget / (1024*1024):.0f} MB")
+        for stage, (count, size) in sorted(stages.items()):
+            print(f"   {stage:<16}{count:>6} artifacts {size / (1024*1024):10.1f} MB")
+        lookups = self.hits + self.misses
+        if lookups:
+            print(f"   {self.hits} hits / {lookups} lookups, {self.evictions} evictions")
+
+
+def materialize(entry, destination):
+    """
+    Copy a cached artifact to destination (a copy, so writing there never alters the cache)
+    """
+    destination = Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if entry["path"].is_dir():
+        shutil.copytree(entry["path"], destination, dirs_exist_ok=True)
+    else:
+        shutil.copyfile(entry["path"], destination)
+    return destination
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    cache = ArtifactCache(options.get("root", CACHE_DIR))
+    if "budget" in options:
+        from async_fetcher import _parse_size
+        cache.budget = _parse_size(options["budget"])
+        cache.evict()
+    if args and args[0] == "clear":
+        cache.clear()
+        print(f"🗑️  Cleared {cache.root}")
+    else:
+        cache.report()
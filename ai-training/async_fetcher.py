@@ -0,0 +1,413 @@
+"""
+Concurrent multi-source dataset fetcher
+Streams several archives at once under connection, bandwidth and disk limits, extracting games as they arrive
+"""
+
+import asyncio
+import hashlib
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+import aiohttp
+
+from parallel_decompress import StreamDecompressor
+from pgn_scan import GameSplitter
+from pipeline import Pipeline, Limit, PgnWriter
+from telemetry import stage
+
+# Source templates; "{key}" is the month (YYYY-MM) or year of the archive
+SOURCES = {
+    "lichess": "https://database.lichess.org/standard/lichess_db_standard_rated_{key}.pgn.bz2",
+    "elite": "https://database.lichess.org/lichess_elite_{key}.pgn.bz2",
+    "fics": "https://www.ficsgames.org/download/ficsgames-{key}.pgn.gz",
+}
+
+# Published "<sha256>  <file name>" listings used to verify whole downloads
+CHECKSUM_URLS = {
+    "lichess": "https://database.lichess.org/standard/sha256sums.txt",
+}
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_MIN_FREE = 1 << 30        # never fill the output disk beyond this
+DISK_CHECK_INTERVAL = 64 << 20    # bytes reserved between free-space checks
+MAX_BACKOFF = 30
+
+# Answers that mean "try again later" rather than "this will never work"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    pass
+
+
+class FetchJob:
+    """
+    One archive to download and extract
+
+    Args:
+        url: Archive URL (.bz2, .gz or plain PGN; detected from the data)
+        output_file: PGN written by the default pipeline
+        max_games: Stop after this many extracted games (None for all)
+        name: Label used in reports (defaults to the file name)
+        sha256: Expected digest of the complete archive
+        checksum_url: Listing to look sha256 up in when not given
+        pipeline: Pipeline the games are fed to; defaults to a Limit
+                  (when max_games is set) followed by a PgnWriter
+    """
+
+    def __init__(self, url, output_file, max_games=None, name=None, sha256=None, checksum_url=None,
+                 pipeline=None):
+        self.url = url
+        self.output_file = Path(output_file)
+        self.max_games = max_games
+        self.name = name or url.rsplit("/", 1)[-1]
+        self.sha256 = sha256
+        self.checksum_url = checksum_url
+        self.pipeline = pipeline
+
+    def make_pipeline(self):
+        if self.pipeline is not None:
+            return self.pipeline
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        stages = [Limit(self.max_games)] if self.max_games is not None else []
+        return Pipeline(*stages, PgnWriter(self.output_file))
+
+
+def parse_source(spec, output_dir=Path("dataset"), max_games=None):
+    """
+    Turn "lichess:2024-08", "elite:2024-01", "fics:2023" or a URL into a FetchJob
+    """
+    if "://" in spec:
+        name = spec.rsplit("/", 1)[-1].split(".", 1)[0]
+        return FetchJob(spec, Path(output_dir) / f"{name}.pgn", max_games, name)
+    source, _, key = spec.partition(":")
+    if source not in SOURCES or not key:
+        raise ValueError(f"Unknown source {spec!r}; use {', '.join(f'{name}:KEY' for name in SOURCES)} or a URL")
+    name = f"{source}_{key}"
+    return FetchJob(SOURCES[source].format(key=key), Path(output_dir) / f"{name}.pgn", max_games, name,
+                    checksum_url=CHECKSUM_URLS.get(source))
+
+
+class TokenBucket:
+    """
+    Bandwidth cap shared by all downloads, in bytes per second
+
+    Args:
+        rate: Bytes per second (None or 0 for unlimited)
+        burst: Bytes that may be taken at once (defaults to one second's worth)
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def take(self, count):
+        if not self.rate:
+            return
+        # Holding the lock while sleeping queues the other downloads
+        # behind this one, which keeps the total rate at the cap
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+class DiskBudget:
+    """
+    Limit on bytes written by all jobs and on the free space left on disk
+
+    reserve() is called from extraction threads, so it is locked.
+
+    Args:
+        max_bytes: Total output bytes allowed (None for no limit)
+        min_free: Free bytes to leave on the output file system
+        path: Any path on the output file system
+    """
+
+    def __init__(self, max_bytes=None, min_free=DEFAULT_MIN_FREE, path="."):
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.path = Path(path)
+        self.used = 0
+        self.exhausted = False
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def reserve(self, count):
+        """
+        Account for count bytes about to be written; False when over budget
+        """
+        with self._lock:
+            if self.exhausted:
+                return False
+            if self.max_bytes is not None and self.used + count > self.max_bytes:
+                self.exhausted = True
+                return False
+            if self.min_free and (self._checked_at is None or self.used - self._checked_at >= DISK_CHECK_INTERVAL):
+                self._checked_at = self.used
+                if shutil.disk_usage(self.path).free - DISK_CHECK_INTERVAL < self.min_free:
+                    self.exhausted = True
+                    return False
+            self.used += count
+            return True
+
+    def release(self, count):
+        with self._lock:
+            self.used -= count
+
+
+class _Extractor:
+    """
+    Decompress, split and pipeline one download (runs in worker threads)
+    """
+
+    def __init__(self, job, budget):
+        self.budget = budget
+        self.decompressor = StreamDecompressor("auto")
+        self.splitter = GameSplitter()
+        self.pipeline = job.make_pipeline()
+        self.games = 0
+        self.bytes_out = 0
+        self.stopped = None
+
+    def feed(self, chunk):
+        """
+        Extract the games completed by chunk; returns why extraction stopped, or None
+        """
+        for game in self.splitter.feed(self.decompressor.decompress(chunk)):
+            if not self._add(game):
+                break
+        return self.stopped
+
+    def _add(self, game):
+        if not self.budget.reserve(len(game)):
+            self.stopped = "disk budget"
+            return False
+        if self.pipeline.feed(game):
+            self.games += 1
+            self.bytes_out += len(game)
+        else:
+            self.budget.release(len(game))
+        if self.pipeline.exhausted:
+            self.stopped = "limit"
+        return self.stopped is None
+
+    def finish(self, complete):
+        # The last game of a complete archive has no boundary after it
+        if complete and self.stopped is None:
+            game = self.splitter.flush()
+            if game is not None:
+                self._add(game)
+        self.pipeline.close()
+
+
+async def load_checksums(session, url):
+    """
+    Fetch a sha256sum-style listing and return {file name: digest}
+    """
+    async with session.get(url) as response:
+        response.raise_for_status()
+        text = await response.text()
+    sums = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            sums[parts[1].lstrip("*")] = parts[0].lower()
+    return sums
+
+
+async def _fetch(session, job, semaphore, bucket, budget, max_retries, chunk_size):
+    """
+    Download and extract one job, resuming with Range requests after errors
+    """
+    result = {"name": job.name, "url": job.url, "output_file": str(job.output_file), "status": "failed",
+              "games": 0, "bytes_in": 0, "bytes_out": 0, "retries": 0, "sha256": None, "verified": None}
+    began = time.perf_counter()
+
+    async with semaphore:
+        print(f"📥 {job.name}: {job.url}")
+        try:
+            with stage(f"fetch:{job.name}", total=job.max_games, unit="games_kept") as metrics:
+                extractor = _Extractor(job, budget)
+                digest = hashlib.sha256()
+                received = 0
+                validator = None
+                complete = False
+
+                try:
+                    while extractor.stopped is None and not complete:
+                        headers = {}
+                        if received:
+                            headers["Range"] = f"bytes={received}-"
+                            if validator:
+                                headers["If-Range"] = validator
+                        try:
+                            async with session.get(job.url, headers=headers) as response:
+                                response.raise_for_status()
+                                current = response.headers.get("ETag") or response.headers.get("Last-Modified")
+                                skip = 0
+                                if received and response.status != 206:
+                                    # If-Range answered with the whole file:
+                                    # only safe to continue when it is unchanged
+                                    if validator and current != validator:
+                                        raise FetchError(f"{job.url} changed while resuming")
+                                    skip = received
+                                validator = validator or current
+
+                                async for chunk in response.content.iter_chunked(chunk_size):
+                                    if skip:
+                                        if len(chunk) <= skip:
+                                            skip -= len(chunk)
+                                            continue
+                                        chunk, skip = chunk[skip:], 0
+                                    await bucket.take(len(chunk))
+                                    received += len(chunk)
+                                    digest.update(chunk)
+                                    games, written = extractor.games, extractor.bytes_out
+                                    # Decompression releases the GIL, so jobs
+                                    # extract in parallel threads
+                                    stopped = await asyncio.to_thread(extractor.feed, chunk)
+                                    metrics.add(bytes_in=len(chunk), bytes_out=extractor.bytes_out - written,
+                                                games_kept=extractor.games - games)
+                                    if stopped:
+                                        break
+                                else:
+                                    complete = True
+                        except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError,
+                                aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
+                            if isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES:
+                                raise
+                            result["retries"] += 1
+                            metrics.add(retries=1)
+                            if result["retries"] > max_retries:
+                                raise FetchError(f"{job.url}: giving up after {max_retries} retries ({e})")
+                            delay = min(2 ** result["retries"], MAX_BACKOFF)
+                            problem = "server busy" if isinstance(e, aiohttp.ClientResponseError) \
+                                else "connection interrupted"
+                            print(f"⚠️  {job.name}: {problem} ({e}), resuming from byte {received} in {delay}s...")
+                            await asyncio.sleep(delay)
+                finally:
+                    await asyncio.to_thread(extractor.finish, complete)
+                    result.update(games=extractor.games, bytes_in=received, bytes_out=extractor.bytes_out,
+                                  sha256=digest.hexdigest())
+
+                if complete:
+                    result["status"] = "done"
+                    if job.sha256:
+                        result["verified"] = result["sha256"] == job.sha256.lower()
+                        if not result["verified"]:
+                            raise FetchError(f"{job.url}: sha256 mismatch "
+                                             f"(expected {job.sha256}, got {result['sha256']})")
+                else:
+                    result["status"] = extractor.stopped
+        except (FetchError, aiohttp.ClientError, OSError, ValueError) as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+            print(f"❌ {job.name}: {e}")
+
+    result["seconds"] = time.perf_counter() - began
+    if result["status"] != "failed":
+        print(f"✅ {job.name}: {result['games']} games ({result['status']}, "
+              f"{result['bytes_in'] / (1024*1024):.1f} MB downloaded)")
+    return result
+
+
+async def fetch_all_async(jobs, connections=DEFAULT_CONNECTIONS, bandwidth=None, disk_budget=None,
+                          min_free=DEFAULT_MIN_FREE, max_retries=5, chunk_size=DEFAULT_CHUNK_SIZE,
+                          timeout=60):
+    """
+    Fetch and extract several archives concurrently
+
+    Args:
+        jobs: List of FetchJob
+        connections: Downloads running at the same time
+        bandwidth: Total bytes per second across all downloads (None for no cap)
+        disk_budget: Total extracted bytes allowed across all jobs
+        min_free: Free bytes to leave on the output disk
+        max_retries: Reconnect attempts per job
+        chunk_size: Bytes read from the network per iteration
+        timeout: Seconds without data before a connection counts as failed
+
+    Returns:
+        List of per-job result dictionaries, in job order
+    """
+    semaphore = asyncio.Semaphore(connections)
+    bucket = TokenBucket(bandwidth)
+    output_dir = jobs[0].output_file.parent if jobs else Path(".")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    budget = DiskBudget(disk_budget, min_free, output_dir)
+
+    client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(timeout=client_timeout, connector=connector) as session:
+        listings = {}
+        for job in jobs:
+            if job.sha256 or not job.checksum_url:
+                continue
+            if job.checksum_url not in listings:
+                try:
+                    listings[job.checksum_url] = await load_checksums(session, job.checksum_url)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"⚠️  Could not load checksums from {job.checksum_url}: {e}")
+                    listings[job.checksum_url] = {}
+            job.sha256 = listings[job.checksum_url].get(job.url.rsplit("/", 1)[-1])
+
+        return await asyncio.gather(*(
+            _fetch(session, job, semaphore, bucket, budget, max_retries, chunk_size) for job in jobs
+        ))
+
+
+def fetch_all(jobs, **options):
+    """
+    Blocking wrapper around fetch_all_async
+    """
+    return asyncio.run(fetch_all_async(jobs, **options))
+
+
+def _parse_size(text):
+    """
+    Parse "500K", "20M", "5G" or a plain byte count
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+if __name__ == "__main__":
+    options = {}
+    max_games = None
+    specs = []
+    for arg in sys.argv[1:]:
+        key, _, value = arg.partition("=")
+        if key == "--max-games":
+            max_games = int(value)
+        elif key == "--connections":
+            options["connections"] = int(value)
+        elif key == "--bandwidth":
+            options["bandwidth"] = _parse_size(value)
+        elif key == "--disk":
+            options["disk_budget"] = _parse_size(value)
+        else:
+            specs.append(arg)
+    if not specs:
+        print("Usage: python async_fetcher.py lichess:2024-08 [elite:2024-01 fics:2023 URL ...] "
+              "[--max-games=N] [--connections=N] [--bandwidth=20M] [--disk=10G]")
+        sys.exit(1)
+
+    results = fetch_all([parse_source(spec, max_games=max_games) for spec in specs], **options)
+    failed = [result for result in results if result["status"] == "failed"]
+    print(f"\n📊 {sum(result['games'] for result in results)} games from {len(results) - len(failed)} "
+          f"of {len(results)} sources")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,289 @@
+"""
+End-to-end benchmark for the ai-training data pipeline
+Times every stage on fixed-seed synthetic corpora and compares against a saved baseline
+"""
+
+import bz2
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+from pgn_scan import open_pgn, iter_game_spans, detect_boundary
+
+CORPUS_SIZES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+FIXTURE_SEED = 20240801
+FIXTURE_DIR = Path("dataset") / "benchmark"
+RESULTS_DIR = Path("benchmarks")
+
+# Games per compressed stream, so the fixture archive is multi-stream
+# like the ones produced by pbzip2
+FIXTURE_STREAM_GAMES = 20000
+
+STAGES = ["decompress", "split", "filter", "analyze", "encode", "load"]
+
+# Each stage is timed at least this many times, and repeated until the runs
+# add up to MIN_STAGE_SECONDS, and the fastest run is kept. Millisecond
+# stages of the small corpus thus get enough runs for a stable minimum.
+DEFAULT_REPEATS = 3
+MIN_STAGE_SECONDS = 0.5
+MAX_REPEATS = 100
+
+# Stages whose baseline run was shorter than this are too close to timer
+# noise for their throughput to be compared
+NOISE_FLOOR_SECONDS = 0.05
+
+# A stage regresses when its throughput drops or its peak RSS grows by
+# more than these fractions relative to the baseline
+THROUGHPUT_TOLERANCE = 0.10
+RSS_TOLERANCE = 0.20
+
+
+def fixture_paths(size):
+    """
+    Return (pgn, bz2) paths of the fixture corpus for a size name
+    """
+    return FIXTURE_DIR / f"games_{size}.pgn", FIXTURE_DIR / f"games_{size}.pgn.bz2"
+
+
+def build_fixture(size):
+    """
+    Generate the fixture corpus for a size name unless it already exists
+
+    The corpus is a pure function of FIXTURE_SEED and the game count, so
+    every machine benchmarks the same bytes.
+    """
+    from generate_sample_dataset import generate_sample_games
+
+    pgn_path, archive_path = fixture_paths(size)
+    FIXTURE_DIR.mkdir(parents=True, exist_ok=True)
+    if not pgn_path.exists():
+        print(f"🧪 Generating {size} fixture corpus ({CORPUS_SIZES[size]} games)...")
+        scratch = pgn_path.with_suffix(".tmp")
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_sample_games(CORPUS_SIZES[size], scratch, seed=FIXTURE_SEED)
+        scratch.replace(pgn_path)
+
+    if not archive_path.exists():
+        scratch = archive_path.with_suffix(".tmp")
+        with open_pgn(pgn_path) as buf, open(scratch, 'wb') as f:
+            starts = [start for start, _ in iter_game_spans(buf, boundary=detect_boundary(buf))]
+            bounds = starts[::FIXTURE_STREAM_GAMES] + [len(buf)]
+            for start, end in zip(bounds, bounds[1:]):
+                f.write(bz2.compress(buf[start:end], 9))
+        scratch.replace(archive_path)
+    return pgn_path, archive_path
+
+
+def _peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def _run_stage(stage, pgn_path, archive_path, scratch, workers, repeats):
+    """
+    Run one stage at least repeats times and for at least MIN_STAGE_SECONDS
+    in total, and return its counters (runs in a fresh process)
+    """
+    seconds = []
+    while len(seconds) < repeats or (sum(seconds) < MIN_STAGE_SECONDS and len(seconds) < MAX_REPEATS):
+        result = _time_stage(stage, Path(pgn_path), Path(archive_path), Path(scratch), workers)
+        seconds.append(result["seconds"])
+    result["seconds"] = min(seconds)
+    result["runs"] = len(seconds)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def _time_stage(stage, pgn_path, archive_path, scratch, workers):
+    input_bytes = pgn_path.stat().st_size
+    result = {}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        began = time.perf_counter()
+        if stage == "decompress":
+            from parallel_decompress import decompress_parallel
+            stats = decompress_parallel(archive_path, scratch / "decompressed.pgn", workers=workers)
+            result.update(games=stats["games"], bytes=stats["bytes_out"])
+        elif stage == "split":
+            games = 0
+            with open_pgn(pgn_path) as buf:
+                for _ in iter_game_spans(buf, boundary=detect_boundary(buf)):
+                    games += 1
+            result.update(games=games, bytes=input_bytes)
+        elif stage == "filter":
+            from download_dataset import filter_high_quality_games
+            stats = filter_high_quality_games(pgn_path, scratch / "filtered.pgn", min_elo=1800)
+            result.update(kept=stats.seen, bytes=input_bytes)
+        elif stage == "analyze":
+            from download_dataset import analyze_dataset
+            analyze_dataset(pgn_path)
+            result.update(bytes=input_bytes)
+        elif stage == "encode":
+            from convert_parallel import convert_parallel
+            manifest = convert_parallel(pgn_path, scratch / "encoded", workers=workers, verbose=False)
+            result.update(games=manifest["games"], positions=manifest["positions"], bytes=input_bytes)
+        elif stage == "load":
+            from data_loader import ShardDataset
+            dataset = ShardDataset(scratch / "encoded", batch_size=1024)
+            positions = 0
+            for planes, policy, value in dataset:
+                positions += len(policy)
+            shard_bytes = sum(path.stat().st_size for path in dataset.shards)
+            result.update(positions=positions, bytes=shard_bytes)
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+        result["seconds"] = time.perf_counter() - began
+    return result
+
+
+def _rates(result, corpus_games):
+    seconds = result["seconds"] or 1e-9
+    # Stages that do not report a game count process the whole corpus
+    games = result.get("games", corpus_games)
+    result["games_per_s"] = games / seconds
+    if "positions" in result:
+        result["positions_per_s"] = result["positions"] / seconds
+    result["mb_per_s"] = result.get("bytes", 0) / (1024 * 1024) / seconds
+    return result
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmark(size="1k", stages=None, workers=None, repeats=DEFAULT_REPEATS, output_file=None):
+    """
+    Run the pipeline stages on a fixture corpus and write the results as JSON
+
+    Every stage runs in its own process so peak RSS is measured per stage.
+    The encode stage's shards feed the load stage.
+
+    Args:
+        size: Corpus name from CORPUS_SIZES
+        stages: Stage names to run (defaults to all of STAGES)
+        workers: Worker processes for the parallel stages
+        repeats: Minimum timed runs per stage (more are made until they
+                 total MIN_STAGE_SECONDS); the fastest is reported
+        output_file: JSON path (defaults to benchmarks/results_<size>.json)
+
+    Returns:
+        The results dictionary
+    """
+    if size not in CORPUS_SIZES:
+        raise ValueError(f"Unknown corpus size {size!r}; choose from {', '.join(CORPUS_SIZES)}")
+    stages = stages or STAGES
+    workers = workers or os.cpu_count() or 1
+    pgn_path, archive_path = build_fixture(size)
+
+    print(f"\n⏱️  Benchmarking {size} corpus ({CORPUS_SIZES[size]} games, {workers} workers)")
+    results = {"corpus": size, "games": CORPUS_SIZES[size], "workers": workers,
+               "environment": _environment(), "stages": {}}
+
+    scratch = Path(tempfile.mkdtemp(prefix="benchmark_"))
+    try:
+        for stage in stages:
+            if stage == "load" and "encode" not in stages:
+                raise ValueError("The load stage reads the shards written by the encode stage")
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                result = executor.submit(_run_stage, stage, str(pgn_path), str(archive_path),
+                                         str(scratch), workers, repeats).result()
+            results["stages"][stage] = _rates(result, CORPUS_SIZES[size])
+            print(f"   {stage:<11}{_format_result(result)}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    output_file = Path(output_file) if output_file else RESULTS_DIR / f"results_{size}.json"
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"📁 Results: {output_file}")
+    return results
+
+
+def _format_result(result):
+    text = f"{result['seconds']:8.2f}s {result['games_per_s']:10.0f} games/s {result['mb_per_s']:8.1f} MB/s"
+    if "positions_per_s" in result:
+        text += f" {result['positions_per_s']:10.0f} positions/s"
+    return text + f"  peak {result['peak_rss_mb']:.0f} MB ({result['runs']} runs)"
+
+
+def compare_to_baseline(results, baseline):
+    """
+    Compare two result dictionaries stage by stage
+
+    Throughput is compared on positions/s where a stage reports it and on
+    MB/s otherwise, and only for stages whose baseline run took at least
+    NOISE_FLOOR_SECONDS; peak RSS is always compared.
+
+    Returns:
+        List of regression messages (empty when nothing regressed)
+    """
+    regressions = []
+    print(f"\n📏 Against baseline {baseline['environment'].get('commit') or ''} "
+          f"({baseline['environment'].get('timestamp')})")
+    for stage, current in results["stages"].items():
+        previous = baseline["stages"].get(stage)
+        if previous is None:
+            continue
+        metric = "positions_per_s" if "positions_per_s" in current else "mb_per_s"
+        change = current[metric] / previous[metric] - 1 if previous[metric] else 0.0
+        rss_change = current["peak_rss_mb"] / previous["peak_rss_mb"] - 1 if previous["peak_rss_mb"] else 0.0
+
+        noisy = previous["seconds"] < NOISE_FLOOR_SECONDS
+        flags = []
+        if change < -THROUGHPUT_TOLERANCE and not noisy:
+            flags.append(f"{metric} {change * 100:+.1f}%")
+        if rss_change > RSS_TOLERANCE:
+            flags.append(f"peak RSS {rss_change * 100:+.1f}%")
+        marker = "❌" if flags else "✅"
+        note = "  (below noise floor, not gated)" if noisy else ""
+        print(f"   {marker} {stage:<11}{metric} {change * 100:+6.1f}%   peak RSS {rss_change * 100:+6.1f}%{note}")
+        regressions.extend(f"{stage}: {flag}" for flag in flags)
+    return regressions
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    size = args[0] if args else "1k"
+    baseline_file = RESULTS_DIR / f"baseline_{size}.json"
+
+    results = run_benchmark(size)
+    if "--save-baseline" in sys.argv:
+        shutil.copyfile(RESULTS_DIR / f"results_{size}.json", baseline_file)
+        print(f"📌 Saved baseline: {baseline_file}")
+    elif baseline_file.exists():
+        with open(baseline_file, 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(results, json.load(f))
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s): " + "; ".join(regressions))
+            sys.exit(1)
+        print("\n✅ No regressions")
+    else:
+        print(f"\nℹ️  No baseline at {baseline_file}; run with --save-baseline to create one")
@@ -0,0 +1,263 @@
+"""
+Multiprocess PGN-to-training-shard converter
+Splits a PGN on game boundaries and encodes the pieces in a worker pool
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from encoder import ENCODER_VERSION, iter_encoded_games
+from pgn_index import build_index, index_path_for
+from pgn_scan import open_pgn, iter_game_spans, detect_boundary
+from record_format import DEFAULT_SHARD_SIZE, RECORD_EXTENSION, RecordShardWriter
+from telemetry import stage
+
+# Chunks are defined by game count, never by worker count, so the shards
+# written for a given input are identical however many workers run
+DEFAULT_GAMES_PER_CHUNK = 2000
+
+MANIFEST_NAME = "manifest.json"
+SHARD_PREFIX = "part_"
+
+
+def plan_chunks(pgn_file, games_per_chunk=DEFAULT_GAMES_PER_CHUNK):
+    """
+    Split a PGN file into byte ranges of games_per_chunk whole games
+
+    Uses the sidecar index when one exists (refreshing it if the PGN was
+    appended to); otherwise game boundaries are found with a byte scan.
+
+    Returns:
+        List of (start, end) byte ranges
+    """
+    if index_path_for(pgn_file).exists():
+        index = build_index(pgn_file, verbose=False)
+        starts = index.records["offset"][::games_per_chunk].astype(np.int64).tolist()
+        size = Path(pgn_file).stat().st_size
+        return [(start, end) for start, end in zip(starts, starts[1:] + [size])]
+
+    chunks = []
+    with open_pgn(pgn_file) as buf:
+        chunk_start = None
+        count = 0
+        for start, end in iter_game_spans(buf, boundary=detect_boundary(buf)):
+            if chunk_start is None:
+                chunk_start = start
+            count += 1
+            if count == games_per_chunk:
+                chunks.append((chunk_start, end))
+                chunk_start = None
+                count = 0
+        if chunk_start is not None:
+            chunks.append((chunk_start, len(buf)))
+    return chunks
+
+
+def _file_digest(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _until(spans, end):
+    for start, stop in spans:
+        if start >= end:
+            return
+        yield start, stop
+
+
+def _convert_chunk(pgn_file, output_dir, number, start, end, shard_size):
+    """
+    Encode the games in one byte range (runs in a worker process)
+    """
+    began = time.perf_counter()
+    stats = {}
+    writer = RecordShardWriter(output_dir, shard_size, prefix=f"{SHARD_PREFIX}{number:05d}")
+
+    with open_pgn(pgn_file) as buf:
+        boundary = detect_boundary(buf)
+        spans = _until(iter_game_spans(buf, start, boundary), end)
+        for positions in iter_encoded_games(buf, spans, stats):
+            writer.add(positions)
+
+    paths = writer.close()
+    return {
+        "chunk": number,
+        "byte_start": start,
+        "byte_end": end,
+        "games": stats.get("games", 0),
+        "skipped": stats.get("skipped", 0),
+        "positions": writer.positions,
+        "files": [path.name for path in paths],
+        "sha256": _file_digest(paths),
+        "seconds": time.perf_counter() - began,
+        "pid": os.getpid(),
+    }
+
+
+def _clear_shards(output_dir):
+    """
+    Remove the shards and manifest of an earlier conversion into output_dir
+    """
+    for path in output_dir.glob(f"{SHARD_PREFIX}*{RECORD_EXTENSION}"):
+        path.unlink()
+    (output_dir / MANIFEST_NAME).unlink(missing_ok=True)
+
+
+def _copy_output(manifest, source_dir, output_dir):
+    """
+    Copy the shards listed in a manifest, and the manifest, between directories
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    names = [name for chunk in manifest["chunks"] for name in chunk["files"]] + [MANIFEST_NAME]
+    for name in names:
+        shutil.copyfile(source_dir / name, output_dir / name)
+
+
+def convert_parallel(pgn_file, output_dir, workers=None, games_per_chunk=DEFAULT_GAMES_PER_CHUNK,
+                     shard_size=DEFAULT_SHARD_SIZE, verbose=True, cache=None):
+    """
+    Encode a PGN file into training shards using a process pool
+
+    Args:
+        pgn_file: Input PGN
+        output_dir: Directory for shards and manifest.json; shards of an
+                    earlier conversion into it are removed first
+        workers: Number of processes (defaults to os.cpu_count())
+        games_per_chunk: Games per task; fixes the output layout
+        shard_size: Maximum positions per shard file
+        verbose: Print progress
+        cache: ArtifactCache; shards of identical input content, encoder
+               version and layout are then copied from the cache
+
+    Returns:
+        The manifest dictionary (also written to output_dir/manifest.json)
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    # Leftover shards would otherwise be loaded alongside the new ones
+    _clear_shards(output_dir)
+
+    if cache is not None:
+        key = cache.key("encode", [pgn_file], encoder_version=ENCODER_VERSION, games_per_chunk=games_per_chunk,
+                        shard_size=shard_size)
+        entry = cache.get(key)
+        if entry is not None:
+            _copy_output(entry["meta"], entry["path"], output_dir)
+            if verbose:
+                print(f"♻️  {pgn_file}: {entry['meta']['positions']} positions from the cache")
+            return entry["meta"]
+
+    began = time.perf_counter()
+    chunks = plan_chunks(pgn_file, games_per_chunk)
+    if verbose:
+        print(f"\n🧮 Converting {pgn_file}: {len(chunks)} chunks on {workers} workers")
+
+    results = []
+    with stage("encode", total=Path(pgn_file).stat().st_size, unit="bytes_in") as metrics, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_convert_chunk, str(pgn_file), str(output_dir), number, start, end, shard_size)
+                   for number, (start, end) in enumerate(chunks)]
+        for future in futures:
+            result = future.result()
+            results.append(result)
+            metrics.add(bytes_in=result["byte_end"] - result["byte_start"],
+                        games_seen=result["games"] + result["skipped"], games_kept=result["games"],
+                        games_malformed=result["skipped"], positions=result["positions"])
+            if verbose and len(results) % 10 == 0:
+                print(f"  {len(results)}/{len(chunks)} chunks done...")
+
+    elapsed = time.perf_counter() - began
+    positions = sum(result["positions"] for result in results)
+    manifest = {
+        "source": str(pgn_file),
+        "encoder_version": ENCODER_VERSION,
+        "games_per_chunk": games_per_chunk,
+        "shard_size": shard_size,
+        "games": sum(result["games"] for result in results),
+        "skipped": sum(result["skipped"] for result in results),
+        "positions": positions,
+        "chunks": [{key: value for key, value in result.items() if key not in ("seconds", "pid")}
+                   for result in results],
+    }
+    with open(output_dir / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    if verbose:
+        print(f"✅ {manifest['games']} games -> {positions} positions in {elapsed:.2f}s "
+              f"({positions / elapsed:.0f} positions/s)")
+        print(f"📁 Manifest: {output_dir / MANIFEST_NAME}")
+
+    manifest_stats = dict(manifest)
+    manifest_stats["seconds"] = elapsed
+    if cache is not None:
+        staged = cache.staging_path(key, "encoded")
+        # Only this conversion's files; output_dir may hold anything else
+        _copy_output(manifest, output_dir, staged)
+        cache.put(key, staged, "encode", manifest_stats)
+    return manifest_stats
+
+
+def measure_scaling(pgn_file, max_workers=None, games_per_chunk=DEFAULT_GAMES_PER_CHUNK):
+    """
+    Convert the same input with 1, 2, 4, ... max_workers processes
+
+    Prints positions/s and speedup per worker count and checks that every
+    run produced identical shards.
+
+    Returns:
+        List of (workers, seconds, positions_per_s) tuples
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+
+    rows = []
+    reference = None
+    print(f"\n📈 Scaling test on {pgn_file}")
+    for workers in counts:
+        scratch = Path(tempfile.mkdtemp(prefix="convert_scaling_"))
+        try:
+            result = convert_parallel(pgn_file, scratch, workers, games_per_chunk, verbose=False)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        digests = [chunk["sha256"] for chunk in result["chunks"]]
+        if reference is None:
+            reference = digests
+        elif digests != reference:
+            raise RuntimeError(f"Output with {workers} workers differs from the 1-worker run")
+
+        rate = result["positions"] / result["seconds"]
+        rows.append((workers, result["seconds"], rate))
+        speedup = rate / rows[0][2]
+        print(f"   {workers:>3} workers: {result['seconds']:7.2f}s  {rate:10.0f} positions/s  x{speedup:.2f}")
+
+    print("✅ Output identical across worker counts")
+    return rows
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else Path("dataset") / "sample_training_dataset.pgn"
+    if len(sys.argv) > 2 and sys.argv[2] == "--scaling":
+        measure_scaling(source, games_per_chunk=250)
+    else:
+        target = sys.argv[2] if len(sys.argv) > 2 else Path("dataset") / "encoded"
+        convert_parallel(source, target)
@@ -0,0 +1,241 @@
+"""
+Streaming PyTorch data loading over encoded record shards
+Memory-maps .rec shards, shuffles through a bounded buffer and reports input stalls
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from encoder import NUM_PLANES
+from record_format import RECORD_EXTENSION, RecordFile
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_SHUFFLE_BUFFER = 1 << 16
+
+
+def find_shards(source):
+    """
+    Return a sorted list of shard paths from a directory, a file or a list
+    """
+    if isinstance(source, (list, tuple)):
+        return [Path(path) for path in source]
+    source = Path(source)
+    if source.is_dir():
+        return sorted(source.glob(f"*{RECORD_EXTENSION}"))
+    return [source]
+
+
+class ShardDataset(IterableDataset):
+    """
+    Iterable dataset yielding ready-made batches from record shards
+
+    Shards are dealt round-robin to DataLoader workers. Each worker streams
+    record references through a fixed-size shuffle buffer and only expands
+    the emitted batch to planes, so memory use is independent of dataset
+    size. Use with DataLoader(batch_size=None).
+
+    Args:
+        shards: Shard directory, file or list of files
+        batch_size: Positions per batch
+        shuffle_buffer: Record references held for shuffling (0 disables)
+        seed: Base seed; combined with the epoch and worker id
+        drop_last: Drop a final short batch
+    """
+
+    def __init__(self, shards, batch_size=DEFAULT_BATCH_SIZE, shuffle_buffer=DEFAULT_SHUFFLE_BUFFER,
+                 seed=0, drop_last=False):
+        super().__init__()
+        self.shards = find_shards(shards)
+        if not self.shards:
+            raise ValueError(f"No {RECORD_EXTENSION} shards found in {shards}")
+        self.batch_size = batch_size
+        self.shuffle_buffer = max(shuffle_buffer, batch_size) if shuffle_buffer else 0
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """
+        Change the shuffle order for the next pass
+
+        Call before iterating the loader; workers copy the dataset when the
+        iteration starts.
+        """
+        self.epoch = epoch
+
+    def num_positions(self):
+        """
+        Total sampled positions across all shards (duplicates excluded)
+        """
+        return sum(len(RecordFile(path).sample_indices()) for path in self.shards)
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker_id, workers = (info.id, info.num_workers) if info else (0, 1)
+        rng = np.random.default_rng([self.seed, self.epoch, worker_id])
+
+        order = np.random.default_rng([self.seed, self.epoch]).permutation(len(self.shards))
+        files = [RecordFile(self.shards[i]) for i in order[worker_id::workers]]
+
+        if not self.shuffle_buffer:
+            for file_number, record_file in enumerate(files):
+                samples = record_file.sample_indices()
+                for start in range(0, len(samples), self.batch_size):
+                    indices = samples[start:start + self.batch_size]
+                    if len(indices) == self.batch_size or not self.drop_last:
+                        yield self._make_batch(files, np.full(len(indices), file_number), indices)
+            return
+
+        capacity = self.shuffle_buffer
+        buffer_files = np.empty(capacity, dtype=np.int32)
+        buffer_indices = np.empty(capacity, dtype=np.int64)
+        filled = 0
+
+        for file_number, record_file in enumerate(files):
+            samples = record_file.sample_indices()
+            for start in range(0, len(samples), self.batch_size):
+                incoming = samples[start:start + self.batch_size]
+                if filled + len(incoming) <= capacity:
+                    buffer_files[filled:filled + len(incoming)] = file_number
+                    buffer_indices[filled:filled + len(incoming)] = incoming
+                    filled += len(incoming)
+                    continue
+
+                # Emit random buffer slots and refill them with the new records
+                slots = rng.choice(filled, size=len(incoming), replace=False)
+                yield self._make_batch(files, buffer_files[slots].copy(), buffer_indices[slots].copy())
+                buffer_files[slots] = file_number
+                buffer_indices[slots] = incoming
+
+        # Drain what is left in random order
+        remaining = rng.permutation(filled)
+        for start in range(0, filled, self.batch_size):
+            slots = remaining[start:start + self.batch_size]
+            if len(slots) == self.batch_size or not self.drop_last:
+                yield self._make_batch(files, buffer_files[slots], buffer_indices[slots])
+
+    def _make_batch(self, files, file_numbers, indices):
+        count = len(indices)
+        planes = np.empty((count, NUM_PLANES, 8, 8), dtype=np.float32)
+        policy = np.empty(count, dtype=np.int64)
+        value = np.empty(count, dtype=np.float32)
+        for file_number in np.unique(file_numbers):
+            mask = file_numbers == file_number
+            planes[mask], policy[mask], value[mask] = files[file_number].batch(indices[mask])
+        return torch.from_numpy(planes), torch.from_numpy(policy), torch.from_numpy(value)
+
+
+def make_loader(shards, batch_size=DEFAULT_BATCH_SIZE, num_workers=2, shuffle_buffer=DEFAULT_SHUFFLE_BUFFER,
+                seed=0, prefetch_factor=4, pin_memory=None, drop_last=False):
+    """
+    Build a DataLoader over record shards
+
+    Args:
+        shards: Shard directory, file or list of files
+        batch_size: Positions per batch
+        num_workers: Loader processes (0 loads in the training process)
+        shuffle_buffer: Record references per worker for shuffling
+        seed: Shuffle seed
+        prefetch_factor: Batches prepared ahead per worker
+        pin_memory: Pin batches for faster host-to-device copies
+                    (defaults to True only when CUDA is available)
+        drop_last: Drop a final short batch
+
+    Returns:
+        (DataLoader, ShardDataset)
+    """
+    dataset = ShardDataset(shards, batch_size, shuffle_buffer, seed, drop_last)
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    options = {}
+    if num_workers > 0:
+        # Workers are not kept alive between epochs: each epoch's workers get
+        # a fresh copy of the dataset, so set_epoch() changes their order
+        options["prefetch_factor"] = prefetch_factor
+    loader = DataLoader(dataset, batch_size=None, num_workers=num_workers, pin_memory=pin_memory, **options)
+    return loader, dataset
+
+
+class StepTimer:
+    """
+    Split each training step into time waiting for data and time computing
+
+    Example:
+        timer = StepTimer(log_every=100)
+        for batch in timer.wrap(loader):
+            ...forward/backward/step...
+            timer.step_done()
+    """
+
+    def __init__(self, log_every=100):
+        self.log_every = log_every
+        self.steps = 0
+        self.data_seconds = 0.0
+        self.compute_seconds = 0.0
+        self.samples = 0
+        self._window = [0.0, 0.0, 0]
+        self._mark = None
+
+    def wrap(self, loader):
+        """
+        Yield batches from loader while timing the wait for each one
+        """
+        iterator = iter(loader)
+        while True:
+            began = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self._mark = time.perf_counter()
+            waited = self._mark - began
+            self.data_seconds += waited
+            self._window[0] += waited
+            self.samples += len(batch[0])
+            yield batch
+
+    def step_done(self):
+        """
+        Record the end of the compute part of the current step
+        """
+        computed = time.perf_counter() - self._mark
+        self.compute_seconds += computed
+        self._window[1] += computed
+        self._window[2] += 1
+        self.steps += 1
+        if self.log_every and self.steps % self.log_every == 0:
+            data, compute, steps = self._window
+            share = data / (data + compute) * 100 if data + compute else 0.0
+            print(f"  step {self.steps}: data {data / steps * 1000:.1f} ms, "
+                  f"compute {compute / steps * 1000:.1f} ms per step (input wait {share:.0f}%)")
+            self._window = [0.0, 0.0, 0]
+
+    def summary(self):
+        total = self.data_seconds + self.compute_seconds
+        return {
+            "steps": self.steps,
+            "samples": self.samples,
+            "data_seconds": self.data_seconds,
+            "compute_seconds": self.compute_seconds,
+            "input_wait_fraction": self.data_seconds / total if total else 0.0,
+            "samples_per_s": self.samples / total if total else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else Path("dataset") / "encoded"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    loader, dataset = make_loader(source, num_workers=workers)
+    timer = StepTimer(log_every=50)
+    print(f"📦 Reading {len(dataset.shards)} shards with {workers} workers")
+    for planes, policy, value in timer.wrap(loader):
+        timer.step_done()
+    summary = timer.summary()
+    print(f"✅ {summary['samples']} positions in {summary['steps']} batches "
+          f"({summary['samples_per_s']:.0f} positions/s)")
@@ -0,0 +1,302 @@
+"""
+Position deduplication for encoded record shards
+Flags repeated positions by Zobrist key and merges their results into the first occurrence
+"""
+
+import json
+import math
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from convert_parallel import MANIFEST_NAME, _file_digest
+from record_format import FLAG_DUPLICATE, FLAG_MERGED, RECORD_EXTENSION, RecordFile
+from zobrist import record_keys
+
+DEFAULT_ERROR_RATE = 0.01
+DEFAULT_MEMORY_KEYS = 1 << 20     # exact keys held in memory before spilling a run
+CHUNK_RECORDS = 1 << 16
+PLY_BUCKETS = 200                 # the last bucket collects every later ply
+
+LOCATION_SHIFT = 32               # location = shard number << 32 | record index
+
+
+class BloomFilter:
+    """
+    Bit-array Bloom filter over 64-bit Zobrist keys
+
+    The two halves of a key serve as the base hashes for double hashing,
+    which is safe because Zobrist keys are already uniformly random.
+
+    Args:
+        capacity: Expected number of distinct keys
+        error_rate: Target false-positive rate at capacity
+    """
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        low = keys & np.uint64(0xFFFFFFFF)
+        high = (keys >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (low[:, None] + steps[None, :] * high[:, None]) % np.uint64(self.size)
+
+    def contains(self, keys):
+        """
+        Boolean array: False means the key was definitely never added
+        """
+        positions = self._positions(keys)
+        hits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return hits.all(axis=1)
+
+    def add(self, keys):
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+
+class SpillKeySet:
+    """
+    Exact map from key to first location, spilling sorted runs to disk
+
+    At most memory_keys entries are held in a dict; older entries live in
+    memory-mapped sorted .npy runs that are binary-searched. Only keys the
+    Bloom filter reports as possibly seen are ever looked up.
+    """
+
+    def __init__(self, directory, memory_keys=DEFAULT_MEMORY_KEYS):
+        self.directory = Path(directory)
+        self.memory_keys = memory_keys
+        self.pending = {}
+        self.runs = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def get(self, keys):
+        """
+        Return the stored location of each key, -1 where it is absent
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        found = np.full(len(keys), -1, dtype=np.int64)
+        for number, key in enumerate(keys.tolist()):
+            location = self.pending.get(key)
+            if location is not None:
+                found[number] = location
+
+        for run_keys, run_locations in self.runs:
+            missing = np.flatnonzero(found < 0)
+            if not len(missing):
+                break
+            slots = np.minimum(np.searchsorted(run_keys, keys[missing]), len(run_keys) - 1)
+            hit = run_keys[slots] == keys[missing]
+            found[missing[hit]] = run_locations[slots[hit]]
+        return found
+
+    def add(self, keys, locations):
+        self.pending.update(zip(np.asarray(keys, dtype=np.uint64).tolist(), np.asarray(locations).tolist()))
+        self.count += len(keys)
+        if len(self.pending) >= self.memory_keys:
+            self._spill()
+
+    def _spill(self):
+        keys = np.fromiter(self.pending.keys(), dtype=np.uint64, count=len(self.pending))
+        locations = np.fromiter(self.pending.values(), dtype=np.int64, count=len(self.pending))
+        order = np.argsort(keys)
+        stem = self.directory / f"run_{len(self.runs):05d}"
+        np.save(f"{stem}_keys.npy", keys[order])
+        np.save(f"{stem}_locations.npy", locations[order])
+        self.runs.append((np.load(f"{stem}_keys.npy", mmap_mode='r'),
+                          np.load(f"{stem}_locations.npy", mmap_mode='r')))
+        self.pending = {}
+
+
+def _accumulator(directory, shard_number, length):
+    """
+    Return zeroed (counts, sums) arrays for one shard, backed by files in directory
+    """
+    stem = Path(directory) / f"merge_{shard_number:05d}"
+    counts = np.lib.format.open_memmap(f"{stem}_counts.npy", mode='w+', dtype=np.uint32, shape=(length,))
+    sums = np.lib.format.open_memmap(f"{stem}_sums.npy", mode='w+', dtype=np.float64, shape=(length,))
+    return counts, sums
+
+
+def _shard_paths(source):
+    if isinstance(source, (list, tuple)):
+        return [Path(path) for path in source]
+    source = Path(source)
+    if source.is_dir():
+        return sorted(source.glob(f"*{RECORD_EXTENSION}"))
+    return [source]
+
+
+def dedup_shards(source, error_rate=DEFAULT_ERROR_RATE, memory_keys=DEFAULT_MEMORY_KEYS, verbose=True):
+    """
+    Flag duplicate positions across record shards in place
+
+    The first occurrence of every position (by Polyglot Zobrist key, in
+    shard order) stays a training sample and gets FLAG_MERGED with the mean
+    result of all occurrences in its score field. Later occurrences get
+    FLAG_DUPLICATE: they remain in the shard as history for the records
+    after them but are skipped by the data loader. Running again on the
+    same shards recomputes the flags from scratch.
+
+    Args:
+        source: Shard directory, file or list of files
+        error_rate: Bloom filter false-positive rate
+        memory_keys: Exact keys kept in memory before spilling to disk
+        verbose: Print the report
+
+    Returns:
+        Dictionary with positions, duplicates, duplicate_rate, distinct,
+        merged, per_ply (list of (positions, duplicates)), seconds
+    """
+    paths = _shard_paths(source)
+    files = [RecordFile(path, writable=True) for path in paths]
+    total = sum(len(record_file) for record_file in files)
+    if verbose:
+        print(f"\n🔁 Deduplicating {total} positions in {len(files)} shards")
+
+    began = time.perf_counter()
+    bloom = BloomFilter(total, error_rate)
+    merged = 0
+    ply_positions = np.zeros(PLY_BUCKETS, dtype=np.int64)
+    ply_duplicates = np.zeros(PLY_BUCKETS, dtype=np.int64)
+    clear = np.uint8(0xFF & ~(FLAG_DUPLICATE | FLAG_MERGED))
+
+    with tempfile.TemporaryDirectory(prefix="dedup_") as spill_dir:
+        seen = SpillKeySet(spill_dir, memory_keys)
+        # Per-shard count and value sum of the later occurrences of each
+        # record, memory-mapped in the spill directory so memory use does not
+        # grow with the number of repeated positions
+        accumulators = {}
+        for shard_number, record_file in enumerate(files):
+            for start in range(0, len(record_file), CHUNK_RECORDS):
+                chunk = record_file.records[start:start + CHUNK_RECORDS]
+                chunk["flags"] &= clear
+                chunk["score"] = 0
+
+                keys = record_keys(chunk)
+                locations = (shard_number << LOCATION_SHIFT) + start + np.arange(len(chunk), dtype=np.int64)
+                unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+                # Only keys the Bloom filter may have seen need the exact set
+                earlier = np.full(len(unique), -1, dtype=np.int64)
+                maybe = bloom.contains(unique)
+                if maybe.any():
+                    earlier[maybe] = seen.get(unique[maybe])
+                new = earlier < 0
+                bloom.add(unique[new])
+                seen.add(unique[new], locations[first[new]])
+
+                owner = np.where(new, locations[first], earlier)
+                duplicate = owner[inverse] != locations
+                chunk["flags"][duplicate] |= np.uint8(FLAG_DUPLICATE)
+
+                plies = np.minimum(chunk["history"], PLY_BUCKETS - 1)
+                ply_positions += np.bincount(plies, minlength=PLY_BUCKETS)
+                ply_duplicates += np.bincount(plies[duplicate], minlength=PLY_BUCKETS)
+
+                if not duplicate.any():
+                    continue
+                groups = inverse[duplicate]
+                counts = np.bincount(groups, minlength=len(unique))
+                sums = np.bincount(groups, weights=chunk["value"][duplicate], minlength=len(unique))
+                repeated = np.flatnonzero(counts)
+                # Distinct keys have distinct owners, so each owner appears once here
+                owners = owner[repeated]
+                owner_shards = owners >> LOCATION_SHIFT
+                for owner_shard in np.unique(owner_shards).tolist():
+                    mine = owner_shards == owner_shard
+                    if owner_shard not in accumulators:
+                        accumulators[owner_shard] = _accumulator(spill_dir, owner_shard, len(files[owner_shard]))
+                    owner_counts, owner_sums = accumulators[owner_shard]
+                    indices = owners[mine] & ((1 << LOCATION_SHIFT) - 1)
+                    owner_counts[indices] += counts[repeated[mine]].astype(np.uint32)
+                    owner_sums[indices] += sums[repeated[mine]]
+        spilled_runs = len(seen.runs)
+        distinct = len(seen)
+
+        # Write the mean result of all occurrences into each first occurrence
+        for shard_number, (owner_counts, owner_sums) in sorted(accumulators.items()):
+            records = files[shard_number].records
+            indices = np.flatnonzero(owner_counts)
+            means = (owner_sums[indices] + records["value"][indices]) / (owner_counts[indices] + 1.0)
+            records["flags"][indices] |= np.uint8(FLAG_MERGED)
+            records["score"][indices] = np.clip(np.rint(means * 100), -100, 100).astype(np.int8)
+            merged += len(indices)
+        del accumulators
+
+    for record_file in files:
+        if len(record_file):
+            record_file.records.flush()
+
+    duplicates = int(ply_duplicates.sum())
+    stats = {
+        "positions": total,
+        "duplicates": duplicates,
+        "duplicate_rate": duplicates / total if total else 0.0,
+        "distinct": distinct,
+        "merged": merged,
+        "per_ply": [(int(count), int(dup)) for count, dup in zip(ply_positions, ply_duplicates)],
+        "spilled_runs": spilled_runs,
+        "bloom_bytes": len(bloom.bits),
+        "seconds": time.perf_counter() - began,
+    }
+    _update_manifest(source, paths, stats)
+
+    if verbose:
+        print_dedup_report(stats)
+    return stats
+
+
+def _update_manifest(source, paths, stats):
+    """
+    Refresh the convert_parallel manifest digests of rewritten shards
+    """
+    if isinstance(source, (list, tuple)) or not Path(source).is_dir():
+        return
+    manifest_path = Path(source) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    for chunk in manifest.get("chunks", []):
+        chunk["sha256"] = _file_digest([Path(source) / name for name in chunk["files"]])
+    manifest["dedup"] = {key: stats[key] for key in ("positions", "duplicates", "distinct", "merged")}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def print_dedup_report(stats):
+    """
+    Print totals and the duplicate rate per ply
+    """
+    print(f"✅ {stats['duplicates']} of {stats['positions']} positions are duplicates "
+          f"({stats['duplicate_rate'] * 100:.1f}%), {stats['distinct']} distinct, "
+          f"{stats['merged']} merged, in {stats['seconds']:.2f}s")
+    print(f"📊 Bloom filter {stats['bloom_bytes'] / (1024*1024):.1f} MB, {stats['spilled_runs']} spilled runs")
+    print("\n   Ply   Positions  Duplicate")
+    per_ply = stats["per_ply"]
+    last = max((ply for ply, (count, _) in enumerate(per_ply) if count), default=-1)
+    ranges = [(ply, ply + 1) for ply in range(min(last + 1, 20))]
+    ranges += [(low, min(low + 20, PLY_BUCKETS)) for low in range(20, last + 1, 20)]
+    for low, high in ranges:
+        count = sum(per_ply[ply][0] for ply in range(low, high))
+        dup = sum(per_ply[ply][1] for ply in range(low, high))
+        label = str(low) if high == low + 1 else f"{low}-{high - 1}" + ("+" if high == PLY_BUCKETS else "")
+        print(f"   {label:>7} {count:9}  {dup / count * 100 if count else 0:8.1f}%")
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else Path("dataset") / "encoded"
+    dedup_shards(source)
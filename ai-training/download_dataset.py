@@ -4,79 +4,125 @@ This script downloads a subset of Lichess games suitable for training
 """
 
 import requests
-import bz2
 import os
+import json
+import shutil
 from pathlib import Path
 
-def download_lichess_games(year_month="2024-10", max_games=10000):
+from artifact_cache import ArtifactCache, materialize
+from parallel_decompress import decompress_parallel, print_decompress_report, StreamDecompressor
+from pgn_scan import open_pgn, iter_game_spans, header_end, header_value, GameSplitter
+from pipeline import Pipeline, EloRange, PgnWriter, StatsCollector, StratifiedSampler
+from telemetry import stage
+
+LICHESS_URL = "https://database.lichess.org/standard/lichess_db_standard_rated_{year_month}.pgn.bz2"
+
+# Network reads are much cheaper in large chunks; 1 MiB keeps the
+# decompressor busy without holding much of the archive in memory.
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Filtered games are copied in large writes rather than line by line
+OUTPUT_BUFFER_SIZE = 4 << 20
+
+
+def download_lichess_games(year_month="2024-10", max_games=10000, stream=False,
+                           chunk_size=DEFAULT_CHUNK_SIZE, url=None, workers=None, cache=None):
     """
     Download Lichess database for a specific month
     
     Args:
         year_month: Format "YYYY-MM" (e.g., "2024-10")
         max_games: Number of games to extract (start small for testing)
+        stream: Decompress while downloading and stop after max_games
+                instead of saving the whole archive first
+        chunk_size: Bytes read from the network per iteration
+        url: Override the archive URL (e.g. a local mirror)
+        workers: Decompression processes for the downloaded archive
+                 (defaults to all cores)
+        cache: ArtifactCache; a sample of the same month and size is then
+               returned from the cache (its path inside the cache), and the
+               downloaded archive is kept there instead of being deleted
     """
+    # Lichess database URL
+    url = url or LICHESS_URL.format(year_month=year_month)
+    sample_name = f"lichess_{year_month}_sample.pgn"
+    
+    if cache is not None:
+        sample_key = cache.key("lichess_sample", [url], max_games=max_games)
+        entry = cache.get(sample_key)
+        if entry is not None:
+            print(f"♻️  Using cached sample of {year_month}: {entry['path']}")
+            return entry["path"]
+    
+    if stream:
+        if cache is None:
+            return stream_lichess_games(year_month, max_games, chunk_size=chunk_size, url=url)
+        staged = stream_lichess_games(year_month, max_games, chunk_size=chunk_size, url=url,
+                                      output_file=cache.staging_path(sample_key, sample_name))
+        return _cache_output(cache, sample_key, staged, "lichess_sample")
     
     # Create directories
     data_dir = Path("dataset")
     data_dir.mkdir(exist_ok=True)
     
-    # Lichess database URL
-    url = f"https://database.lichess.org/standard/lichess_db_standard_rated_{year_month}.pgn.bz2"
-    
-    print(f"📥 Downloading games from {year_month}...")
-    print(f"URL: {url}")
-    print(f"This may take a few minutes depending on your connection...")
-    
     compressed_file = data_dir / f"lichess_{year_month}.pgn.bz2"
-    output_file = data_dir / f"lichess_{year_month}_sample.pgn"
+    output_file = data_dir / sample_name
+    archive = None
+    if cache is not None:
+        archive_key = cache.key("lichess_archive", [url])
+        archive = cache.get(archive_key)
+        output_file = cache.staging_path(sample_key, sample_name)
     
     try:
-        # Download compressed file
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded = 0
-        
-        with open(compressed_file, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        progress = (downloaded / total_size) * 100
-                        print(f"\rDownload progress: {progress:.1f}%", end="")
-        
-        print("\n✅ Download complete!")
+        if archive is not None:
+            compressed_file = archive["path"]
+            print(f"♻️  Using cached archive of {year_month}: {compressed_file}")
+        else:
+            print(f"📥 Downloading games from {year_month}...")
+            print(f"URL: {url}")
+            print(f"This may take a few minutes depending on your connection...")
+            
+            # Download compressed file
+            response = requests.get(url, stream=True)
+            response.raise_for_status()
+            
+            total_size = int(response.headers.get('content-length', 0))
+            downloaded = 0
+            reported = 0
+            
+            with stage("download", total=total_size or None, unit="bytes_in") as metrics, \
+                    open(compressed_file, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        metrics.add(bytes_in=len(chunk), bytes_out=len(chunk))
+                        if total_size > 0 and downloaded * 10 // total_size > reported:
+                            reported = downloaded * 10 // total_size
+                            print(f"Download progress: {reported * 10}%")
+            
+            print("✅ Download complete!")
         
         # Decompress and extract sample
         print(f"\n📦 Extracting {max_games} games...")
         
-        with bz2.open(compressed_file, 'rt', encoding='utf-8') as f_in:
-            with open(output_file, 'w', encoding='utf-8') as f_out:
-                game_count = 0
-                current_game = []
-                
-                for line in f_in:
-                    current_game.append(line)
-                    
-                    # Empty line indicates end of game
-                    if line.strip() == "" and current_game:
-                        if game_count < max_games:
-                            f_out.writelines(current_game)
-                            game_count += 1
-                            
-                            if game_count % 1000 == 0:
-                                print(f"Extracted {game_count} games...")
-                        else:
-                            break
-                        current_game = []
+        with stage("decompress", total=max_games, unit="games_kept") as metrics:
+            stats = decompress_parallel(compressed_file, output_file, max_games=max_games, workers=workers)
+            metrics.add(bytes_in=stats["bytes_in"], bytes_out=stats["bytes_out"],
+                        games_seen=stats["games"], games_kept=stats["games"])
+        print_decompress_report(stats)
+        game_count = stats["games"]
         
         print(f"\n✅ Successfully extracted {game_count} games!")
         print(f"📁 Output file: {output_file}")
         print(f"📊 File size: {output_file.stat().st_size / (1024*1024):.2f} MB")
         
+        if cache is not None:
+            # Keep the archive for other sample sizes; the budget bounds its cost
+            if archive is None and cache.put(archive_key, compressed_file, "lichess_archive") is None:
+                compressed_file.unlink()
+            return _cache_output(cache, sample_key, output_file, "lichess_sample")
+        
         # Clean up compressed file to save space
         if compressed_file.exists():
             compressed_file.unlink()
@@ -89,87 +135,245 @@ def download_lichess_games(year_month="2024-10", max_games=10000):
         return None
 
 
-def filter_high_quality_games(input_file, output_file, min_elo=1800):
+def _cache_output(cache, key, path, stage_name, meta=None):
+    """
+    Move a finished artifact into the cache and return its new path
+    """
+    if path is None:
+        return None
+    entry = cache.put(key, path, stage_name, meta)
+    if entry is None:
+        return path
+    print(f"🗄️  Cached as {entry['path']}")
+    return entry["path"]
+
+
+def stream_lichess_games(year_month="2024-10", max_games=10000, chunk_size=DEFAULT_CHUNK_SIZE,
+                         url=None, output_file=None, max_retries=5, timeout=60, quotas=None, seed=None):
+    """
+    Extract games from a Lichess dump while it downloads
+    
+    The response body is decompressed as it arrives and the connection is
+    closed once max_games games are written, so the compressed archive is
+    never stored. Interrupted transfers are resumed with an HTTP Range
+    request from the first byte not yet received.
+    
+    With quotas the games are not the first max_games of the month but a
+    stratified random sample of everything read (see StratifiedSampler);
+    max_games then caps the games read, and None reads the whole archive.
+    
+    Args:
+        year_month: Format "YYYY-MM" (e.g., "2024-10")
+        max_games: Number of games to extract (games to read when sampling)
+        chunk_size: Bytes read from the network per iteration
+        url: Override the archive URL (e.g. a local mirror)
+        output_file: Output PGN path (defaults to dataset/lichess_{year_month}_sample.pgn)
+        max_retries: Reconnect attempts before giving up
+        timeout: Socket timeout in seconds
+        quotas: Per-stratum sample sizes for StratifiedSampler (int or dict)
+        seed: Random seed of the sample
+    """
+    url = url or LICHESS_URL.format(year_month=year_month)
+    
+    if output_file is None:
+        data_dir = Path("dataset")
+        data_dir.mkdir(exist_ok=True)
+        output_file = data_dir / f"lichess_{year_month}_sample.pgn"
+    output_file = Path(output_file)
+    
+    print(f"📥 Streaming games from {year_month}...")
+    print(f"URL: {url}")
+    
+    decompressor = StreamDecompressor("bz2")
+    splitter = GameSplitter()
+    sampler = StratifiedSampler(quotas, output_file, seed=seed) if quotas is not None else None
+    pipeline = Pipeline(sampler or PgnWriter(output_file, OUTPUT_BUFFER_SIZE))
+    limit = max_games if max_games is not None else float("inf")
+    received = 0
+    retries = 0
+    game_count = 0
+    
+    try:
+        with stage("stream", total=max_games, unit="games_seen") as metrics, requests.Session() as session:
+            
+            def add(game):
+                nonlocal game_count
+                pipeline.feed(game)
+                game_count += 1
+                metrics.add(bytes_out=len(game), games_seen=1, games_kept=0 if sampler else 1)
+            
+            try:
+                while game_count < limit:
+                    headers = {"Range": f"bytes={received}-"} if received else {}
+                    try:
+                        with session.get(url, stream=True, timeout=timeout, headers=headers) as response:
+                            response.raise_for_status()
+                            
+                            # A server that ignores Range resends from byte 0
+                            skip = received if received and response.status_code != 206 else 0
+                            
+                            for chunk in response.iter_content(chunk_size=chunk_size):
+                                if skip:
+                                    if len(chunk) <= skip:
+                                        skip -= len(chunk)
+                                        continue
+                                    chunk = chunk[skip:]
+                                    skip = 0
+                                
+                                received += len(chunk)
+                                metrics.add(bytes_in=len(chunk))
+                                
+                                for game in splitter.feed(decompressor.decompress(chunk)):
+                                    add(game)
+                                    if game_count % 1000 == 0:
+                                        print(f"{'Read' if sampler else 'Extracted'} {game_count} games "
+                                              f"({received / (1024*1024):.1f} MB downloaded)...")
+                                    if game_count >= limit:
+                                        break
+                                
+                                if game_count >= limit:
+                                    break
+                            else:
+                                # Whole archive consumed; keep the final game
+                                game = splitter.flush()
+                                if game is not None:
+                                    add(game)
+                                break
+                    except (requests.ConnectionError, requests.Timeout,
+                            requests.exceptions.ChunkedEncodingError) as e:
+                        retries += 1
+                        metrics.add(retries=1)
+                        if retries > max_retries:
+                            raise
+                        print(f"\n⚠️  Connection interrupted ({e}), resuming from byte {received}...")
+            finally:
+                # Writes the sample when sampling
+                pipeline.close()
+            
+            if sampler:
+                metrics.add(games_kept=sampler.kept, games_dropped=game_count - sampler.kept)
+        
+        if sampler:
+            sampler.report()
+            game_count = sampler.kept
+        
+        print(f"\n✅ Successfully extracted {game_count} games!")
+        print(f"📁 Output file: {output_file}")
+        print(f"📊 Downloaded {received / (1024*1024):.2f} MB compressed")
+        print(f"📊 File size: {output_file.stat().st_size / (1024*1024):.2f} MB")
+        
+        return output_file
+        
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        return None
+
+
+def filter_high_quality_games(input_file, output_file, min_elo=1800, cache=None):
     """
     Filter games to only include high-quality games (higher rated players)
     
+    Only the header block of each game is examined; matching games are
+    copied to the output as raw byte ranges of the memory-mapped input.
+    Statistics of the kept games are gathered in the same pass.
+    
     Args:
         input_file: Input PGN file
         output_file: Output PGN file with filtered games
         min_elo: Minimum ELO rating for both players
+        cache: ArtifactCache; an earlier run on the same input content with
+               the same min_elo is then copied from the cache
+    
+    Returns:
+        StatsCollector describing the filtered games
     """
     print(f"\n🔍 Filtering games (minimum ELO: {min_elo})...")
     
-    with open(input_file, 'r', encoding='utf-8') as f_in:
-        with open(output_file, 'w', encoding='utf-8') as f_out:
-            current_game = []
-            white_elo = 0
-            black_elo = 0
-            filtered_count = 0
-            total_count = 0
-            
-            for line in f_in:
-                current_game.append(line)
-                
-                # Extract ELO ratings
-                if line.startswith('[WhiteElo "'):
-                    try:
-                        white_elo = int(line.split('"')[1])
-                    except:
-                        white_elo = 0
-                        
-                if line.startswith('[BlackElo "'):
-                    try:
-                        black_elo = int(line.split('"')[1])
-                    except:
-                        black_elo = 0
-                
-                # End of game
-                if line.strip() == "" and current_game:
-                    total_count += 1
-                    
-                    # Check if both players meet minimum ELO
-                    if white_elo >= min_elo and black_elo >= min_elo:
-                        f_out.writelines(current_game)
-                        filtered_count += 1
-                    
-                    current_game = []
-                    white_elo = 0
-                    black_elo = 0
-    
-    print(f"✅ Filtered {filtered_count} games out of {total_count} (kept {filtered_count/total_count*100:.1f}%)")
+    stats = StatsCollector()
+    if cache is not None:
+        key = cache.key("filter", [input_file], min_elo=min_elo)
+        entry = cache.get(key)
+        if entry is not None:
+            materialize(entry, output_file)
+            stats.__dict__.update(entry["meta"]["stats"])
+            print(f"♻️  Cached result: {stats.seen} games")
+            print(f"📁 Output file: {output_file}")
+            return stats
+    
+    pipeline = Pipeline(EloRange(min_elo=min_elo), PgnWriter(output_file, OUTPUT_BUFFER_SIZE), stats)
+    with stage("filter") as metrics:
+        filtered_count = pipeline.run(input_file)
+        total_count = pipeline.games_read
+        metrics.add(bytes_in=Path(input_file).stat().st_size, bytes_out=Path(output_file).stat().st_size,
+                    games_seen=total_count, games_kept=filtered_count,
+                    games_dropped=total_count - filtered_count)
+    
+    kept = filtered_count / total_count * 100 if total_count else 0.0
+    print(f"✅ Filtered {filtered_count} games out of {total_count} (kept {kept:.1f}%)")
     print(f"📁 Output file: {output_file}")
+    
+    if cache is not None:
+        staged = cache.staging_path(key, Path(output_file).name)
+        shutil.copyfile(output_file, staged)
+        cache.put(key, staged, "filter", {"stats": vars(stats)})
+    
+    return stats
 
 
-def analyze_dataset(pgn_file):
+def analyze_dataset(pgn_file, cache=None):
     """
     Analyze the dataset and show statistics
+    
+    With an ArtifactCache the statistics of identical content are reused.
     """
     print(f"\n📊 Analyzing dataset: {pgn_file}")
     
-    game_count = 0
-    elo_ratings = []
-    time_controls = {}
+    summary = None
+    if cache is not None:
+        key = cache.key("analysis", [pgn_file])
+        entry = cache.get(key)
+        if entry is not None:
+            summary = entry["meta"]
     
-    with open(pgn_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.startswith('[Event "'):
+    if summary is None:
+        game_count = 0
+        elo_total = 0
+        elo_count = 0
+        elo_min = None
+        elo_max = None
+        time_controls = {}
+        
+        with stage("analyze") as metrics, open_pgn(pgn_file) as buf:
+            for start, end in iter_game_spans(buf):
                 game_count += 1
-            elif line.startswith('[WhiteElo "'):
-                try:
-                    elo = int(line.split('"')[1])
-                    elo_ratings.append(elo)
-                except:
-                    pass
-            elif line.startswith('[TimeControl "'):
-                tc = line.split('"')[1]
-                time_controls[tc] = time_controls.get(tc, 0) + 1
-    
-    print(f"Total games: {game_count}")
-    if elo_ratings:
-        print(f"Average ELO: {sum(elo_ratings) / len(elo_ratings):.0f}")
-        print(f"ELO range: {min(elo_ratings)} - {max(elo_ratings)}")
-    print(f"Time controls: {len(time_controls)} different types")
+                header = buf[start:header_end(buf, start, end)]
+                
+                elo = header_value(header, b"WhiteElo")
+                if elo is not None and elo.isdigit():
+                    elo = int(elo)
+                    elo_total += elo
+                    elo_count += 1
+                    elo_min = elo if elo_min is None else min(elo_min, elo)
+                    elo_max = elo if elo_max is None else max(elo_max, elo)
+                
+                tc = header_value(header, b"TimeControl")
+                if tc is not None:
+                    time_controls[tc] = time_controls.get(tc, 0) + 1
+            metrics.add(bytes_in=len(buf), games_seen=game_count)
+        
+        summary = {"games": game_count, "elo_total": elo_total, "elo_count": elo_count,
+                   "elo_min": elo_min, "elo_max": elo_max, "time_controls": time_controls}
+        if cache is not None:
+            staged = cache.staging_path(key, "analysis.json")
+            with open(staged, 'w', encoding='utf-8') as f:
+                json.dump(summary, f)
+            cache.put(key, staged, "analysis", summary)
+    
+    print(f"Total games: {summary['games']}")
+    if summary["elo_count"]:
+        print(f"Average ELO: {summary['elo_total'] / summary['elo_count']:.0f}")
+        print(f"ELO range: {summary['elo_min']} - {summary['elo_max']}")
+    print(f"Time controls: {len(summary['time_controls'])} different types")
 
 
 if __name__ == "__main__":
@@ -177,13 +381,16 @@ if __name__ == "__main__":
     print("Chess Dataset Download Tool")
     print("=" * 60)
     
+    # Derived files are reused across runs (dataset/cache, 20 GB budget)
+    cache = ArtifactCache()
+    
     # Step 1: Download and extract sample
     # Using August 2024 - you can change to any month
-    pgn_file = download_lichess_games(year_month="2024-08", max_games=10000)
+    pgn_file = download_lichess_games(year_month="2024-08", max_games=10000, stream=True, cache=cache)
     
     if pgn_file:
         # Step 2: Analyze the dataset
-        analyze_dataset(pgn_file)
+        analyze_dataset(pgn_file, cache=cache)
         
         # Step 3: Optional - Filter for high quality games
         print("\n" + "=" * 60)
@@ -191,8 +398,9 @@ if __name__ == "__main__":
         
         if user_input.lower() == 'y':
             filtered_file = Path("dataset") / "lichess_filtered_high_quality.pgn"
-            filter_high_quality_games(pgn_file, filtered_file, min_elo=1800)
-            analyze_dataset(filtered_file)
+            stats = filter_high_quality_games(pgn_file, filtered_file, min_elo=1800, cache=cache)
+            print(f"\n📊 Analyzing dataset: {filtered_file}")
+            stats.report()
             print(f"\n✅ Use this file for training: {filtered_file}")
         else:
             print(f"\n✅ Use this file for training: {pgn_file}")
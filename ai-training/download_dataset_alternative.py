@@ -3,10 +3,17 @@ Alternative dataset download using smaller, more reliable sources
 """
 
 import requests
-import gzip
 import os
 from pathlib import Path
 
+from parallel_decompress import StreamDecompressor, decompress_parallel, print_decompress_report
+from pgn_scan import open_pgn, iter_game_spans, GameSplitter
+from telemetry import stage
+
+# Network reads per iteration; large reads keep the decompressor busy
+CHUNK_SIZE = 1 << 20
+
+
 def download_ficsgames_sample():
     """
     Download a sample from FICS Games Database - smaller and more reliable
@@ -37,43 +44,34 @@ def download_ficsgames_sample():
         
         total_size = int(response.headers.get('content-length', 0))
         downloaded = 0
+        reported = 0
         
         print("\nDownload progress:")
-        with open(compressed_file, 'wb') as f:
+        with stage("download", total=total_size or None, unit="bytes_in") as metrics, \
+                open(compressed_file, 'wb') as f:
             for chunk in response.iter_content(chunk_size=8192):
                 if chunk:
                     f.write(chunk)
                     downloaded += len(chunk)
-                    if total_size > 0:
-                        progress = (downloaded / total_size) * 100
+                    metrics.add(bytes_in=len(chunk), bytes_out=len(chunk))
+                    if total_size > 0 and downloaded * 10 // total_size > reported:
+                        reported = downloaded * 10 // total_size
                         mb_downloaded = downloaded / (1024 * 1024)
                         mb_total = total_size / (1024 * 1024)
-                        print(f"\r  {progress:.1f}% ({mb_downloaded:.1f} MB / {mb_total:.1f} MB)", end="")
+                        print(f"  {reported * 10}% ({mb_downloaded:.1f} MB / {mb_total:.1f} MB)")
         
-        print("\n✅ Download complete!")
+        print("✅ Download complete!")
         
         # Decompress
         print("\n📦 Decompressing files...")
         
-        with gzip.open(compressed_file, 'rt', encoding='utf-8', errors='ignore') as f_in:
-            with open(output_file, 'w', encoding='utf-8') as f_out:
-                game_count = 0
-                max_games = 10000  # Extract first 10,000 games
-                current_game = []
-                
-                for line in f_in:
-                    current_game.append(line)
-                    
-                    if line.strip() == "" and current_game:
-                        if game_count < max_games:
-                            f_out.writelines(current_game)
-                            game_count += 1
-                            
-                            if game_count % 1000 == 0:
-                                print(f"  Extracted {game_count} games...")
-                        else:
-                            break
-                        current_game = []
+        max_games = 10000  # Extract first 10,000 games
+        with stage("decompress", total=max_games, unit="games_kept") as metrics:
+            stats = decompress_parallel(compressed_file, output_file, max_games=max_games)
+            metrics.add(bytes_in=stats["bytes_in"], bytes_out=stats["bytes_out"],
+                        games_seen=stats["games"], games_kept=stats["games"])
+        print_decompress_report(stats)
+        game_count = stats["games"]
         
         print(f"\n✅ Successfully extracted {game_count} games!")
         print(f"📁 Output file: {output_file}")
@@ -113,8 +111,6 @@ def download_lichess_elite_games():
     output_file = data_dir / "chess_training_dataset.pgn"
     
     try:
-        import bz2
-        
         print(f"Downloading from: {url}")
         response = requests.get(url, stream=True, timeout=60)
         response.raise_for_status()
@@ -122,40 +118,48 @@ def download_lichess_elite_games():
         # Download and decompress in chunks
         print("\nDownloading and processing...")
         
-        with open(output_file, 'w', encoding='utf-8') as f_out:
-            decompressor = bz2.BZ2Decompressor()
+        max_games = 5000  # Elite games are higher quality, need fewer
+        with stage("elite", total=max_games, unit="games_kept") as metrics, \
+                open(output_file, 'wb') as f_out:
+            # Follows every concatenated bz2 stream of the archive
+            decompressor = StreamDecompressor("bz2")
+            splitter = GameSplitter()
             game_count = 0
-            max_games = 5000  # Elite games are higher quality, need fewer
-            current_game = []
-            buffer = ""
             
-            for chunk in response.iter_content(chunk_size=8192):
+            def write_game(game):
+                # Decoding once per game only validates it; the bytes are
+                # written unchanged. Games are cut at ASCII boundaries, so
+                # a multi-byte character is never split between two games.
+                try:
+                    game.decode('utf-8')
+                except UnicodeDecodeError:
+                    metrics.add(games_seen=1, games_malformed=1)
+                    return 0
+                f_out.write(game)
+                metrics.add(bytes_out=len(game), games_seen=1, games_kept=1)
+                return 1
+            
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
                 if chunk:
-                    try:
-                        decompressed = decompressor.decompress(chunk).decode('utf-8', errors='ignore')
-                        buffer += decompressed
-                        
-                        lines = buffer.split('\n')
-                        buffer = lines[-1]  # Keep incomplete line
-                        
-                        for line in lines[:-1]:
-                            current_game.append(line + '\n')
-                            
-                            if line.strip() == "" and current_game:
-                                if game_count < max_games:
-                                    f_out.writelines(current_game)
-                                    game_count += 1
-                                    
-                                    if game_count % 500 == 0:
-                                        print(f"  Extracted {game_count} elite games...")
-                                else:
-                                    break
-                                current_game = []
-                        
+                    # A corrupt stream raises OSError here; it ends the
+                    # stage with an error instead of silently losing games
+                    metrics.add(bytes_in=len(chunk))
+                    for game in splitter.feed(decompressor.decompress(chunk)):
+                        if write_game(game):
+                            game_count += 1
+                            if game_count % 500 == 0:
+                                print(f"  Extracted {game_count} elite games...")
                         if game_count >= max_games:
                             break
-                    except:
-                        continue
+                    
+                    if game_count >= max_games:
+                        break
+            
+            # End of the archive; the last game has no boundary after it
+            if game_count < max_games:
+                game = splitter.flush()
+                if game is not None:
+                    game_count += write_game(game)
         
         print(f"\n✅ Successfully extracted {game_count} elite games!")
         print(f"📁 Output file: {output_file}")
@@ -227,10 +231,10 @@ def analyze_dataset(pgn_file):
     game_count = 0
     
     try:
-        with open(pgn_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.startswith('[Event '):
-                    game_count += 1
+        with stage("analyze") as metrics, open_pgn(pgn_file) as buf:
+            for _ in iter_game_spans(buf):
+                game_count += 1
+            metrics.add(bytes_in=len(buf), games_seen=game_count)
         
         print(f"✅ Total games: {game_count}")
         print(f"✅ File location: {pgn_file}")
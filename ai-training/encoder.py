@@ -0,0 +1,306 @@
+"""
+Encode PGN games into 119x8x8 network input planes
+Produces the input, 1858-way policy target and value target used by ChessNet
+"""
+
+import chess
+import numpy as np
+
+from pgn_scan import header_end, header_value, result_code, COMMENT_RE, VARIATION_RE, SAN_RE
+
+ENCODER_VERSION = 1
+
+HISTORY_STEPS = 8
+PLANES_PER_STEP = 14          # 12 piece planes + 2 repetition planes
+NUM_PLANES = 119              # 8 * 14 history planes + 7 constant planes
+POLICY_SIZE = 1858
+
+# Piece plane order within a history step, matching boardToInput in
+# client/src/services/customai.ts (black pieces first, then white)
+PIECE_ORDER = [(color, piece_type)
+               for color in (chess.BLACK, chess.WHITE)
+               for piece_type in (chess.PAWN, chess.KNIGHT, chess.BISHOP,
+                                  chess.ROOK, chess.QUEEN, chess.KING)]
+
+# Constant planes after the 112 history planes
+PLANE_SIDE_TO_MOVE = 112      # 1 when white is to move
+PLANE_MOVE_COUNT = 113        # full move number * MOVE_COUNT_SCALE
+PLANE_CASTLING = 114          # white O-O, white O-O-O, black O-O, black O-O-O
+PLANE_RULE50 = 118            # halfmove clock * RULE50_SCALE
+
+MOVE_COUNT_SCALE = 1 / 200
+RULE50_SCALE = 1 / 100
+
+# Plane rows run from rank 8 to rank 1, as in chess.js board() output
+RANK_FLIP = slice(None, None, -1)
+
+
+def _build_policy_moves():
+    """
+    Enumerate the 1858 policy moves in LC0's style
+
+    Every queen-line and knight move between two squares gets one index,
+    plus queen/rook/bishop promotions from the 7th to the 8th rank. Knight
+    promotions reuse the plain from-to index. Moves are always expressed
+    from the side to move's point of view (black moves are mirrored).
+    """
+    moves = []
+    for from_square in chess.SQUARES:
+        from_file, from_rank = chess.square_file(from_square), chess.square_rank(from_square)
+        for to_square in chess.SQUARES:
+            if to_square == from_square:
+                continue
+            to_file, to_rank = chess.square_file(to_square), chess.square_rank(to_square)
+            df, dr = abs(to_file - from_file), abs(to_rank - from_rank)
+            if df == 0 or dr == 0 or df == dr or (df, dr) in ((1, 2), (2, 1)):
+                uci = chess.square_name(from_square) + chess.square_name(to_square)
+                moves.append(uci)
+                if from_rank == 6 and to_rank == 7 and df <= 1:
+                    moves.extend(uci + piece for piece in "qrb")
+    return moves
+
+
+POLICY_MOVES = _build_policy_moves()
+POLICY_INDEX = {uci: index for index, uci in enumerate(POLICY_MOVES)}
+assert len(POLICY_MOVES) == POLICY_SIZE
+
+
+def policy_index(move, turn):
+    """
+    Return the policy index of a chess.Move played by the given side
+    """
+    from_square, to_square = move.from_square, move.to_square
+    if turn == chess.BLACK:
+        from_square = chess.square_mirror(from_square)
+        to_square = chess.square_mirror(to_square)
+    uci = chess.square_name(from_square) + chess.square_name(to_square)
+    if move.promotion and move.promotion != chess.KNIGHT:
+        uci += chess.piece_symbol(move.promotion)
+    return POLICY_INDEX[uci]
+
+
+def policy_move(index, board):
+    """
+    Return the chess.Move for a policy index in the given position
+    """
+    uci = POLICY_MOVES[index]
+    from_square = chess.parse_square(uci[0:2])
+    to_square = chess.parse_square(uci[2:4])
+    if board.turn == chess.BLACK:
+        from_square = chess.square_mirror(from_square)
+        to_square = chess.square_mirror(to_square)
+    promotion = chess.Piece.from_symbol(uci[4]).piece_type if len(uci) == 5 else None
+    if promotion is None and board.piece_type_at(from_square) == chess.PAWN \
+            and chess.square_rank(to_square) in (0, 7):
+        promotion = chess.KNIGHT
+    return chess.Move(from_square, to_square, promotion)
+
+
+def board_bitboards(board):
+    """
+    Return the 12 piece bitboards of a board in PIECE_ORDER
+    """
+    black, white = board.occupied_co[chess.BLACK], board.occupied_co[chess.WHITE]
+    pawns, knights, bishops = board.pawns, board.knights, board.bishops
+    rooks, queens, kings = board.rooks, board.queens, board.kings
+    return (pawns & black, knights & black, bishops & black, rooks & black, queens & black, kings & black,
+            pawns & white, knights & white, bishops & white, rooks & white, queens & white, kings & white)
+
+
+def board_scalars(board):
+    """
+    Return the 7 constant-plane values of a board (unscaled)
+    """
+    return (
+        1 if board.turn == chess.WHITE else 0,
+        board.fullmove_number,
+        board.has_kingside_castling_rights(chess.WHITE),
+        board.has_queenside_castling_rights(chess.WHITE),
+        board.has_kingside_castling_rights(chess.BLACK),
+        board.has_queenside_castling_rights(chess.BLACK),
+        board.halfmove_clock,
+    )
+
+
+def game_positions(board, moves, value):
+    """
+    Replay moves and collect the compact state of every position
+
+    Args:
+        board: chess.Board at the start of the game (modified in place)
+        moves: Iterable of SAN strings or chess.Move objects
+        value: Game result from white's point of view (1, 0, -1)
+
+    Returns:
+        Dictionary of NumPy arrays, one row per position before each move:
+        bitboards (n+1, 12) including the final position, repetitions
+        (n+1,), scalars (n, 7), ep_square (n,), policy (n,) and value (n,)
+    """
+    bitboards = [board_bitboards(board)]
+    repetitions = [0]
+    seen = {(bitboards[0], board.turn, board.castling_rights, board.ep_square): 1}
+    scalars = []
+    ep_squares = []
+    policy = []
+    values = []
+
+    for move in moves:
+        if isinstance(move, str):
+            move = board.parse_san(move)
+        turn = board.turn
+        scalars.append(board_scalars(board))
+        ep_squares.append(-1 if board.ep_square is None else board.ep_square)
+        policy.append(policy_index(move, turn))
+        values.append(value if turn == chess.WHITE else -value)
+
+        board.push(move)
+        pieces = board_bitboards(board)
+        key = (pieces, board.turn, board.castling_rights, board.ep_square)
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        bitboards.append(pieces)
+        repetitions.append(min(count, 2))
+
+    return {
+        "bitboards": np.array(bitboards, dtype=np.uint64),
+        "repetitions": np.array(repetitions, dtype=np.uint8),
+        "scalars": np.array(scalars, dtype=np.uint16).reshape(-1, 7),
+        "ep_square": np.array(ep_squares, dtype=np.int8),
+        "policy": np.array(policy, dtype=np.int16),
+        "value": np.array(values, dtype=np.int8),
+    }
+
+
+def history_indices(count, history=HISTORY_STEPS):
+    """
+    Return (count, history) row indices into a game's position array
+
+    Row t of the result lists positions t, t-1, ..., t-7; -1 marks
+    steps before the start of the game.
+    """
+    steps = np.arange(count)[:, None] - np.arange(history)[None, :]
+    steps[steps < 0] = -1
+    return steps
+
+
+def planes_from_features(history_bitboards, history_repetitions, scalars, dtype=np.float32):
+    """
+    Expand compact position features into input planes in bulk
+
+    Args:
+        history_bitboards: (N, 8, 12) uint64, zero for missing history
+        history_repetitions: (N, 8) uint8 repetition counts (0-2)
+        scalars: (N, 7) unscaled constant-plane values
+        dtype: Output dtype
+
+    Returns:
+        (N, 119, 8, 8) array
+    """
+    count = len(history_bitboards)
+    planes = np.zeros((count, NUM_PLANES, 8, 8), dtype=dtype)
+
+    # Little-endian bit order turns each uint64 into squares a1..h8
+    bits = np.unpackbits(
+        np.ascontiguousarray(history_bitboards, dtype="<u8").view(np.uint8).reshape(count, HISTORY_STEPS, 12, 8),
+        axis=-1, bitorder='little',
+    ).reshape(count, HISTORY_STEPS, 12, 8, 8)[:, :, :, RANK_FLIP, :]
+
+    steps = planes[:, :HISTORY_STEPS * PLANES_PER_STEP].reshape(count, HISTORY_STEPS, PLANES_PER_STEP, 8, 8)
+    steps[:, :, :12] = bits
+    steps[:, :, 12] = (history_repetitions >= 1)[:, :, None, None]
+    steps[:, :, 13] = (history_repetitions >= 2)[:, :, None, None]
+
+    scalars = np.asarray(scalars, dtype=np.float32)
+    planes[:, PLANE_SIDE_TO_MOVE] = scalars[:, 0, None, None]
+    planes[:, PLANE_MOVE_COUNT] = (scalars[:, 1] * MOVE_COUNT_SCALE)[:, None, None]
+    planes[:, PLANE_CASTLING:PLANE_CASTLING + 4] = scalars[:, 2:6, None, None]
+    planes[:, PLANE_RULE50] = (scalars[:, 6] * RULE50_SCALE)[:, None, None]
+    return planes
+
+
+def encode_positions(positions, dtype=np.float32):
+    """
+    Turn the output of game_positions into (planes, policy, value)
+    """
+    count = len(positions["policy"])
+    rows = history_indices(count)
+    valid = rows >= 0
+
+    history_bitboards = positions["bitboards"][rows]
+    history_bitboards[~valid] = 0
+    history_repetitions = positions["repetitions"][rows]
+    history_repetitions[~valid] = 0
+
+    planes = planes_from_features(history_bitboards, history_repetitions, positions["scalars"], dtype)
+    return planes, positions["policy"], positions["value"]
+
+
+def encode_board(board, dtype=np.float32):
+    """
+    Encode a single chess.Board, using its move stack as history
+
+    Returns:
+        (119, 8, 8) array
+    """
+    positions = game_positions(board.root(), board.move_stack, 0)
+    rows = len(board.move_stack) - np.arange(HISTORY_STEPS)
+    valid = rows >= 0
+
+    bitboards = np.zeros((1, HISTORY_STEPS, 12), dtype=np.uint64)
+    repetitions = np.zeros((1, HISTORY_STEPS), dtype=np.uint8)
+    bitboards[0, valid] = positions["bitboards"][rows[valid]]
+    repetitions[0, valid] = positions["repetitions"][rows[valid]]
+    return planes_from_features(bitboards, repetitions, np.array([board_scalars(board)]), dtype)[0]
+
+
+def movetext_sans(movetext):
+    """
+    Return the mainline SAN tokens of a movetext block
+    """
+    movetext = COMMENT_RE.sub(b" ", movetext)
+    while b"(" in movetext:
+        stripped = VARIATION_RE.sub(b" ", movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+    return [token.decode('ascii') for token in SAN_RE.findall(movetext)]
+
+
+def iter_encoded_games(buf, spans, stats=None):
+    """
+    Yield game_positions() output for each decodable game with a result
+
+    Games without a 1-0/0-1/1/2-1/2 result, with illegal moves or
+    without moves are skipped.
+
+    Args:
+        buf: bytes or mmap holding PGN text
+        spans: Iterable of (start, end) game byte ranges
+        stats: Optional dict updated with "games" and "skipped" counts
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("games", 0)
+    stats.setdefault("skipped", 0)
+
+    for start, end in spans:
+        split = header_end(buf, start, end)
+        header = buf[start:split]
+        value = result_code(header_value(header, b"Result"))
+        if value is None:
+            stats["skipped"] += 1
+            continue
+
+        fen = header_value(header, b"FEN")
+        try:
+            board = chess.Board(fen) if fen else chess.Board()
+            positions = game_positions(board, movetext_sans(buf[split:end]), value)
+        except ValueError:
+            stats["skipped"] += 1
+            continue
+        if len(positions["policy"]) == 0:
+            stats["skipped"] += 1
+            continue
+
+        stats["games"] += 1
+        yield positions
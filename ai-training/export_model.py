@@ -0,0 +1,283 @@
+"""
+ONNX export of ChessNet with graph-optimized and int8-quantized variants
+Checks every variant against the float model and reports its size and CPU latency
+"""
+
+import inspect
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+import torch
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                      quantize_dynamic, quantize_static)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from data_loader import find_shards
+from encoder import NUM_PLANES, encode_positions, iter_encoded_games
+from pgn_scan import open_pgn, iter_game_spans, detect_boundary
+from record_format import RecordFile
+from train import ChessNet
+
+OPSET = 17
+MODEL_NAME = "chess_model_web"
+REPORT_NAME = "export_report.json"
+
+DEFAULT_CALIBRATION_POSITIONS = 512
+DEFAULT_EVAL_POSITIONS = 1024
+CALIBRATION_BATCH = 32
+
+# A variant is accepted when it stays this close to the float model
+VALUE_TOLERANCE = 0.02            # mean absolute value error
+POLICY_TOP1_AGREEMENT = 0.95      # share of positions with the same best policy index
+
+LATENCY_RUNS = 50
+THROUGHPUT_BATCH = 64
+
+
+def load_positions(source, count, seed=0, skip=0):
+    """
+    Return (count, 119, 8, 8) float32 planes of real positions
+
+    Args:
+        source: Record shard directory/file or a PGN file
+        count: Positions to return
+        seed: Sampling seed for shards
+        skip: Positions to pass over first (keeps evaluation and
+              calibration sets disjoint)
+    """
+    source = Path(source)
+    if source.is_dir() or source.suffix == ".rec":
+        files = [RecordFile(path) for path in find_shards(source)]
+        sizes = np.array([len(record_file) for record_file in files])
+        picks = np.random.default_rng(seed).permutation(int(sizes.sum()))[skip:skip + count]
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+        planes = []
+        for number, record_file in enumerate(files):
+            mine = np.sort(picks[(picks >= bounds[number]) & (picks < bounds[number + 1])]) - bounds[number]
+            if len(mine):
+                planes.append(record_file.batch(mine)[0])
+        return np.concatenate(planes)[:count]
+
+    planes = []
+    total = 0
+    with open_pgn(source) as buf:
+        spans = iter_game_spans(buf, boundary=detect_boundary(buf))
+        for positions in iter_encoded_games(buf, spans):
+            game_planes = encode_positions(positions)[0]
+            planes.append(game_planes)
+            total += len(game_planes)
+            if total >= skip + count:
+                break
+    return np.concatenate(planes)[skip:skip + count]
+
+
+class _PositionReader(CalibrationDataReader):
+    """
+    Feed calibration positions to quantize_static in small batches
+    """
+
+    def __init__(self, input_name, planes):
+        self.batches = iter([{input_name: planes[start:start + CALIBRATION_BATCH]}
+                             for start in range(0, len(planes), CALIBRATION_BATCH)])
+
+    def get_next(self):
+        return next(self.batches, None)
+
+
+def export_onnx(model, path):
+    """
+    Export a ChessNet to ONNX with a dynamic batch axis
+    """
+    model.eval()
+    example = torch.zeros(1, NUM_PLANES, 8, 8)
+    options = {}
+    # torch 2.5+ has a dynamo exporter (the default in recent releases);
+    # keep the TorchScript one, which older versions only have
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        options["dynamo"] = False
+    torch.onnx.export(
+        model, example, str(path),
+        export_params=True,
+        opset_version=OPSET,
+        do_constant_folding=True,
+        input_names=["input"],
+        output_names=["policy", "value"],
+        dynamic_axes={"input": {0: "batch"}, "policy": {0: "batch"}, "value": {0: "batch"}},
+        **options,
+    )
+    return path
+
+
+def optimize_graph(source, path):
+    """
+    Save onnxruntime's graph-optimized model
+
+    Only the portable (basic) rewrites are applied, so the file still runs
+    on every execution provider, including onnxruntime-web.
+    """
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    options.optimized_model_filepath = str(path)
+    ort.InferenceSession(str(source), options, providers=["CPUExecutionProvider"])
+    return path
+
+
+def _session(path):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+
+def compare_to_reference(session, planes, reference_policy, reference_value):
+    """
+    Return agreement metrics of an ONNX session with the float model's outputs
+    """
+    policy, value = session.run(None, {"input": planes})
+    value = value.reshape(-1)
+    shifted = policy - policy.max(axis=1, keepdims=True)
+    probabilities = np.exp(shifted) / np.exp(shifted).sum(axis=1, keepdims=True)
+    shifted = reference_policy - reference_policy.max(axis=1, keepdims=True)
+    reference_probabilities = np.exp(shifted) / np.exp(shifted).sum(axis=1, keepdims=True)
+    return {
+        "value_mean_error": float(np.abs(value - reference_value).mean()),
+        "value_max_error": float(np.abs(value - reference_value).max()),
+        "policy_top1_agreement": float((policy.argmax(axis=1) == reference_policy.argmax(axis=1)).mean()),
+        "policy_max_prob_error": float(np.abs(probabilities - reference_probabilities).max()),
+    }
+
+
+def measure_latency(session, planes, runs=LATENCY_RUNS, batch=THROUGHPUT_BATCH):
+    """
+    Return single-position latency percentiles and batched throughput
+    """
+    single = planes[:1]
+    for _ in range(3):
+        session.run(None, {"input": single})
+    latencies = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        session.run(None, {"input": single})
+        latencies.append(time.perf_counter() - began)
+
+    batched = planes[:batch]
+    session.run(None, {"input": batched})
+    began = time.perf_counter()
+    repeats = max(1, runs // 10)
+    for _ in range(repeats):
+        session.run(None, {"input": batched})
+    elapsed = time.perf_counter() - began
+    return {
+        "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "latency_p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "batch_positions_per_s": len(batched) * repeats / elapsed,
+    }
+
+
+def export_variants(checkpoint, positions_source, output_dir=Path("models"),
+                    calibration_positions=DEFAULT_CALIBRATION_POSITIONS, eval_positions=DEFAULT_EVAL_POSITIONS,
+                    value_tolerance=VALUE_TOLERANCE, top1_agreement=POLICY_TOP1_AGREEMENT, verbose=True):
+    """
+    Export fp32, graph-optimized, dynamic int8 and static int8 models and compare them
+
+    Static quantization is calibrated on real positions; every variant
+    is then scored on a disjoint set of positions against the PyTorch
+    float model and timed on the CPU.
+
+    Args:
+        checkpoint: ChessNet state_dict (.pth) from train.py or the notebook
+        positions_source: Record shards or a PGN providing real positions
+        output_dir: Directory for the .onnx files and export_report.json
+        calibration_positions: Positions used to calibrate static quantization
+        eval_positions: Positions used to check agreement
+        value_tolerance: Largest accepted mean absolute value error
+        top1_agreement: Smallest accepted share of identical best policy indices
+        verbose: Print the report
+
+    Returns:
+        The report dictionary, with a "recommended" variant name
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    model = ChessNet()
+    model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+    model.eval()
+
+    evaluation = load_positions(positions_source, eval_positions, seed=1)
+    calibration = load_positions(positions_source, calibration_positions, seed=1, skip=eval_positions)
+    with torch.no_grad():
+        reference_policy, reference_value = model(torch.from_numpy(evaluation))
+    reference_policy = reference_policy.numpy()
+    reference_value = reference_value.numpy().reshape(-1)
+
+    if verbose:
+        print(f"\n📦 Exporting {checkpoint} ({len(calibration)} calibration, {len(evaluation)} evaluation positions)")
+
+    fp32 = export_onnx(model, output_dir / f"{MODEL_NAME}.onnx")
+    variants = {"fp32": fp32, "fp32_optimized": optimize_graph(fp32, output_dir / f"{MODEL_NAME}.opt.onnx")}
+
+    # Quantizers want shape information on every tensor
+    prepared = output_dir / f"{MODEL_NAME}.prep.onnx"
+    quant_pre_process(str(fp32), str(prepared))
+    try:
+        variants["int8_dynamic"] = output_dir / f"{MODEL_NAME}.int8_dynamic.onnx"
+        quantize_dynamic(str(prepared), str(variants["int8_dynamic"]), weight_type=QuantType.QInt8,
+                         per_channel=True)
+        variants["int8_static"] = output_dir / f"{MODEL_NAME}.int8_static.onnx"
+        quantize_static(str(prepared), str(variants["int8_static"]), _PositionReader("input", calibration),
+                        quant_format=QuantFormat.QDQ, per_channel=True, activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8, calibrate_method=CalibrationMethod.MinMax)
+    finally:
+        prepared.unlink(missing_ok=True)
+
+    report = {"checkpoint": str(checkpoint), "positions": str(positions_source), "opset": OPSET,
+              "value_tolerance": value_tolerance, "top1_agreement": top1_agreement, "variants": {}}
+    for name, path in variants.items():
+        session = _session(path)
+        entry = {"path": str(path), "size_mb": path.stat().st_size / (1024 * 1024)}
+        entry.update(compare_to_reference(session, evaluation, reference_policy, reference_value))
+        entry.update(measure_latency(session, evaluation))
+        entry["accepted"] = entry["value_mean_error"] <= value_tolerance and \
+            entry["policy_top1_agreement"] >= top1_agreement
+        report["variants"][name] = entry
+
+    accepted = [name for name, entry in report["variants"].items() if entry["accepted"]]
+    report["recommended"] = min(accepted, key=lambda name: report["variants"][name]["latency_p50_ms"]) \
+        if accepted else None
+
+    with open(output_dir / REPORT_NAME, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    if verbose:
+        print_export_report(report)
+        print(f"📁 Report: {output_dir / REPORT_NAME}")
+    return report
+
+
+def print_export_report(report):
+    """
+    Print size, latency and agreement of every variant
+    """
+    print(f"\n   {'Variant':<16}{'Size MB':>9}{'p50 ms':>9}{'p99 ms':>9}{'pos/s':>9}"
+          f"{'top-1':>8}{'value err':>11}")
+    for name, entry in report["variants"].items():
+        marker = "✅" if entry["accepted"] else "❌"
+        print(f"{marker} {name:<16}{entry['size_mb']:9.1f}{entry['latency_p50_ms']:9.2f}"
+              f"{entry['latency_p99_ms']:9.2f}{entry['batch_positions_per_s']:9.0f}"
+              f"{entry['policy_top1_agreement'] * 100:7.1f}%{entry['value_mean_error']:11.4f}")
+    if report["recommended"]:
+        print(f"\n🏆 Recommended: {report['recommended']} ({report['variants'][report['recommended']]['path']})")
+    else:
+        print("\n⚠️  No variant is within tolerance")
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    checkpoint = args[0] if args else "chess_model_trained.pth"
+    source = args[1] if len(args) > 1 else Path("dataset") / "sample_training_dataset.pgn"
+    output_dir = next((arg.split("=", 1)[1] for arg in sys.argv[1:] if arg.startswith("--output=")), "models")
+    report = export_variants(checkpoint, source, output_dir)
+    sys.exit(0 if report["recommended"] else 1)
@@ -4,138 +4,209 @@ This creates synthetic but realistic chess games
 """
 
 import chess
-import chess.pgn
+import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from datetime import datetime, timedelta
 
-def generate_sample_games(num_games=1000):
+from pgn_scan import open_pgn, iter_game_spans, header_end, header_value, count_plies
+from telemetry import stage
+
+# Common opening moves for variety
+OPENING_SEQUENCES = [
+    # Italian Game
+    ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4"],
+    # Sicilian Defense
+    ["e2e4", "c7c5", "g1f3", "d7d6", "d2d4", "c5d4"],
+    # French Defense
+    ["e2e4", "e7e6", "d2d4", "d7d5"],
+    # Caro-Kann
+    ["e2e4", "c7c6", "d2d4", "d7d5"],
+    # Queen's Gambit
+    ["d2d4", "d7d5", "c2c4"],
+    # King's Indian
+    ["d2d4", "g8f6", "c2c4", "g7g6"],
+    # English Opening
+    ["c2c4", "e7e5"],
+    # Ruy Lopez
+    ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5"],
+]
+
+TIME_CONTROLS = ["180+0", "300+0", "600+0", "900+10"]
+
+# Dates are drawn from the year before this day so a seed always
+# produces the same file, whenever it is run
+DEFAULT_BASE_DATE = datetime(2025, 1, 1)
+
+GAMES_PER_TASK = 1000
+
+
+def _game_over(board, legal_moves):
+    """
+    Cheap equivalent of board.is_game_over() for a position whose legal moves are known
+
+    Fivefold repetition needs 16 reversible plies, so the move stack is
+    only replayed when the halfmove clock allows it.
+    """
+    return (not legal_moves
+            or board.is_insufficient_material()
+            or board.is_seventyfive_moves()
+            or (board.halfmove_clock >= 16 and board.is_fivefold_repetition()))
+
+
+def generate_game(rng, base_date=DEFAULT_BASE_DATE):
+    """
+    Generate one synthetic game as PGN text
+    
+    Args:
+        rng: random.Random instance driving every choice in the game
+        base_date: Games are dated within the year before this date
+    """
+    date = base_date - timedelta(days=rng.randint(0, 365))
+    round_number = rng.randint(1, 10)
+    white = f"Player{rng.randint(1000, 9999)}"
+    black = f"Player{rng.randint(1000, 9999)}"
+    
+    # Random ELO ratings (1400-2200)
+    white_elo = rng.randint(1400, 2200)
+    black_elo = rng.randint(1400, 2200)
+    time_control = rng.choice(TIME_CONTROLS)
+    
+    board = chess.Board()
+    sans = []
+    
+    # Start with a random opening
+    for uci_move in rng.choice(OPENING_SEQUENCES):
+        sans.append(board.san_and_push(chess.Move.from_uci(uci_move)))
+    
+    # Continue with random legal moves (weighted towards good moves)
+    move_count = 0
+    max_moves = rng.randint(30, 80)
+    
+    while move_count < max_moves:
+        legal_moves = list(board.legal_moves)
+        if _game_over(board, legal_moves):
+            break
+        
+        # Captures and checks are only generated when the dice ask for them
+        move = None
+        # 30% chance to make a capture if available
+        if rng.random() < 0.3:
+            captures = list(board.generate_legal_captures())
+            if captures:
+                move = rng.choice(captures)
+        # 20% chance to make a check if available
+        if move is None and rng.random() < 0.2:
+            checks = [m for m in legal_moves if board.gives_check(m)]
+            if checks:
+                move = rng.choice(checks)
+        # Otherwise random legal move
+        if move is None:
+            move = rng.choice(legal_moves)
+        
+        sans.append(board.san_and_push(move))
+        move_count += 1
+        
+        # Small chance to end game early (resignation)
+        if move_count > 15 and rng.random() < 0.05:
+            break
+    
+    # Determine result
+    if board.is_checkmate():
+        result = "0-1" if board.turn == chess.WHITE else "1-0"
+    elif board.is_stalemate() or board.is_insufficient_material():
+        result = "1/2-1/2"
+    elif move_count >= max_moves:
+        # Timeout or random result
+        result = rng.choice(["1-0", "0-1", "1/2-1/2"])
+    else:
+        # Resignation
+        result = rng.choice(["1-0", "0-1"])
+    
+    moves = []
+    for ply, san in enumerate(sans):
+        if ply % 2 == 0:
+            moves.append(f"{ply // 2 + 1}. {san}")
+        else:
+            moves.append(san)
+    
+    return (
+        f'[Event "Sample Training Game"]\n'
+        f'[Site "Training Dataset"]\n'
+        f'[Date "{date.strftime("%Y.%m.%d")}"]\n'
+        f'[Round "{round_number}"]\n'
+        f'[White "{white}"]\n'
+        f'[Black "{black}"]\n'
+        f'[Result "{result}"]\n'
+        f'[WhiteElo "{white_elo}"]\n'
+        f'[BlackElo "{black_elo}"]\n'
+        f'[TimeControl "{time_control}"]\n'
+        f'\n'
+        f'{" ".join(moves)} {result}\n\n'
+    )
+
+
+def _generate_batch(seed, first_game, count, base_date):
+    """
+    Generate games first_game .. first_game + count - 1 (runs in a worker)
+    
+    Every game has its own RNG derived from (seed, game number), so the
+    output does not depend on how games are split between workers.
+    """
+    return "".join(generate_game(random.Random(f"{seed}:{number}"), base_date)
+                   for number in range(first_game, first_game + count))
+
+
+def generate_sample_games(num_games=1000, output_file=None, workers=None, seed=None,
+                          base_date=DEFAULT_BASE_DATE, games_per_task=GAMES_PER_TASK):
     """
     Generate sample chess games with realistic play patterns
+    
+    Args:
+        num_games: Number of games to generate
+        output_file: Output PGN (defaults to dataset/sample_training_dataset.pgn)
+        workers: Worker processes (defaults to os.cpu_count())
+        seed: Seed for reproducible output (random when None)
+        base_date: Games are dated within the year before this date
+        games_per_task: Games generated and written per batch
     """
-    data_dir = Path("dataset")
-    data_dir.mkdir(exist_ok=True)
+    if output_file is None:
+        data_dir = Path("dataset")
+        data_dir.mkdir(exist_ok=True)
+        output_file = data_dir / "sample_training_dataset.pgn"
+    output_file = Path(output_file)
     
-    output_file = data_dir / "sample_training_dataset.pgn"
+    if seed is None:
+        seed = random.randrange(2**32)
+    workers = workers or os.cpu_count() or 1
     
     print("=" * 60)
     print("Generating Sample Chess Dataset")
     print("=" * 60)
-    print(f"\n📝 Creating {num_games} sample games...")
-    print("This will take a few minutes...\n")
-    
-    # Common opening moves for variety
-    opening_sequences = [
-        # Italian Game
-        ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4"],
-        # Sicilian Defense
-        ["e2e4", "c7c5", "g1f3", "d7d6", "d2d4", "c5d4"],
-        # French Defense
-        ["e2e4", "e7e6", "d2d4", "d7d5"],
-        # Caro-Kann
-        ["e2e4", "c7c6", "d2d4", "d7d5"],
-        # Queen's Gambit
-        ["d2d4", "d7d5", "c2c4"],
-        # King's Indian
-        ["d2d4", "g8f6", "c2c4", "g7g6"],
-        # English Opening
-        ["c2c4", "e7e5"],
-        # Ruy Lopez
-        ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5"],
-    ]
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for game_num in range(num_games):
-            # Create new game
-            game = chess.pgn.Game()
-            
-            # Add headers
-            game.headers["Event"] = "Sample Training Game"
-            game.headers["Site"] = "Training Dataset"
-            
-            # Random date in the past year
-            date = datetime.now() - timedelta(days=random.randint(0, 365))
-            game.headers["Date"] = date.strftime("%Y.%m.%d")
-            
-            game.headers["Round"] = str(random.randint(1, 10))
-            game.headers["White"] = f"Player{random.randint(1000, 9999)}"
-            game.headers["Black"] = f"Player{random.randint(1000, 9999)}"
-            
-            # Random ELO ratings (1400-2200)
-            game.headers["WhiteElo"] = str(random.randint(1400, 2200))
-            game.headers["BlackElo"] = str(random.randint(1400, 2200))
-            
-            # Time control
-            time_controls = ["180+0", "300+0", "600+0", "900+10"]
-            game.headers["TimeControl"] = random.choice(time_controls)
-            
-            # Generate moves
-            board = chess.Board()
-            node = game
-            
-            # Start with a random opening
-            opening = random.choice(opening_sequences)
-            for uci_move in opening:
-                try:
-                    move = chess.Move.from_uci(uci_move)
-                    if move in board.legal_moves:
-                        board.push(move)
-                        node = node.add_variation(move)
-                except:
-                    break
-            
-            # Continue with random legal moves (weighted towards good moves)
-            move_count = 0
-            max_moves = random.randint(30, 80)
-            
-            while not board.is_game_over() and move_count < max_moves:
-                legal_moves = list(board.legal_moves)
-                
-                if not legal_moves:
-                    break
-                
-                # Bias towards captures and checks (more interesting moves)
-                captures = [m for m in legal_moves if board.is_capture(m)]
-                checks = [m for m in legal_moves if board.gives_check(m)]
-                
-                # 30% chance to make a capture if available
-                if captures and random.random() < 0.3:
-                    move = random.choice(captures)
-                # 20% chance to make a check if available
-                elif checks and random.random() < 0.2:
-                    move = random.choice(checks)
-                # Otherwise random legal move
-                else:
-                    move = random.choice(legal_moves)
-                
-                board.push(move)
-                node = node.add_variation(move)
-                move_count += 1
-                
-                # Small chance to end game early (resignation)
-                if move_count > 15 and random.random() < 0.05:
-                    break
-            
-            # Determine result
-            if board.is_checkmate():
-                game.headers["Result"] = "0-1" if board.turn == chess.WHITE else "1-0"
-            elif board.is_stalemate() or board.is_insufficient_material():
-                game.headers["Result"] = "1/2-1/2"
-            elif move_count >= max_moves:
-                # Timeout or random result
-                game.headers["Result"] = random.choice(["1-0", "0-1", "1/2-1/2"])
-            else:
-                # Resignation
-                game.headers["Result"] = random.choice(["1-0", "0-1"])
-            
-            # Write game to file
-            print(game, file=f, end="\n\n")
-            
-            # Progress update
-            if (game_num + 1) % 100 == 0:
-                print(f"  Generated {game_num + 1}/{num_games} games...")
-    
-    print(f"\n✅ Successfully generated {num_games} games!")
+    print(f"\n📝 Creating {num_games} sample games (seed {seed}, {workers} workers)...\n")
+    
+    began = time.perf_counter()
+    tasks = [(first, min(games_per_task, num_games - first))
+             for first in range(0, num_games, games_per_task)]
+    
+    with stage("generate", total=num_games, unit="games_kept") as metrics, \
+            ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(output_file, 'w', encoding='utf-8', newline='\n') as f:
+        batches = executor.map(_generate_batch, repeat(seed), [first for first, _ in tasks],
+                               [count for _, count in tasks], repeat(base_date))
+        generated = 0
+        for (first, count), text in zip(tasks, batches):
+            f.write(text)
+            generated += count
+            metrics.add(bytes_out=len(text), games_seen=count, games_kept=count)
+            elapsed = time.perf_counter() - began
+            print(f"  Generated {generated}/{num_games} games ({generated / elapsed:.0f} games/s)...")
+    
+    elapsed = time.perf_counter() - began
+    print(f"\n✅ Successfully generated {num_games} games in {elapsed:.1f}s!")
     print(f"📁 Output file: {output_file}")
     print(f"📊 File size: {output_file.stat().st_size / (1024*1024):.2f} MB")
     
@@ -156,20 +227,18 @@ def analyze_dataset(pgn_file):
     results = {"1-0": 0, "0-1": 0, "1/2-1/2": 0}
     
     try:
-        with open(pgn_file, 'r', encoding='utf-8') as f:
-            while True:
-                game = chess.pgn.read_game(f)
-                if game is None:
-                    break
-                
+        # Header fields and move numbers are read straight from the bytes;
+        # no game is replayed on a board
+        with open_pgn(pgn_file) as buf:
+            for start, end in iter_game_spans(buf):
                 game_count += 1
+                split = header_end(buf, start, end)
                 
                 # Count moves
-                moves = list(game.mainline_moves())
-                total_moves += len(moves)
+                total_moves += count_plies(buf[split:end])
                 
                 # Count results
-                result = game.headers.get("Result", "*")
+                result = header_value(buf[start:split], b"Result")
                 if result in results:
                     results[result] += 1
         
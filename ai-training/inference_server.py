@@ -0,0 +1,408 @@
+"""
+Batch inference service for the exported ONNX model
+Batches concurrent requests dynamically, caches results by Zobrist key and reports latency
+"""
+
+import asyncio
+import collections
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import chess
+import chess.polyglot
+import numpy as np
+import onnxruntime as ort
+
+from encoder import POLICY_SIZE, encode_board, policy_index
+from record_format import expand_planes
+from zobrist import record_keys
+
+DEFAULT_MODEL = Path("chess_model_web.onnx")
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT_US = 1000
+DEFAULT_CACHE_SIZE = 1 << 14      # a cached policy is 7.4 KB
+LATENCY_WINDOW = 100000      # most recent request latencies kept for percentiles
+
+
+def load_session(model_path, threads=None):
+    """
+    Open an ONNX model with the CPU execution provider and full graph optimisation
+    """
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used map from Zobrist key to (policy, value)
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if not self.capacity:
+            return
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+
+class InferenceServer:
+    """
+    Evaluate positions with an ONNX policy/value model
+
+    Single requests (submit, evaluate_fen, evaluate_async) go through a
+    queue drained by one batching thread: the first waiting request opens
+    a batch that closes when max_batch_size requests have arrived or
+    max_wait_us microseconds have passed, and the whole batch is one
+    session.run call. Bulk calls (evaluate_records, evaluate_fens) are
+    batched directly.
+
+    Results are cached by Polyglot Zobrist key. The key covers the
+    position only, not the history planes, so a transposition reached by
+    a different move order reuses the first evaluation.
+
+    Args:
+        model_path: Exported .onnx file (input "input", outputs "policy", "value")
+        max_batch_size: Positions per session.run call
+        max_wait_us: Longest a request waits for its batch to fill
+        cache_size: LRU entries (0 disables caching)
+        threads: onnxruntime intra-op threads
+    """
+
+    def __init__(self, model_path=DEFAULT_MODEL, max_batch_size=DEFAULT_MAX_BATCH, max_wait_us=DEFAULT_MAX_WAIT_US,
+                 cache_size=DEFAULT_CACHE_SIZE, threads=None):
+        self.session = load_session(model_path, threads)
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Models exported without a dynamic batch axis take a fixed batch
+        fixed = model_input.shape[0]
+        self.model_batch = fixed if isinstance(fixed, int) and fixed > 0 else None
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_us / 1e6
+        self.cache = LRUCache(cache_size)
+
+        self.requests = 0
+        self.positions = 0
+        self.batches = 0
+        self.batch_positions = 0
+        self.inference_seconds = 0.0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.started = time.perf_counter()
+        # Counters are updated by callers' threads and the batching thread
+        self._stats_lock = threading.Lock()
+
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._batch_loop, name="inference-batcher", daemon=True)
+        self._worker.start()
+
+    def run(self, planes):
+        """
+        Evaluate a (N, 119, 8, 8) float32 array; returns (policy logits (N, 1858), value (N,))
+        """
+        planes = np.ascontiguousarray(planes, dtype=np.float32)
+        began = time.perf_counter()
+        if self.model_batch is None:
+            policy, value = self.session.run(None, {self.input_name: planes})
+        else:
+            parts = [self.session.run(None, {self.input_name: planes[start:start + self.model_batch]})
+                     for start in range(0, len(planes), self.model_batch)]
+            policy = np.concatenate([part[0] for part in parts])
+            value = np.concatenate([part[1] for part in parts])
+        seconds = time.perf_counter() - began
+        with self._stats_lock:
+            self.inference_seconds += seconds
+            self.batches += 1
+            self.batch_positions += len(planes)
+        return policy, value.reshape(-1)
+
+    def _count(self, requests, positions, latencies):
+        with self._stats_lock:
+            self.requests += requests
+            self.positions += positions
+            self.latencies.extend(latencies)
+
+    def submit(self, planes, key=None):
+        """
+        Queue one (119, 8, 8) position; returns a Future of (policy logits, value)
+        """
+        future = Future()
+        if key is not None:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self._count(1, 1, [0.0])
+                future.set_result(entry)
+                return future
+        if self._closed:
+            raise RuntimeError("InferenceServer is closed")
+        self._queue.put((planes, key, future, time.perf_counter()))
+        return future
+
+    def _batch_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = item[3] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+
+            try:
+                policy, value = self.run(np.stack([planes for planes, _, _, _ in batch]))
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            self._count(len(batch), len(batch), [done - queued for _, _, _, queued in batch])
+            for number, (_, key, future, _) in enumerate(batch):
+                entry = (policy[number].copy(), float(value[number]))
+                if key is not None:
+                    self.cache.put(key, entry)
+                future.set_result(entry)
+
+    def evaluate_board(self, board):
+        """
+        Evaluate a chess.Board (its move stack supplies the history planes)
+        """
+        return self.submit(encode_board(board), chess.polyglot.zobrist_hash(board)).result()
+
+    def evaluate_fen(self, fen):
+        return self.evaluate_board(chess.Board(fen))
+
+    async def evaluate_async(self, board):
+        """
+        Awaitable evaluate_board for asyncio callers
+        """
+        return await asyncio.wrap_future(
+            self.submit(encode_board(board), chess.polyglot.zobrist_hash(board)))
+
+    def evaluate_fens(self, fens):
+        """
+        Evaluate many FENs; returns (policy logits (N, 1858), value (N,))
+        """
+        boards = [chess.Board(fen) for fen in fens]
+        keys = np.array([chess.polyglot.zobrist_hash(board) for board in boards], dtype=np.uint64)
+        return self._evaluate_bulk(keys, lambda rows: np.stack([encode_board(boards[row]) for row in rows]))
+
+    def evaluate_records(self, records, indices=None):
+        """
+        Evaluate encoded records, e.g. RecordFile(path).records
+
+        History planes come from the preceding records of each game, as in
+        training. Returns (policy logits (N, 1858), value (N,)).
+        """
+        indices = np.arange(len(records)) if indices is None else np.asarray(indices, dtype=np.int64)
+        keys = record_keys(records[indices])
+        return self._evaluate_bulk(keys, lambda rows: expand_planes(records, indices[rows]))
+
+    def _evaluate_bulk(self, keys, make_planes):
+        began = time.perf_counter()
+        count = len(keys)
+        policy = np.empty((count, POLICY_SIZE), dtype=np.float32)
+        value = np.empty(count, dtype=np.float32)
+        missing = []
+        cached = {}
+        for row, key in enumerate(keys.tolist()):
+            entry = self.cache.get(key)
+            if entry is None:
+                missing.append(row)
+            else:
+                cached[row] = entry
+
+        for start in range(0, len(missing), self.max_batch_size):
+            rows = missing[start:start + self.max_batch_size]
+            batch_policy, batch_value = self.run(make_planes(np.array(rows)))
+            policy[rows] = batch_policy
+            value[rows] = batch_value
+            for number, row in enumerate(rows):
+                self.cache.put(int(keys[row]), (batch_policy[number].copy(), float(batch_value[number])))
+
+        for row, (entry_policy, entry_value) in cached.items():
+            policy[row] = entry_policy
+            value[row] = entry_value
+
+        self._count(1, count, [time.perf_counter() - began])
+        return policy, value
+
+    def best_move(self, board):
+        """
+        Return (legal move with the highest policy logit, value) for a chess.Board
+        """
+        policy, value = self.evaluate_board(board)
+        moves = list(board.legal_moves)
+        if not moves:
+            return None, value
+        scores = [policy[policy_index(move, board.turn)] for move in moves]
+        return moves[int(np.argmax(scores))], value
+
+    def stats(self):
+        """
+        Return request counts, latency percentiles, throughput and cache hit rate
+        """
+        with self._stats_lock:
+            latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        elapsed = time.perf_counter() - self.started
+        lookups = self.cache.hits + self.cache.misses
+        return {
+            "requests": self.requests,
+            "positions": self.positions,
+            "batches": self.batches,
+            "mean_batch": self.batch_positions / self.batches if self.batches else 0.0,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "positions_per_s": self.positions / elapsed if elapsed else 0.0,
+            "model_positions_per_s": self.batch_positions / self.inference_seconds if self.inference_seconds else 0.0,
+            "cache_hit_rate": self.cache.hits / lookups if lookups else 0.0,
+            "cache_entries": len(self.cache),
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(f"📊 {stats['requests']} requests, {stats['positions']} positions in {stats['batches']} batches "
+              f"(mean batch {stats['mean_batch']:.1f})")
+        print(f"📊 Latency p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms; "
+              f"{stats['model_positions_per_s']:.0f} positions/s in the model; "
+              f"cache hit rate {stats['cache_hit_rate'] * 100:.1f}%")
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def make_app(server):
+    """
+    aiohttp application exposing POST /evaluate and GET /stats
+
+    /evaluate takes {"fens": [...]} (or {"fen": ...}) and answers each
+    position with its value and best legal move.
+    """
+    from aiohttp import web
+
+    async def evaluate(request):
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.json_response({"error": "Body is not valid JSON"}, status=400)
+        if not isinstance(payload, dict):
+            return web.json_response({"error": "Body must be a JSON object"}, status=400)
+        fens = payload.get("fens") if "fens" in payload else [payload["fen"]] if "fen" in payload else None
+        if not isinstance(fens, list) or not fens or not all(isinstance(fen, str) for fen in fens):
+            return web.json_response({"error": 'Expected {"fen": "..."} or a non-empty {"fens": [...]}'},
+                                     status=400)
+        results = []
+        try:
+            boards = [chess.Board(fen) for fen in fens]
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        evaluations = await asyncio.gather(*(server.evaluate_async(board) for board in boards))
+        for board, (policy, value) in zip(boards, evaluations):
+            moves = list(board.legal_moves)
+            best = max(moves, key=lambda move: policy[policy_index(move, board.turn)]) if moves else None
+            results.append({"fen": board.fen(), "value": value, "best_move": best.uci() if best else None})
+        return web.json_response({"results": results})
+
+    async def stats(request):
+        return web.json_response(server.stats())
+
+    app = web.Application()
+    app.add_routes([web.post("/evaluate", evaluate), web.get("/stats", stats)])
+    return app
+
+
+def benchmark(server, pgn_file, positions=10000, clients=64):
+    """
+    Replay positions from a PGN through concurrent single-position requests
+    """
+    import chess.pgn
+
+    boards = []
+    with open(pgn_file, 'r', encoding='utf-8', errors='replace') as f:
+        while len(boards) < positions:
+            game = chess.pgn.read_game(f)
+            if game is None:
+                break
+            board = game.board()
+            for move in game.mainline_moves():
+                board.push(move)
+                boards.append(board.copy())
+    boards = boards[:positions]
+    print(f"⏱️  {len(boards)} positions from {pgn_file}, {clients} concurrent clients")
+
+    planes = [encode_board(board) for board in boards]
+    keys = [chess.polyglot.zobrist_hash(board) for board in boards]
+
+    def client(number):
+        for row in range(number, len(boards), clients):
+            server.submit(planes[row], keys[row]).result()
+
+    began = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    print(f"✅ {len(boards) / elapsed:.0f} positions/s end to end")
+    server.report()
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    model = args[0] if args else DEFAULT_MODEL
+    server = InferenceServer(model, max_batch_size=int(options.get("max-batch", DEFAULT_MAX_BATCH)),
+                             max_wait_us=int(options.get("max-wait-us", DEFAULT_MAX_WAIT_US)),
+                             threads=int(options["threads"]) if "threads" in options else None)
+    if "bench" in options:
+        benchmark(server, options["bench"], int(options.get("positions", 10000)))
+        server.close()
+    else:
+        from aiohttp import web
+        web.run_app(make_app(server), port=int(options.get("port", 8080)))
@@ -0,0 +1,421 @@
+"""
+Resumable incremental ingestion of PGN archives into sharded datasets
+Keeps a manifest of processed sources so interrupted runs resume and repeated runs only process new data
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+from async_fetcher import SOURCES
+from parallel_decompress import StreamDecompressor
+from pgn_scan import GameSplitter
+from pipeline import Pipeline, EloRange, PgnWriter
+from telemetry import stage
+
+MANIFEST_NAME = "manifest.json"
+DEFAULT_OUTPUT_DIR = Path("dataset") / "ingest"
+DEFAULT_CHECKPOINT_EVERY = 10000    # games read between checkpoints
+DEFAULT_SHARD_GAMES = 100000        # a new shard is started at the first checkpoint past this
+DEFAULT_CHUNK_SIZE = 1 << 20
+OUTPUT_BUFFER_SIZE = 4 << 20
+MAX_BACKOFF = 30
+
+
+class IngestError(Exception):
+    pass
+
+
+def expand_sources(specs):
+    """
+    Turn source specs into (name, location) pairs
+
+    A spec is "lichess:2024-08", a month range such as
+    "lichess:2024-01..2024-08", a URL or a local archive path.
+    """
+    sources = []
+    for spec in specs:
+        if "://" in spec or Path(spec).exists():
+            name = spec.rsplit("/", 1)[-1].split(".", 1)[0]
+            sources.append((name, spec))
+            continue
+        source, _, key = spec.partition(":")
+        if source not in SOURCES or not key:
+            raise ValueError(f"Unknown source {spec!r}; use {', '.join(f'{name}:KEY' for name in SOURCES)}, "
+                             f"a URL or a file")
+        first, _, last = key.partition("..")
+        for month in months(first, last or first):
+            sources.append((f"{source}_{month}", SOURCES[source].format(key=month)))
+    return sources
+
+
+def months(first, last):
+    """
+    List the keys from first to last inclusive: months as "YYYY-MM" or plain years
+    """
+    if "-" not in first:
+        return [str(year) for year in range(int(first), int(last) + 1)]
+    year, month = map(int, first.split("-"))
+    end = tuple(map(int, last.split("-")))
+    keys = []
+    while (year, month) <= end:
+        keys.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return keys
+
+
+def load_manifest(output_dir):
+    """
+    Return the ingestion manifest of output_dir (empty when none exists yet)
+    """
+    path = Path(output_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {"version": 1, "sources": {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    """
+    Write the manifest atomically, so a crash leaves the previous checkpoint intact
+    """
+    path = Path(output_dir) / MANIFEST_NAME
+    temp = path.with_suffix(".tmp")
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def list_shards(output_dir, since=None):
+    """
+    Return the shard paths recorded in the manifest, oldest first
+
+    Args:
+        output_dir: Ingestion directory
+        since: Only shards written by runs starting at or after this
+               ISO timestamp (e.g. the previous nightly run)
+    """
+    output_dir = Path(output_dir)
+    shards = []
+    for entry in load_manifest(output_dir)["sources"].values():
+        shards += [shard for shard in entry["shards"] if since is None or shard["run"] >= since]
+    return [output_dir / shard["file"] for shard in sorted(shards, key=lambda shard: (shard["run"], shard["file"]))]
+
+
+def _read_chunks(location, offset, chunk_size, timeout):
+    """
+    Yield the bytes of a URL or file from offset onwards
+    """
+    if "://" not in location:
+        with open(location, 'rb') as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with requests.get(location, stream=True, timeout=timeout, headers=headers) as response:
+        response.raise_for_status()
+        # A server that ignores Range resends from byte 0
+        skip = offset if offset and response.status_code != 206 else 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk[skip:]
+                skip = 0
+            yield chunk
+
+
+def _new_entry(location, settings):
+    return {
+        "location": location,
+        "settings": settings,
+        "status": "new",
+        "format": "auto",
+        "offset": 0,           # compressed byte to restart from (a stream start)
+        "offset_out": 0,       # decompressed byte at that point
+        "skip": 0,             # decompressed bytes from there to the next unread game
+        "games_read": 0,
+        "games_kept": 0,
+        "shards": [],
+        "updated": None,
+    }
+
+
+class _SourceRun:
+    """
+    Process one source from its last checkpoint
+
+    A checkpoint is the latest compressed stream start lying before the
+    end of the last complete game, plus the decompressed bytes to skip
+    from there. Restarting a fresh decompressor at that offset and
+    dropping the skipped bytes continues exactly at the next game, so no
+    game is lost or emitted twice. Plain PGN restarts at any byte; a
+    single-member gzip file can only restart at its beginning.
+    """
+
+    def __init__(self, name, entry, output_dir, manifest, run_id, min_elo):
+        self.name = name
+        self.entry = entry
+        self.output_dir = Path(output_dir)
+        self.manifest = manifest
+        self.run_id = run_id
+        self.min_elo = min_elo
+        self.writer = None
+        self.pipeline = None
+        self.shard = None
+
+    def _repair(self):
+        # A killed run may have written past its last checkpoint
+        for shard in list(self.entry["shards"]):
+            path = self.output_dir / shard["file"]
+            if path.exists() and path.stat().st_size > shard["bytes"]:
+                with open(path, 'r+b') as f:
+                    f.truncate(shard["bytes"])
+            if not shard["games"]:
+                path.unlink(missing_ok=True)
+                self.entry["shards"].remove(shard)
+
+    def _open_shard(self):
+        number = max((int(shard["file"][-9:-4]) + 1 for shard in self.entry["shards"]), default=0)
+        path = Path(self.name) / f"part_{number:05d}.pgn"
+        (self.output_dir / self.name).mkdir(parents=True, exist_ok=True)
+        self.shard = {"file": path.as_posix(), "games": 0, "bytes": 0, "run": self.run_id}
+        self.entry["shards"].append(self.shard)
+        self.writer = PgnWriter(self.output_dir / path, OUTPUT_BUFFER_SIZE)
+        stages = [EloRange(min_elo=self.min_elo)] if self.min_elo else []
+        self.pipeline = Pipeline(*stages, self.writer)
+
+    def _close_shard(self):
+        self.writer.f_out.flush()
+        os.fsync(self.writer.f_out.fileno())
+        self.pipeline.close()
+        if not self.shard["games"]:
+            (self.output_dir / self.shard["file"]).unlink()
+            self.entry["shards"].remove(self.shard)
+        self.writer = self.pipeline = self.shard = None
+
+    def checkpoint(self, decompressor, position, final=False):
+        """
+        Make the shard durable and record the restart point in the manifest
+
+        Returns:
+            False when no stream start before position is known (the
+            previous checkpoint then stays in force)
+        """
+        base_in, base_out = self.base
+        if decompressor.fmt is None:
+            restart = (base_in + position - base_out, position)
+        else:
+            restart = next(((base_in + bytes_in, base_out + bytes_out)
+                            for bytes_in, bytes_out in reversed(decompressor.boundaries)
+                            if base_out + bytes_out <= position), None)
+            if restart is None:
+                return False
+
+        self.writer.f_out.flush()
+        os.fsync(self.writer.f_out.fileno())
+        self.entry.update({
+            "format": decompressor.fmt,
+            "offset": restart[0],
+            "offset_out": restart[1],
+            "skip": position - restart[1],
+            "updated": datetime.now().isoformat(timespec="seconds"),
+        })
+        if final or self.shard["games"] >= self.shard_games:
+            self._close_shard()
+        save_manifest(self.output_dir, self.manifest)
+        if not final and self.shard is None:
+            self._open_shard()
+        return True
+
+    def run(self, max_games, checkpoint_every, shard_games, chunk_size, timeout, metrics):
+        """
+        Read until the archive ends or max_games games have been read in total
+
+        Returns:
+            True when the whole archive was read
+        """
+        entry = self.entry
+        self.shard_games = shard_games
+        # Decompressor positions count from where this run started reading
+        self.base = (entry["offset"], entry["offset_out"])
+        decompressor = StreamDecompressor(entry["format"])
+        splitter = GameSplitter()
+        position = entry["offset_out"] + entry["skip"]
+        skip = entry["skip"]
+        limit = max_games if max_games is not None else float("inf")
+        next_checkpoint = entry["games_read"] + checkpoint_every
+        self._repair()
+        self._open_shard()
+
+        def add(game):
+            nonlocal position, next_checkpoint
+            passed = self.pipeline.feed(game)
+            position += len(game)
+            entry["games_read"] += 1
+            if passed:
+                entry["games_kept"] += 1
+                self.shard["games"] += 1
+                self.shard["bytes"] += len(game)
+            metrics.add(bytes_out=len(game) if passed else 0, games_seen=1, games_kept=int(passed),
+                        games_dropped=int(not passed))
+            if entry["games_read"] >= next_checkpoint and self.checkpoint(decompressor, position):
+                next_checkpoint = entry["games_read"] + checkpoint_every
+                print(f"  💾 {self.name}: {entry['games_read']} games read, {entry['games_kept']} kept")
+
+        try:
+            for chunk in _read_chunks(entry["location"], entry["offset"], chunk_size, timeout):
+                metrics.add(bytes_in=len(chunk))
+                data = decompressor.decompress(chunk)
+                if skip:
+                    dropped = min(skip, len(data))
+                    data = data[dropped:]
+                    skip -= dropped
+                for game in splitter.feed(data):
+                    add(game)
+                    if entry["games_read"] >= limit:
+                        self.checkpoint(decompressor, position, final=True)
+                        return False
+            game = splitter.flush()
+            if game is not None:
+                add(game)
+            entry["status"] = "complete"
+            self.checkpoint(decompressor, position, final=True)
+            return True
+        except requests.RequestException:
+            # Interrupted between games, so the current position is a valid checkpoint
+            self.checkpoint(decompressor, position, final=True)
+            raise
+
+
+def ingest(specs, output_dir=DEFAULT_OUTPUT_DIR, min_elo=None, max_games=None,
+           checkpoint_every=DEFAULT_CHECKPOINT_EVERY, shard_games=DEFAULT_SHARD_GAMES,
+           chunk_size=DEFAULT_CHUNK_SIZE, timeout=60, max_retries=5):
+    """
+    Ingest archives into PGN shards, resuming from the manifest
+
+    Sources already read to the end are skipped, interrupted ones continue
+    from their last checkpoint, and every run writes its games to new
+    shards, so repeated (e.g. nightly) runs cost time in proportion to the
+    new data only. A run killed at any point loses at most the games read
+    since the last checkpoint; they are read again on the next run.
+
+    Args:
+        specs: Source specs ("lichess:2024-08", "lichess:2024-01..2024-08",
+               URLs or local archives)
+        output_dir: Directory holding the manifest and one shard directory per source
+        min_elo: Keep games where both players have at least this rating
+        max_games: Games to read per source in total (None for the whole archive)
+        checkpoint_every: Games read between checkpoints
+        shard_games: Kept games after which a new shard is started
+        chunk_size: Bytes read per iteration
+        timeout: Socket timeout in seconds
+        max_retries: Reconnect attempts per source before giving up
+
+    A source that answers with an HTTP error (e.g. a month not published
+    yet) or keeps dropping the connection is marked "failed" with the
+    error in the manifest, and the run continues with the next source;
+    the next run tries it again from its checkpoint.
+
+    Returns:
+        Dictionary with the manifest entries of the sources, the shards
+        written by this run and {name: error} of the sources that failed
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    run_id = datetime.now().isoformat(timespec="seconds")
+    settings = {"min_elo": min_elo}
+    sources = expand_sources(specs)
+
+    print(f"\n📥 Ingesting {len(sources)} sources into {output_dir}")
+    began = time.perf_counter()
+    games_read = 0
+    failed = {}
+    for name, location in sources:
+        entry = manifest["sources"].setdefault(name, _new_entry(location, settings))
+        if entry["settings"] != settings:
+            raise IngestError(f"{name} was ingested with {entry['settings']}, not {settings}; "
+                              f"use another output directory")
+        if entry["status"] == "complete":
+            print(f"⏭️  {name}: already complete ({entry['games_kept']} games)")
+            continue
+        if max_games is not None and entry["games_read"] >= max_games:
+            print(f"⏭️  {name}: {entry['games_read']} games already read")
+            continue
+
+        print(f"📦 {name}: {'resuming at game ' + str(entry['games_read']) if entry['games_read'] else 'starting'}")
+        entry["status"] = "partial"
+        entry.pop("error", None)
+        read_before = entry["games_read"]
+        retries = 0
+        error = None
+        with stage("ingest", total=max_games, unit="games_seen") as metrics:
+            while True:
+                try:
+                    _SourceRun(name, entry, output_dir, manifest, run_id, min_elo).run(
+                        max_games, checkpoint_every, shard_games, chunk_size, timeout, metrics)
+                    break
+                except requests.HTTPError as e:
+                    error = e
+                    break
+                except (requests.ConnectionError, requests.Timeout,
+                        requests.exceptions.ChunkedEncodingError) as e:
+                    retries += 1
+                    metrics.add(retries=1)
+                    if retries > max_retries:
+                        error = e
+                        break
+                    print(f"\n⚠️  Connection interrupted ({e}), resuming {name} at game {entry['games_read']}...")
+                    time.sleep(min(2 ** retries, MAX_BACKOFF))
+        games_read += entry["games_read"] - read_before
+        if error is not None:
+            entry["status"] = "failed"
+            entry["error"] = str(error)
+            save_manifest(output_dir, manifest)
+            failed[name] = str(error)
+            print(f"❌ {name}: {error} ({entry['games_read'] - read_before} games read this run)")
+            continue
+        print(f"✅ {name}: {entry['games_read'] - read_before} games read this run, "
+              f"{entry['games_kept']} kept in total ({entry['status']})")
+
+    new_shards = [output_dir / shard["file"] for entry in manifest["sources"].values()
+                  for shard in entry["shards"] if shard["run"] == run_id]
+    elapsed = time.perf_counter() - began
+    print(f"\n📊 {games_read} new games read in {elapsed:.1f}s, {len(new_shards)} new shards")
+    if failed:
+        print(f"❌ {len(failed)} of {len(sources)} sources failed: {', '.join(failed)}")
+    print(f"📁 Manifest: {output_dir / MANIFEST_NAME}")
+    return {"sources": {name: manifest["sources"][name] for name, _ in sources}, "new_shards": new_shards,
+            "failed": failed}
+
+
+if __name__ == "__main__":
+    options = {}
+    specs = []
+    for arg in sys.argv[1:]:
+        key, _, value = arg.partition("=")
+        if key in ("--min-elo", "--max-games", "--checkpoint-every", "--shard-games"):
+            options[key[2:].replace("-", "_")] = int(value)
+        elif key == "--output":
+            options["output_dir"] = value
+        else:
+            specs.append(arg)
+    if not specs:
+        print("Usage: python ingest.py lichess:2024-01..2024-08 [URL or file ...] [--output=dataset/ingest] "
+              "[--min-elo=1800] [--max-games=N] [--checkpoint-every=N] [--shard-games=N]")
+        sys.exit(1)
+    result = ingest(specs, **options)
+    sys.exit(1 if result["failed"] else 0)
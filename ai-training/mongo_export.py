@@ -0,0 +1,333 @@
+"""
+Incremental export of games played on the site from MongoDB
+Pages through the games collection after a high-water mark and writes PGN or encoded record shards
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import chess
+
+from encoder import game_positions
+from record_format import DEFAULT_SHARD_SIZE, RecordShardWriter
+from telemetry import stage
+
+DEFAULT_URI = "mongodb://localhost:27017"
+DEFAULT_DATABASE = "chess"
+COLLECTION = "games"                  # mongoose's collection for the Game model
+DEFAULT_OUTPUT_DIR = Path("dataset") / "site_games"
+STATE_NAME = "export_state.json"
+DEFAULT_BATCH_SIZE = 1000
+
+# Game.result values
+RESULTS = {"white": "1-0", "black": "0-1", "draw": "1/2-1/2"}
+VALUES = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}
+
+# Only the fields the export reads are fetched
+PROJECTION = {"players": 1, "moves.move": 1, "moves.fen": 1, "result": 1, "gameMode": 1,
+              "startTime": 1, "endTime": 1, "finalFEN": 1}
+
+
+class ExportError(Exception):
+    pass
+
+
+def connect(uri=None, database=None):
+    """
+    Return the games collection of the server's database
+
+    pymongo is only needed here; export_games accepts any object with
+    pymongo's find/sort/limit interface, e.g. a mongomock collection.
+    """
+    try:
+        from pymongo import MongoClient
+    except ImportError:
+        raise ExportError("pymongo is required to read from MongoDB: pip install pymongo")
+    uri = uri or os.environ.get("MONGODB_URI", DEFAULT_URI)
+    client = MongoClient(uri, tz_aware=True)
+    db = client[database] if database else client.get_default_database(DEFAULT_DATABASE)
+    return db[COLLECTION]
+
+
+def _board_fen(fen):
+    return fen.split(" ", 1)[0] if fen else None
+
+
+def _parse_move(board, text, fen):
+    """
+    Parse a stored move as SAN or UCI, or recover it from the position after it
+    """
+    if text:
+        try:
+            return board.parse_san(text)
+        except ValueError:
+            pass
+        try:
+            move = chess.Move.from_uci(text)
+            if move in board.legal_moves:
+                return move
+        except ValueError:
+            pass
+    target = _board_fen(fen)
+    if target:
+        for move in board.legal_moves:
+            board.push(move)
+            found = board.board_fen() == target
+            board.pop()
+            if found:
+                return move
+    return None
+
+
+def document_moves(document):
+    """
+    Replay a game document's moves from the initial position
+
+    The client records the SAN of every move. Per-ply fen values only
+    serve to recover moves stored in another notation, as the client
+    currently saves the final position with every move. The replay must
+    end on finalFEN when it is present.
+
+    Returns:
+        List of chess.Move, or None when the moves do not form a legal game
+    """
+    board = chess.Board()
+    moves = []
+    for ply in document.get("moves") or []:
+        move = _parse_move(board, ply.get("move"), ply.get("fen"))
+        if move is None:
+            return None
+        board.push(move)
+        moves.append(move)
+    final = _board_fen(document.get("finalFEN"))
+    if final and board.board_fen() != final:
+        return None
+    return moves
+
+
+def _tag(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def document_pgn(document, moves, result):
+    """
+    Render a game document as PGN
+    """
+    players = document.get("players") or {}
+    start = document.get("startTime")
+    board = chess.Board()
+    tokens = []
+    for ply, move in enumerate(moves):
+        san = board.san(move)
+        tokens.append(f"{ply // 2 + 1}. {san}" if ply % 2 == 0 else san)
+        board.push(move)
+    return (
+        f'[Event "Site game ({document.get("gameMode", "unknown")})"]\n'
+        f'[Site "?"]\n'
+        f'[Date "{start.strftime("%Y.%m.%d") if start else "????.??.??"}"]\n'
+        f'[Round "-"]\n'
+        f'[White "{_tag(players.get("white", "?"))}"]\n'
+        f'[Black "{_tag(players.get("black", "?"))}"]\n'
+        f'[Result "{result}"]\n'
+        f'[UTCTime "{start.strftime("%H:%M:%S") if start else "??:??:??"}"]\n'
+        f'[GameId "{document["_id"]}"]\n'
+        f'\n'
+        f'{" ".join(tokens + [result])}\n\n'
+    )
+
+
+def iter_documents(collection, mark=None, batch_size=DEFAULT_BATCH_SIZE, max_games=None):
+    """
+    Yield game documents in (startTime, _id) order after a high-water mark
+
+    Each page is a separate query resuming after the last key of the
+    previous one, so no server cursor stays open, only batch_size
+    documents are held at a time, and pages stay fast on an index over
+    (startTime, _id).
+
+    Args:
+        collection: pymongo-compatible collection
+        mark: (startTime, _id) of the last exported game, or None for all
+        batch_size: Documents per query
+        max_games: Stop after this many documents
+    """
+    count = 0
+    while max_games is None or count < max_games:
+        query = {}
+        if mark is not None:
+            start, last_id = mark
+            query = {"$or": [{"startTime": {"$gt": start}}, {"startTime": start, "_id": {"$gt": last_id}}]}
+        limit = batch_size if max_games is None else min(batch_size, max_games - count)
+        page = list(collection.find(query, PROJECTION).sort([("startTime", 1), ("_id", 1)]).limit(limit))
+        for document in page:
+            yield document
+        count += len(page)
+        if len(page) < limit:
+            return
+        mark = (page[-1]["startTime"], page[-1]["_id"])
+
+
+def load_state(output_dir):
+    """
+    Return the saved export state of output_dir ({} before the first export)
+    """
+    path = Path(output_dir) / STATE_NAME
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _mark_from_state(state):
+    if not state.get("start_time"):
+        return None
+    start = datetime.fromisoformat(state["start_time"])
+    last_id = state["id"]
+    if state.get("id_type") == "objectid":
+        from bson import ObjectId
+        last_id = ObjectId(last_id)
+    return start, last_id
+
+
+def _remove(path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def _save_state(output_dir, state):
+    path = Path(output_dir) / STATE_NAME
+    temp = path.with_suffix(".tmp")
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp, path)
+
+
+def export_games(collection, output_dir=DEFAULT_OUTPUT_DIR, fmt="pgn", batch_size=DEFAULT_BATCH_SIZE,
+                 max_games=None, shard_size=DEFAULT_SHARD_SIZE, modes=None, verbose=True):
+    """
+    Export games newer than the last high-water mark
+
+    Each run writes a new file (PGN) or shard directory (records) named
+    after the run's start time (to the microsecond), and only then
+    advances the mark, so an interrupted run exports nothing and is simply
+    repeated. An existing output is never replaced. Unfinished ("ongoing") and
+    unreplayable games are skipped but still move the mark.
+
+    Args:
+        collection: Games collection (see connect()) or a stand-in with the
+                    same find/sort/limit interface
+        output_dir: Directory for the exports and export_state.json
+        fmt: "pgn" or "records"
+        batch_size: Documents fetched per query
+        max_games: Documents to read in this run (None for all new ones)
+        shard_size: Maximum positions per record shard
+        modes: Only export these gameMode values (e.g. ("online",))
+        verbose: Print a summary
+
+    Returns:
+        Dictionary with the output path, counts and the new mark
+    """
+    if fmt not in ("pgn", "records"):
+        raise ValueError(f"Unknown format {fmt!r}; use 'pgn' or 'records'")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    state = load_state(output_dir)
+    mark = _mark_from_state(state)
+
+    run = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    name = f"site_{run}.pgn" if fmt == "pgn" else f"site_{run}"
+    target = output_dir / name
+    temp = output_dir / f"{name}.partial"
+    if target.exists():
+        raise ExportError(f"{target} already exists; not exporting over it")
+    for leftover in output_dir.glob("*.partial"):
+        _remove(leftover)
+
+    counts = {"read": 0, "exported": 0, "ongoing": 0, "filtered": 0, "invalid": 0, "positions": 0}
+    last = None
+    began = time.perf_counter()
+    if fmt == "pgn":
+        f_out = open(temp, 'w', encoding='utf-8', newline='\n')
+    else:
+        writer = RecordShardWriter(temp, shard_size, prefix="site")
+
+    try:
+        with stage("mongo_export", total=max_games) as metrics:
+            for document in iter_documents(collection, mark, batch_size, max_games):
+                counts["read"] += 1
+                last = document
+                result = RESULTS.get(document.get("result"))
+                if result is None:
+                    counts["ongoing"] += 1
+                    metrics.add(games_seen=1, games_dropped=1)
+                    continue
+                if modes and document.get("gameMode") not in modes:
+                    counts["filtered"] += 1
+                    metrics.add(games_seen=1, games_dropped=1)
+                    continue
+                moves = document_moves(document)
+                if not moves:
+                    counts["invalid"] += 1
+                    metrics.add(games_seen=1, games_malformed=1)
+                    continue
+
+                if fmt == "pgn":
+                    text = document_pgn(document, moves, result)
+                    f_out.write(text)
+                    metrics.add(bytes_out=len(text))
+                else:
+                    writer.add(game_positions(chess.Board(), moves, VALUES[result]))
+                counts["exported"] += 1
+                counts["positions"] += len(moves)
+                metrics.add(games_seen=1, games_kept=1, positions=len(moves))
+    finally:
+        if fmt == "pgn":
+            f_out.close()
+        else:
+            writer.close()
+
+    if counts["exported"]:
+        if target.exists():
+            _remove(temp)
+            raise ExportError(f"{target} appeared during the export; the high-water mark was not moved")
+        os.replace(temp, target)
+    else:
+        _remove(temp)
+        target = None
+
+    if last is not None:
+        last_id = last["_id"]
+        state = {
+            "start_time": last["startTime"].isoformat(),
+            "id": str(last_id),
+            "id_type": "objectid" if type(last_id).__name__ == "ObjectId" else "str",
+            "exported": state.get("exported", 0) + counts["exported"],
+            "updated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        _save_state(output_dir, state)
+
+    elapsed = time.perf_counter() - began
+    if verbose:
+        print(f"✅ {counts['exported']} of {counts['read']} new games exported in {elapsed:.1f}s "
+              f"({counts['ongoing']} unfinished, {counts['invalid']} invalid, {counts['filtered']} other modes)")
+        if target:
+            print(f"📁 Output: {target}")
+        if last is not None:
+            print(f"🔖 High-water mark: {state['start_time']} / {state['id']}")
+    return dict(counts, output=target, mark=state.get("start_time"), seconds=elapsed)
+
+
+if __name__ == "__main__":
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    collection = connect(options.get("uri"), options.get("db"))
+    export_games(collection, options.get("output", DEFAULT_OUTPUT_DIR), options.get("format", "pgn"),
+                 batch_size=int(options.get("batch", DEFAULT_BATCH_SIZE)),
+                 max_games=int(options["max-games"]) if "max-games" in options else None,
+                 modes=tuple(options["modes"].split(",")) if "modes" in options else None)
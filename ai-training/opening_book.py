@@ -0,0 +1,367 @@
+"""
+Opening book builder and reader
+Aggregates move counts and W/D/L per Zobrist key into a sorted Polyglot book
+"""
+
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import chess
+import chess.polyglot
+import numpy as np
+
+from encoder import movetext_sans
+from pgn_scan import open_pgn, iter_game_spans, detect_boundary, header_end, header_value, result_code
+
+# Polyglot entries: big-endian key, move, weight, learn (16 bytes)
+BOOK_DTYPE = np.dtype([
+    ("key", ">u8"),
+    ("move", ">u2"),
+    ("weight", ">u2"),
+    ("learn", ">u4"),
+])
+
+# Sidecar with one row per book entry: results for the side to move
+WDL_MAGIC = b"CHSWDL\x00\x00"
+WDL_VERSION = 1
+WDL_HEADER = struct.Struct("<8sHHQ")
+WDL_HEADER_SIZE = 64
+WDL_DTYPE = np.dtype([
+    ("wins", "<u4"),
+    ("draws", "<u4"),
+    ("losses", "<u4"),
+])
+
+# Aggregation rows used while building (sorted by key, then move)
+RUN_DTYPE = np.dtype([
+    ("key", "<u8"),
+    ("move", "<u2"),
+    ("wins", "<u4"),
+    ("draws", "<u4"),
+    ("losses", "<u4"),
+])
+
+DEFAULT_DEPTH = 20                # plies per game added to the book
+DEFAULT_MAX_ENTRIES = 1 << 21     # in-memory (key, move) pairs before a run is spilled
+MERGE_BLOCK = 1 << 16             # rows read per run per merge step
+
+PROMOTION_PIECES = {chess.KNIGHT: 1, chess.BISHOP: 2, chess.ROOK: 3, chess.QUEEN: 4}
+
+
+def wdl_path_for(book_path):
+    """
+    Return the W/D/L sidecar path for a book (book.bin -> book.bin.wdl)
+    """
+    book_path = Path(book_path)
+    return book_path.with_name(book_path.name + ".wdl")
+
+
+def encode_move(board, move):
+    """
+    Polyglot move encoding; castling is written as king-takes-rook
+    """
+    to_square = move.to_square
+    if board.is_castling(move):
+        to_square = chess.square(7 if chess.square_file(move.to_square) > chess.square_file(move.from_square) else 0,
+                                 chess.square_rank(move.from_square))
+    return to_square | (move.from_square << 6) | (PROMOTION_PIECES.get(move.promotion, 0) << 12)
+
+
+def decode_move(board, raw_move):
+    """
+    Turn a Polyglot move back into a chess.Move for the given position
+    """
+    to_square = raw_move & 0x3F
+    from_square = (raw_move >> 6) & 0x3F
+    promotion_part = (raw_move >> 12) & 0x7
+    promotion = promotion_part + 1 if promotion_part else None
+    if board.piece_type_at(from_square) == chess.KING and board.color_at(to_square) == board.turn:
+        to_square = chess.square(6 if chess.square_file(to_square) > chess.square_file(from_square) else 2,
+                                 chess.square_rank(from_square))
+    return chess.Move(from_square, to_square, promotion)
+
+
+class _RunWriter:
+    """
+    Collect (key, move) results in memory and spill sorted runs to disk
+    """
+
+    def __init__(self, directory, max_entries):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.counts = {}
+        self.runs = []
+
+    def add(self, key, move, outcome):
+        entry = self.counts.get((key, move))
+        if entry is None:
+            entry = self.counts[(key, move)] = [0, 0, 0]
+        entry[outcome] += 1
+        if len(self.counts) >= self.max_entries:
+            self.spill()
+
+    def spill(self):
+        if not self.counts:
+            return
+        rows = np.empty(len(self.counts), dtype=RUN_DTYPE)
+        pairs = np.array(list(self.counts.keys()), dtype=np.uint64)
+        rows["key"] = pairs[:, 0]
+        rows["move"] = pairs[:, 1]
+        rows["wins"], rows["draws"], rows["losses"] = np.array(list(self.counts.values()), dtype=np.uint32).T
+        rows.sort(order=["key", "move"])
+        path = self.directory / f"run_{len(self.runs):05d}.npy"
+        np.save(path, rows)
+        self.runs.append(path)
+        self.counts = {}
+
+
+def _merge_runs(run_paths, block=MERGE_BLOCK):
+    """
+    K-way merge of sorted runs, yielding aggregated sorted blocks
+
+    Each step reads one block per run and emits every row whose key is
+    below the smallest last key among blocks that do not end their run,
+    so all rows of a key are always combined in the same step.
+    """
+    runs = [np.load(path, mmap_mode='r') for path in run_paths]
+    positions = [0] * len(runs)
+    while True:
+        active = [number for number, run in enumerate(runs) if positions[number] < len(run)]
+        if not active:
+            return
+        cutoff = None
+        for number in active:
+            end = positions[number] + block
+            if end < len(runs[number]):
+                last = int(runs[number]["key"][end - 1])
+                cutoff = last if cutoff is None else min(cutoff, last)
+
+        taken = []
+        for number in active:
+            position = positions[number]
+            rows = runs[number][position:position + block]
+            count = len(rows) if cutoff is None else int(np.searchsorted(rows["key"], np.uint64(cutoff), 'left'))
+            taken.append(np.array(rows[:count]))
+            positions[number] = position + count
+
+        rows = np.concatenate(taken)
+        if not len(rows):
+            raise RuntimeError("Merge block too small for the number of moves per position")
+        rows.sort(order=["key", "move"])
+        pair_start = np.ones(len(rows), dtype=bool)
+        pair_start[1:] = (rows["key"][1:] != rows["key"][:-1]) | (rows["move"][1:] != rows["move"][:-1])
+        starts = np.flatnonzero(pair_start)
+        merged = rows[starts].copy()
+        for field in ("wins", "draws", "losses"):
+            merged[field] = np.add.reduceat(rows[field].astype(np.uint64), starts)
+        yield merged
+
+
+def _book_block(rows, min_games):
+    """
+    Convert aggregated rows to Polyglot entries and W/D/L rows
+
+    Weights follow the usual Polyglot convention (2 * wins + draws) and are
+    scaled down per position when they would not fit in 16 bits.
+    """
+    games = rows["wins"].astype(np.int64) + rows["draws"] + rows["losses"]
+    rows = rows[games >= min_games]
+    if not len(rows):
+        return np.zeros(0, BOOK_DTYPE), np.zeros(0, WDL_DTYPE)
+
+    weights = 2 * rows["wins"].astype(np.float64) + rows["draws"]
+    key_start = np.ones(len(rows), dtype=bool)
+    key_start[1:] = rows["key"][1:] != rows["key"][:-1]
+    starts = np.flatnonzero(key_start)
+    largest = np.repeat(np.maximum.reduceat(weights, starts), np.diff(np.append(starts, len(rows))))
+    weights = np.where(largest > 65535, weights * 65535 / np.maximum(largest, 1), weights)
+
+    entries = np.zeros(len(rows), dtype=BOOK_DTYPE)
+    entries["key"] = rows["key"]
+    entries["move"] = rows["move"]
+    entries["weight"] = np.floor(weights).astype(np.uint16)
+    wdl = np.empty(len(rows), dtype=WDL_DTYPE)
+    for field in ("wins", "draws", "losses"):
+        wdl[field] = rows[field]
+    return entries, wdl
+
+
+def build_book(pgn_files, book_path, depth=DEFAULT_DEPTH, min_games=1, max_entries=DEFAULT_MAX_ENTRIES,
+               max_games=None, verbose=True):
+    """
+    Build a Polyglot book (plus W/D/L sidecar) from one or more PGN files
+
+    Only the first depth plies of each decided or drawn game are counted.
+    Memory is bounded by max_entries: partial counts are spilled as sorted
+    runs and combined with an external merge sort.
+
+    Args:
+        pgn_files: PGN path or list of paths (e.g. dataset shards)
+        book_path: Output .bin path; the sidecar is written next to it
+        depth: Plies per game to include
+        min_games: Drop moves played in fewer games
+        max_entries: In-memory (key, move) pairs before spilling
+        max_games: Stop after this many games
+        verbose: Print progress
+
+    Returns:
+        Dictionary with games, skipped, entries, positions, runs, seconds
+    """
+    if isinstance(pgn_files, (str, Path)):
+        pgn_files = [pgn_files]
+    book_path = Path(book_path)
+    began = time.perf_counter()
+    games = skipped = 0
+
+    with tempfile.TemporaryDirectory(prefix="book_") as run_dir:
+        writer = _RunWriter(run_dir, max_entries)
+        for pgn_file in pgn_files:
+            if verbose:
+                print(f"\n📖 Reading openings from {pgn_file} (depth {depth})")
+            with open_pgn(pgn_file) as buf:
+                for start, end in iter_game_spans(buf, boundary=detect_boundary(buf)):
+                    if max_games is not None and games >= max_games:
+                        break
+                    split = header_end(buf, start, end)
+                    header = buf[start:split]
+                    value = result_code(header_value(header, b"Result"))
+                    if value is None:
+                        skipped += 1
+                        continue
+                    fen = header_value(header, b"FEN")
+                    # Parse the whole prefix first so a game with an illegal
+                    # move adds nothing to the book
+                    try:
+                        board = chess.Board(fen) if fen else chess.Board()
+                        moves = []
+                        for san in movetext_sans(buf[split:end])[:depth]:
+                            moves.append(board.parse_san(san))
+                            board.push(moves[-1])
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    for _ in moves:
+                        board.pop()
+                    for move in moves:
+                        # 0 win, 1 draw, 2 loss for the side to move
+                        outcome = 1 - (value if board.turn == chess.WHITE else -value)
+                        writer.add(chess.polyglot.zobrist_hash(board), encode_move(board, move), outcome)
+                        board.push(move)
+                    games += 1
+                    if verbose and games % 10000 == 0:
+                        print(f"  {games} games, {len(writer.runs)} runs spilled...")
+        writer.spill()
+
+        entries = positions = 0
+        wdl_path = wdl_path_for(book_path)
+        with open(book_path, 'wb') as book, open(wdl_path, 'wb') as sidecar:
+            sidecar.write(b"\x00" * WDL_HEADER_SIZE)
+            previous_key = None
+            for rows in _merge_runs(writer.runs):
+                block_entries, block_wdl = _book_block(rows, min_games)
+                book.write(block_entries.tobytes())
+                sidecar.write(block_wdl.tobytes())
+                entries += len(block_entries)
+                if len(block_entries):
+                    keys = block_entries["key"]
+                    positions += int(np.count_nonzero(keys[1:] != keys[:-1])) + 1
+                    positions -= int(keys[0]) == previous_key
+                    previous_key = int(keys[-1])
+            sidecar.seek(0)
+            sidecar.write(WDL_HEADER.pack(WDL_MAGIC, WDL_VERSION, WDL_DTYPE.itemsize, entries))
+        runs = len(writer.runs)
+
+    elapsed = time.perf_counter() - began
+    stats = {
+        "games": games,
+        "skipped": skipped,
+        "entries": entries,
+        "positions": positions,
+        "runs": runs,
+        "seconds": elapsed,
+    }
+    if verbose:
+        print(f"✅ {games} games -> {entries} book moves in {positions} positions "
+              f"({runs} sorted runs merged, {elapsed:.2f}s)")
+        print(f"📁 Book: {book_path} ({book_path.stat().st_size / 1024:.1f} KB)")
+    return stats
+
+
+class OpeningBook:
+    """
+    Memory-mapped reader for books written by build_book
+
+    The .bin file is a standard Polyglot book, so engines and
+    chess.polyglot can read it directly; this reader adds the W/D/L
+    counts from the sidecar.
+    """
+
+    def __init__(self, book_path):
+        self.path = Path(book_path)
+        size = self.path.stat().st_size
+        if size % BOOK_DTYPE.itemsize:
+            raise ValueError(f"{self.path} is not a Polyglot book")
+        count = size // BOOK_DTYPE.itemsize
+        self.entries = np.memmap(self.path, dtype=BOOK_DTYPE, mode='r') if count else np.zeros(0, BOOK_DTYPE)
+
+        self.wdl = None
+        wdl_path = wdl_path_for(self.path)
+        if wdl_path.exists():
+            with open(wdl_path, 'rb') as f:
+                magic, version, row_size, rows = WDL_HEADER.unpack(f.read(WDL_HEADER.size))
+            if magic != WDL_MAGIC or version != WDL_VERSION or row_size != WDL_DTYPE.itemsize or rows != count:
+                raise ValueError(f"{wdl_path} does not match {self.path}")
+            if count:
+                self.wdl = np.memmap(wdl_path, dtype=WDL_DTYPE, mode='r', offset=WDL_HEADER_SIZE, shape=(count,))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, board):
+        """
+        Return the book moves for a position, most played first
+
+        Returns:
+            List of dicts with move, weight and (when the sidecar exists)
+            games, wins, draws, losses for the side to move
+        """
+        key = np.uint64(chess.polyglot.zobrist_hash(board))
+        keys = self.entries["key"]
+        low = int(np.searchsorted(keys, key, 'left'))
+        high = int(np.searchsorted(keys, key, 'right'))
+
+        moves = []
+        for index in range(low, high):
+            move = decode_move(board, int(self.entries["move"][index]))
+            if not board.is_legal(move):
+                continue
+            entry = {"move": move, "weight": int(self.entries["weight"][index])}
+            if self.wdl is not None:
+                wins, draws, losses = (int(count) for count in self.wdl[index])
+                entry.update(games=wins + draws + losses, wins=wins, draws=draws, losses=losses)
+            moves.append(entry)
+        moves.sort(key=lambda entry: (entry.get("games", 0), entry["weight"]), reverse=True)
+        return moves
+
+    def best_move(self, board):
+        """
+        Most played book move, or None when the position is out of book
+        """
+        moves = self.find(board)
+        return moves[0]["move"] if moves else None
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else Path("dataset") / "sample_training_dataset.pgn"
+    target = sys.argv[2] if len(sys.argv) > 2 else Path("dataset") / "opening_book.bin"
+    build_book(source, target)
+
+    book = OpeningBook(target)
+    board = chess.Board()
+    print("\n   Start position:")
+    for entry in book.find(board)[:5]:
+        print(f"   {board.san(entry['move']):>6}  {entry.get('games', 0):6} games  "
+              f"+{entry.get('wins', 0)} ={entry.get('draws', 0)} -{entry.get('losses', 0)}")
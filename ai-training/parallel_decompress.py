@@ -0,0 +1,338 @@
+"""
+Parallel decompression of multi-stream PGN archives
+Splits .bz2/.gz dumps at stream boundaries and decompresses the pieces on all cores
+"""
+
+import bz2
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Every bz2 stream starts with "BZh" + block size digit, immediately followed
+# by the 48-bit block magic of its first block (byte aligned at stream start)
+BZ2_BLOCK_MAGIC = b"1AY&SY"
+GZIP_MAGIC = b"\x1f\x8b\x08"
+
+# Compressed bytes handed to a worker at a time; streams are grouped
+# until a segment reaches this size so task overhead stays negligible
+DEFAULT_SEGMENT_SIZE = 16 << 20
+
+# Bytes read at a time when decompressing a segment and copying its output
+IO_BLOCK_SIZE = 1 << 20
+
+GAME_BOUNDARY = b"\n\n["
+
+# Recent stream starts remembered by StreamDecompressor for restarting
+STREAM_BOUNDARY_HISTORY = 1024
+
+
+def detect_format(path):
+    """
+    Return "bz2" or "gzip" based on the archive's magic bytes
+    """
+    with open(path, 'rb') as f:
+        head = f.read(3)
+    if head.startswith(b"BZh"):
+        return "bz2"
+    if head == GZIP_MAGIC:
+        return "gzip"
+    raise ValueError(f"{path} is neither a bz2 nor a gzip archive")
+
+
+class StreamDecompressor:
+    """
+    Incremental decompressor that follows concatenated bz2 streams or gzip members
+
+    bz2.BZ2Decompressor and zlib decompress objects stop at the end of the
+    first stream, while Lichess and FICS dumps hold many back to back.
+
+    The (bytes in, bytes out) position of each stream start is kept in
+    boundaries (most recent last); decompression can restart at any of
+    them with a fresh decompressor.
+
+    Args:
+        fmt: "bz2", "gzip", None for uncompressed data, or "auto" to detect
+             the format from the first bytes (input is held back until
+             three bytes have arrived)
+    """
+
+    def __init__(self, fmt="auto"):
+        self.fmt = fmt
+        self._decompressor = None if fmt == "auto" else self._new()
+        self._head = b""
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.boundaries = deque([(0, 0)], maxlen=STREAM_BOUNDARY_HISTORY)
+
+    def _new(self):
+        if self.fmt == "bz2":
+            return bz2.BZ2Decompressor()
+        if self.fmt == "gzip":
+            return zlib.decompressobj(wbits=31)
+        return None
+
+    def decompress(self, data):
+        if self.fmt == "auto":
+            self._head += data
+            if len(self._head) < 3:
+                return b""
+            data, self._head = self._head, b""
+            self.fmt = "bz2" if data.startswith(b"BZh") else "gzip" if data[:3] == GZIP_MAGIC else None
+            self._decompressor = self._new()
+        if self._decompressor is None:
+            self.bytes_in += len(data)
+            self.bytes_out += len(data)
+            return bytes(data)
+
+        output = []
+        while data:
+            output.append(self._decompressor.decompress(data))
+            self.bytes_out += len(output[-1])
+            if not self._decompressor.eof:
+                self.bytes_in += len(data)
+                break
+            unused = self._decompressor.unused_data
+            self.bytes_in += len(data) - len(unused)
+            self.boundaries.append((self.bytes_in, self.bytes_out))
+            data = unused
+            self._decompressor = self._new()
+        return b"".join(output)
+
+
+def find_bz2_streams(data):
+    """
+    Find the byte offsets of all bz2 streams in a buffer
+
+    Args:
+        data: bytes or mmap of a (possibly multi-stream) .bz2 archive
+
+    Returns:
+        Sorted list of stream start offsets
+    """
+    offsets = []
+    pos = data.find(BZ2_BLOCK_MAGIC, 4)
+    while pos != -1:
+        start = pos - 4
+        header = data[start:pos]
+        if header[:3] == b"BZh" and 0x31 <= header[3] <= 0x39:
+            offsets.append(start)
+        pos = data.find(BZ2_BLOCK_MAGIC, pos + 1)
+    if not offsets or offsets[0] != 0:
+        offsets.insert(0, 0)
+    return offsets
+
+
+def find_gzip_members(data):
+    """
+    Find the byte offsets of gzip members in a buffer
+
+    The 3-byte gzip magic can occur inside deflate data, so candidates
+    must also carry a plausible header (no reserved flag bits, a known
+    XFL value and OS byte). Single-member files yield just [0].
+
+    Args:
+        data: bytes or mmap of a .gz archive
+
+    Returns:
+        Sorted list of member start offsets
+    """
+    offsets = [0]
+    pos = data.find(GZIP_MAGIC, 1)
+    while pos != -1:
+        header = data[pos:pos + 10]
+        if (len(header) == 10 and header[3] & 0xE0 == 0
+                and header[8] in (0, 2, 4) and (header[9] <= 13 or header[9] == 255)):
+            offsets.append(pos)
+        pos = data.find(GZIP_MAGIC, pos + 1)
+    return offsets
+
+
+def plan_segments(offsets, total_size, segment_size=DEFAULT_SEGMENT_SIZE):
+    """
+    Group stream offsets into (start, end) byte ranges of roughly segment_size
+    """
+    segments = []
+    start = offsets[0]
+    for offset in offsets[1:]:
+        if offset - start >= segment_size:
+            segments.append((start, offset))
+            start = offset
+    segments.append((start, total_size))
+    return segments
+
+
+def _decompress_segment(path, fmt, start, end, output_path):
+    """
+    Decompress one byte range of whole streams into output_path (runs in a worker process)
+
+    The range is read and decompressed a block at a time, so the worker
+    never holds a whole segment.
+
+    Returns:
+        (output_path, worker pid, compressed size, decompressed size, seconds)
+    """
+    began = time.perf_counter()
+    decompressor = StreamDecompressor(fmt)
+    with open(path, 'rb') as f_in, open(output_path, 'wb') as f_out:
+        f_in.seek(start)
+        remaining = end - start
+        while remaining:
+            data = f_in.read(min(IO_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            f_out.write(decompressor.decompress(data))
+
+    # A complete range ends exactly where its last stream does
+    if remaining or decompressor.boundaries[-1][0] != decompressor.bytes_in:
+        raise ValueError(f"Truncated {fmt} stream in bytes {start}-{end} of {path}")
+    return output_path, os.getpid(), end - start, decompressor.bytes_out, time.perf_counter() - began
+
+
+def decompress_parallel(archive, output_file, max_games=None, workers=None,
+                        segment_size=DEFAULT_SEGMENT_SIZE):
+    """
+    Decompress a multi-stream .bz2 or .gz PGN archive using a process pool
+
+    Segments are decompressed out of order but written in order. Workers
+    write each segment to a scratch file next to output_file, which is
+    copied into the output block by block, so memory use does not depend
+    on the segment size or the number of segments in flight. When
+    max_games is set, output stops right after that many complete games
+    and outstanding work is cancelled. Archives with a single stream
+    cannot be split and are decompressed by one worker.
+
+    Args:
+        archive: Path to the .bz2 or .gz file
+        output_file: Path of the PGN file to write
+        max_games: Stop after this many games (None for the whole archive)
+        workers: Number of processes (defaults to os.cpu_count())
+        segment_size: Target compressed bytes per task
+
+    Returns:
+        Dictionary with games, byte counts, elapsed time and per-worker throughput
+    """
+    archive = Path(archive)
+    fmt = detect_format(archive)
+    workers = workers or os.cpu_count() or 1
+
+    total_size = archive.stat().st_size
+    with open(archive, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offsets = find_bz2_streams(mm) if fmt == "bz2" else find_gzip_members(mm)
+    segments = plan_segments(offsets, total_size, segment_size)
+
+    began = time.perf_counter()
+    per_worker = {}
+    games = 0
+    bytes_out = 0
+    carry = b""
+    done = False
+
+    scratch = Path(tempfile.mkdtemp(prefix=".decompress_", dir=Path(output_file).resolve().parent))
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(segments)))
+    try:
+        pending = deque()
+        remaining = enumerate(segments)
+
+        def submit_next():
+            number, segment = next(remaining, (None, None))
+            if segment is not None:
+                pending.append(executor.submit(_decompress_segment, str(archive), fmt, *segment,
+                                               str(scratch / f"segment_{number:06d}")))
+
+        # Keep a bounded window in flight so scratch disk use stays bounded
+        for _ in range(workers * 2):
+            submit_next()
+
+        with open(output_file, 'wb') as f_out:
+            while pending and not done:
+                segment_path, pid, size_in, size_out, seconds = pending.popleft().result()
+                submit_next()
+
+                stats = per_worker.setdefault(pid, {"segments": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0})
+                stats["segments"] += 1
+                stats["bytes_in"] += size_in
+                stats["bytes_out"] += size_out
+                stats["seconds"] += seconds
+
+                with open(segment_path, 'rb') as f_segment:
+                    for data in iter(lambda: f_segment.read(IO_BLOCK_SIZE), b""):
+                        # Prefix the last two bytes of the previous block so
+                        # boundaries spanning two blocks are still seen
+                        buf = carry + data
+                        if max_games is None:
+                            games += buf.count(GAME_BOUNDARY)
+                            f_out.write(data)
+                            bytes_out += len(data)
+                        else:
+                            cut = len(data)
+                            pos = buf.find(GAME_BOUNDARY)
+                            while pos != -1:
+                                games += 1
+                                if games >= max_games:
+                                    cut = max(pos + 2 - len(carry), 0)
+                                    done = True
+                                    break
+                                pos = buf.find(GAME_BOUNDARY, pos + 1)
+                            f_out.write(data[:cut])
+                            bytes_out += cut
+                        carry = buf[-2:]
+                        if done:
+                            break
+                os.remove(segment_path)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    # The last game has no following header to terminate it
+    if not done and bytes_out:
+        games += 1
+
+    elapsed = time.perf_counter() - began
+    for stats in per_worker.values():
+        seconds = stats["seconds"] or 1e-9
+        stats["mb_per_s_in"] = stats["bytes_in"] / (1024 * 1024) / seconds
+        stats["mb_per_s_out"] = stats["bytes_out"] / (1024 * 1024) / seconds
+
+    return {
+        "format": fmt,
+        "streams": len(offsets),
+        "segments": len(segments),
+        "games": games,
+        "bytes_in": total_size,
+        "bytes_out": bytes_out,
+        "elapsed": elapsed,
+        "workers": per_worker,
+    }
+
+
+def print_decompress_report(stats):
+    """
+    Print the throughput summary returned by decompress_parallel
+    """
+    elapsed = stats["elapsed"] or 1e-9
+    print(f"📦 {stats['format']}: {stats['streams']} streams in {stats['segments']} segments")
+    print(f"✅ {stats['games']} games, {stats['bytes_out'] / (1024*1024):.1f} MB written "
+          f"in {elapsed:.2f}s ({stats['bytes_out'] / (1024*1024) / elapsed:.1f} MB/s)")
+    for pid, worker in sorted(stats["workers"].items()):
+        print(f"   worker {pid}: {worker['segments']} segments, "
+              f"{worker['mb_per_s_in']:.1f} MB/s in, {worker['mb_per_s_out']:.1f} MB/s out")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python parallel_decompress.py ARCHIVE OUTPUT.pgn [MAX_GAMES] [WORKERS]")
+        sys.exit(1)
+
+    max_games = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    result = decompress_parallel(sys.argv[1], sys.argv[2], max_games=max_games, workers=workers)
+    print_decompress_report(result)
@@ -0,0 +1,281 @@
+"""
+Persistent byte-offset index for PGN datasets
+Stores one fixed-size record per game so games can be fetched by number
+"""
+
+import hashlib
+import io
+import mmap
+import struct
+import sys
+from pathlib import Path
+
+import chess.pgn
+import numpy as np
+
+from pgn_scan import (iter_game_spans, detect_boundary, split_game, parse_headers,
+                      count_plies, parse_elo, parse_time_control, result_code)
+
+INDEX_MAGIC = b"PGNIDX\x00\x00"
+INDEX_VERSION = 1
+
+# magic, version, record size, game count, indexed end offset, fingerprint
+INDEX_HEADER = struct.Struct("<8sIIQQ16s")
+INDEX_HEADER_SIZE = 64
+
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),
+    ("length", "<u4"),
+    ("white_elo", "<u2"),
+    ("black_elo", "<u2"),
+    ("tc_base", "<i4"),
+    ("tc_increment", "<i2"),
+    ("result", "i1"),       # 1 white win, 0 draw, -1 black win, -2 unknown
+    ("eco", "S3"),
+    ("plies", "<u2"),
+])
+
+INDEXED_TAGS = {b"WhiteElo", b"BlackElo", b"TimeControl", b"Result", b"ECO"}
+
+# Bytes before the indexed end that are hashed to detect rewrites
+FINGERPRINT_WINDOW = 4096
+
+
+def index_path_for(pgn_path):
+    """
+    Return the sidecar index path for a PGN file (game.pgn -> game.pgn.idx)
+    """
+    pgn_path = Path(pgn_path)
+    return pgn_path.with_name(pgn_path.name + ".idx")
+
+
+def _fingerprint(buf, end):
+    return hashlib.blake2b(buf[max(0, end - FINGERPRINT_WINDOW):end], digest_size=16).digest()
+
+
+def scan_records(buf, start=0):
+    """
+    Build index records for every game in buf starting at a byte offset
+
+    Args:
+        buf: bytes or mmap of the PGN file
+        start: Offset of the first game to index
+
+    Returns:
+        Structured NumPy array with INDEX_DTYPE
+    """
+    rows = []
+    boundary = detect_boundary(buf)
+    for game_start, game_end in iter_game_spans(buf, start, boundary):
+        header_block, movetext = split_game(buf[game_start:game_end])
+        headers = parse_headers(header_block, INDEXED_TAGS)
+        tc_base, tc_increment = parse_time_control(headers.get("TimeControl"))
+        result = result_code(headers.get("Result"))
+        rows.append((
+            game_start,
+            game_end - game_start,
+            min(parse_elo(headers.get("WhiteElo")), 65535),
+            min(parse_elo(headers.get("BlackElo")), 65535),
+            tc_base,
+            min(tc_increment, 32767),
+            -2 if result is None else result,
+            headers.get("ECO", "").encode('ascii', errors='ignore')[:3],
+            min(count_plies(movetext), 65535),
+        ))
+    return np.array(rows, dtype=INDEX_DTYPE)
+
+
+def _read_header(index_path):
+    with open(index_path, 'rb') as f:
+        raw = f.read(INDEX_HEADER.size)
+    if len(raw) < INDEX_HEADER.size:
+        return None
+    magic, version, record_size, count, indexed_end, fingerprint = INDEX_HEADER.unpack(raw)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION or record_size != INDEX_DTYPE.itemsize:
+        return None
+    return count, indexed_end, fingerprint
+
+
+def _write_index(index_path, records, indexed_end, fingerprint):
+    header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, INDEX_DTYPE.itemsize,
+                               len(records), indexed_end, fingerprint)
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(INDEX_HEADER_SIZE, b"\x00"))
+        f.write(records.tobytes())
+    tmp_path.replace(index_path)
+
+
+def build_index(pgn_path, index_path=None, verbose=True):
+    """
+    Create or update the sidecar index of a PGN file
+
+    If an index exists and the PGN has only been appended to since, just
+    the new games (plus the previous last game, in case it was still
+    being written) are scanned. Otherwise the index is rebuilt.
+
+    Args:
+        pgn_path: PGN file to index
+        index_path: Index location (defaults to <pgn>.idx)
+        verbose: Print a summary line
+
+    Returns:
+        GameIndex for the file
+    """
+    pgn_path = Path(pgn_path)
+    index_path = Path(index_path) if index_path else index_path_for(pgn_path)
+
+    size = pgn_path.stat().st_size
+    if size == 0:
+        _write_index(index_path, np.zeros(0, dtype=INDEX_DTYPE), 0, b"\x00" * 16)
+        return GameIndex(pgn_path, index_path)
+
+    existing = _read_header(index_path) if index_path.exists() else None
+
+    with open(pgn_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        kept = np.zeros(0, dtype=INDEX_DTYPE)
+        start = 0
+
+        if existing:
+            count, indexed_end, fingerprint = existing
+            if indexed_end <= size and _fingerprint(mm, indexed_end) == fingerprint:
+                if indexed_end == size:
+                    return GameIndex(pgn_path, index_path)
+                old = np.fromfile(index_path, dtype=INDEX_DTYPE, count=count, offset=INDEX_HEADER_SIZE)
+                if count:
+                    kept = old[:-1]
+                    start = int(old[-1]["offset"])
+
+        new = scan_records(mm, start)
+        records = np.concatenate([kept, new]) if len(kept) else new
+        _write_index(index_path, records, size, _fingerprint(mm, size))
+
+    if verbose:
+        mode = "Updated" if start else "Built"
+        print(f"🗂️  {mode} index: {len(records)} games ({len(new)} scanned) -> {index_path}")
+
+    return GameIndex(pgn_path, index_path)
+
+
+class GameIndex:
+    """
+    Random access to the games of an indexed PGN file
+
+    Records are memory-mapped from the sidecar file, so opening an index
+    is constant time and columns can be filtered with NumPy directly.
+    """
+
+    def __init__(self, pgn_path, index_path=None):
+        self.pgn_path = Path(pgn_path)
+        self.index_path = Path(index_path) if index_path else index_path_for(pgn_path)
+
+        header = _read_header(self.index_path)
+        if header is None:
+            raise ValueError(f"{self.index_path} is not a valid PGN index")
+        count = header[0]
+        if count:
+            self.records = np.memmap(self.index_path, dtype=INDEX_DTYPE, mode='r',
+                                     offset=INDEX_HEADER_SIZE, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=INDEX_DTYPE)
+        self._file = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, number):
+        return self.records[number]
+
+    def _pgn(self):
+        if self._file is None:
+            self._file = open(self.pgn_path, 'rb')
+        return self._file
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def read_game_bytes(self, number):
+        """
+        Return the raw PGN bytes of game number (0-based)
+        """
+        record = self.records[number]
+        f = self._pgn()
+        f.seek(int(record["offset"]))
+        return f.read(int(record["length"]))
+
+    def read_game_text(self, number):
+        """
+        Return the PGN text of game number (0-based)
+        """
+        return self.read_game_bytes(number).decode('utf-8', errors='replace')
+
+    def read_game(self, number):
+        """
+        Return game number (0-based) as a chess.pgn.Game
+        """
+        return chess.pgn.read_game(io.StringIO(self.read_game_text(number)))
+
+    def iter_game_bytes(self, numbers=None):
+        """
+        Yield raw game bytes for the given game numbers (all games by default)
+
+        Reads are issued in file order, which keeps disk access sequential.
+        """
+        if numbers is None:
+            numbers = range(len(self.records))
+        for number in sorted(numbers):
+            yield self.read_game_bytes(number)
+
+    def select(self, min_elo=None, max_elo=None, result=None, min_plies=None, eco_prefix=None):
+        """
+        Return the game numbers matching simple header criteria
+        """
+        records = self.records
+        mask = np.ones(len(records), dtype=bool)
+        if min_elo is not None:
+            mask &= (records["white_elo"] >= min_elo) & (records["black_elo"] >= min_elo)
+        if max_elo is not None:
+            mask &= (records["white_elo"] <= max_elo) & (records["black_elo"] <= max_elo)
+        if result is not None:
+            mask &= records["result"] == result
+        if min_plies is not None:
+            mask &= records["plies"] >= min_plies
+        if eco_prefix:
+            prefix = eco_prefix.encode('ascii')
+            mask &= np.char.startswith(records["eco"], prefix)
+        return np.flatnonzero(mask)
+
+    def sample(self, count, seed=None, numbers=None):
+        """
+        Return count game numbers drawn without replacement
+        """
+        rng = np.random.default_rng(seed)
+        population = np.arange(len(self.records)) if numbers is None else np.asarray(numbers)
+        count = min(count, len(population))
+        return np.sort(rng.choice(population, size=count, replace=False))
+
+    def write_games(self, numbers, output_file):
+        """
+        Copy the selected games into a new PGN file
+
+        Returns:
+            Number of games written
+        """
+        written = 0
+        with open(output_file, 'wb') as f_out:
+            for game in self.iter_game_bytes(numbers):
+                # The file's last game may lack its trailing blank line
+                f_out.write(game.rstrip() + b"\n\n")
+                written += 1
+        return written
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else Path("dataset") / "sample_training_dataset.pgn"
+    index = build_index(target)
+    print(f"✅ {len(index)} games indexed")
+    if len(index):
+        print(f"📊 Average plies: {index.records['plies'].mean():.1f}")
+        print(f"📊 Average Elo: {index.records['white_elo'].mean():.0f}")
@@ -0,0 +1,271 @@
+"""
+Byte-level PGN scanning helpers
+Finds game boundaries and reads header fields without parsing movetext
+"""
+
+import mmap
+import re
+from contextlib import contextmanager
+
+# A game ends at the blank line that precedes the next game's first tag
+GAME_BOUNDARY = b"\n\n["
+GAME_BOUNDARY_CRLF = b"\r\n\r\n["
+
+HEADER_RE = re.compile(rb'^\[(\w+)\s+"((?:[^"\\\r\n]|\\.)*)"\]', re.MULTILINE)
+
+# Comments and variations are removed before counting moves so clock
+# annotations and side lines are not mistaken for mainline moves
+COMMENT_RE = re.compile(rb"\{[^}]*\}|;[^\n]*")
+VARIATION_RE = re.compile(rb"\([^()]*\)")
+SAN_RE = re.compile(rb"(?<!\w)(?:[KQRBN][a-h]?[1-8]?x?[a-h][1-8]|[a-h](?:x[a-h])?[1-8](?:=?[QRBN])?|O-O(?:-O)?|0-0(?:-0)?)[+#]?")
+DIGITS = b"0123456789"
+
+RESULT_CODES = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}
+
+
+@contextmanager
+def open_pgn(path):
+    """
+    Memory-map a PGN file read-only (yields b"" for an empty file)
+    """
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuses zero-length files
+            yield b""
+            return
+        with mm:
+            yield mm
+
+
+def detect_boundary(buf):
+    """
+    Return the game boundary pattern matching the buffer's line endings
+    """
+    head = bytes(buf[:65536])
+    return GAME_BOUNDARY_CRLF if b"\r\n" in head else GAME_BOUNDARY
+
+
+def iter_game_spans(buf, start=0, boundary=None):
+    """
+    Yield (start, end) byte ranges of the games in a buffer
+
+    Each range includes the trailing blank line, so concatenating the
+    ranges reproduces the input. The final game runs to the end of the
+    buffer.
+
+    Args:
+        buf: bytes, bytearray or mmap holding PGN text
+        start: Offset of the first game to yield
+        boundary: Boundary pattern (detected from the buffer if omitted)
+    """
+    if boundary is None:
+        boundary = detect_boundary(buf)
+    skip = len(boundary) - 1
+    size = len(buf)
+
+    while start < size:
+        pos = buf.find(boundary, start)
+        if pos == -1:
+            if buf[start:size].strip():
+                yield start, size
+            return
+        end = pos + skip
+        yield start, end
+        start = end
+
+
+class GameSplitter:
+    """
+    Incremental splitter turning a stream of PGN bytes into whole games
+
+    Games are cut at the same boundaries as iter_game_spans, so the games
+    (plus the final flush) concatenate back to the input. Only the
+    unfinished game is kept between feeds: the consumed prefix is dropped
+    from the front of the bytearray (which CPython does without moving the
+    tail), and the boundary search resumes where the previous one stopped.
+
+    Example:
+        splitter = GameSplitter()
+        for chunk in chunks:
+            for game in splitter.feed(chunk):
+                f_out.write(game)
+        tail = splitter.flush()
+
+    Args:
+        boundary: Boundary pattern (detected from the first line ending if omitted)
+    """
+
+    def __init__(self, boundary=None):
+        self.boundary = boundary
+        self.buffer = bytearray()
+        self.start = 0
+        self.scanned = 0
+        self.games = 0
+
+    def feed(self, data):
+        """
+        Add bytes and yield every game they complete, as bytes
+
+        It is safe to stop iterating early; remaining games are returned by
+        the next feed() or flush().
+        """
+        if self.start:
+            del self.buffer[:self.start]
+            self.scanned = max(self.scanned - self.start, 0)
+            self.start = 0
+        self.buffer += data
+
+        if self.boundary is None:
+            if b"\n" not in self.buffer:
+                return
+            self.boundary = detect_boundary(self.buffer)
+        skip = len(self.boundary) - 1
+
+        pos = self.buffer.find(self.boundary, self.scanned)
+        while pos != -1:
+            end = pos + skip
+            game = bytes(self.buffer[self.start:end])
+            self.start = end
+            self.scanned = end
+            self.games += 1
+            yield game
+            pos = self.buffer.find(self.boundary, end)
+        self.scanned = max(self.start, len(self.buffer) - skip)
+
+    def flush(self):
+        """
+        Return the final game (not followed by a boundary), or None
+        """
+        tail = bytes(self.buffer[self.start:])
+        self.buffer = bytearray()
+        self.start = self.scanned = 0
+        if not tail.strip():
+            return None
+        self.games += 1
+        return tail
+
+
+def split_game(game):
+    """
+    Split raw game bytes into (header block, movetext)
+    """
+    pos = header_end(game, 0, len(game))
+    return game[:pos], game[pos:]
+
+
+def header_end(buf, start, end):
+    """
+    Return the offset of the blank line ending the header block of a game
+
+    Only the header bytes are searched, so callers can slice out the tags
+    without touching the movetext.
+    """
+    pos = buf.find(b"\n\n", start, end)
+    if pos == -1:
+        pos = buf.find(b"\r\n\r\n", start, end)
+        if pos == -1:
+            return end
+    return pos
+
+
+def header_value(header_block, name):
+    """
+    Return the value of one tag (as str) or None, without parsing the others
+
+    Args:
+        header_block: Raw bytes of the tag section
+        name: Tag name as bytes (e.g. b"WhiteElo")
+    """
+    key = b"[" + name + b' "'
+    pos = header_block.find(key)
+    if pos == -1:
+        return None
+    pos += len(key)
+    return header_block[pos:header_block.find(b'"', pos)].decode('utf-8', errors='replace')
+
+
+def parse_headers(header_block, tags=None):
+    """
+    Parse PGN tag pairs from a header block
+
+    Args:
+        header_block: Raw bytes of the tag section
+        tags: Optional set of tag names (bytes) to keep
+
+    Returns:
+        Dictionary of tag name to value (str)
+    """
+    headers = {}
+    for name, value in HEADER_RE.findall(header_block):
+        if tags is None or name in tags:
+            headers[name.decode('ascii')] = value.decode('utf-8', errors='replace')
+    return headers
+
+
+def count_plies(movetext):
+    """
+    Count the half-moves in a movetext block without building a board
+
+    The ply count is derived from the last move number ("N." or "N...")
+    plus the moves written after it, so only the tail of the game is
+    examined once comments and variations are out of the way.
+    """
+    if b"{" in movetext or b";" in movetext:
+        movetext = COMMENT_RE.sub(b" ", movetext)
+    while b"(" in movetext:
+        stripped = VARIATION_RE.sub(b" ", movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+
+    # Move numbers are the only tokens containing "."
+    dot = movetext.rfind(b".")
+    if dot == -1:
+        return len(SAN_RE.findall(movetext))
+
+    first_dot = dot
+    while first_dot > 0 and movetext[first_dot - 1] == 0x2E:
+        first_dot -= 1
+    digits = first_dot
+    while digits > 0 and movetext[digits - 1] in DIGITS:
+        digits -= 1
+    if digits == first_dot:
+        return len(SAN_RE.findall(movetext))
+
+    number = int(movetext[digits:first_dot])
+    black_to_move = dot - first_dot >= 2
+    return 2 * (number - 1) + black_to_move + len(SAN_RE.findall(movetext, dot + 1))
+
+
+def parse_elo(value):
+    """
+    Convert an Elo tag value to int (0 when missing or "?")
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_time_control(value):
+    """
+    Convert a TimeControl tag like "300+3" to (base seconds, increment)
+
+    Returns (-1, -1) for missing or non-standard values such as "-".
+    """
+    if not value:
+        return -1, -1
+    base, _, increment = value.partition("+")
+    try:
+        return int(base), int(increment or 0)
+    except ValueError:
+        return -1, -1
+
+
+def result_code(value):
+    """
+    Map a Result tag to 1 (white win), 0 (draw), -1 (black win) or None
+    """
+    return RESULT_CODES.get(value)
@@ -0,0 +1,691 @@
+"""
+Streaming filter pipeline for PGN datasets
+Chains predicates, samplers and sinks so a dataset is processed in a single pass
+"""
+
+import bisect
+import json
+import random
+import time
+from pathlib import Path
+
+from pgn_scan import (open_pgn, iter_game_spans, detect_boundary, header_end, header_value,
+                      parse_headers, count_plies, parse_elo, parse_time_control, result_code,
+                      COMMENT_RE, VARIATION_RE, SAN_RE)
+
+# Lichess speed classes, by estimated duration (base + 40 * increment)
+TIME_CONTROL_CLASSES = [
+    (29, "ultrabullet"),
+    (179, "bullet"),
+    (479, "blitz"),
+    (1499, "rapid"),
+]
+
+# Average-rating band boundaries used to stratify samples
+ELO_BANDS = (1000, 1400, 1800, 2200, 2600)
+RESULTS = ("1-0", "0-1", "1/2-1/2")
+
+
+def time_control_class(value):
+    """
+    Classify a TimeControl tag as ultrabullet/bullet/blitz/rapid/classical
+
+    Returns "correspondence" for "-" and "unknown" for missing values.
+    """
+    if value == "-":
+        return "correspondence"
+    base, increment = parse_time_control(value)
+    if base < 0:
+        return "unknown"
+    estimate = base + 40 * increment
+    for limit, name in TIME_CONTROL_CLASSES:
+        if estimate <= limit:
+            return name
+    return "classical"
+
+
+def elo_bands(bands=ELO_BANDS):
+    """
+    Return the band labels for the given boundaries, e.g. ["<1000", "1000-1399", ..., "2600+"]
+    """
+    labels = [f"<{bands[0]}"]
+    labels += [f"{low}-{high - 1}" for low, high in zip(bands, bands[1:])]
+    return labels + [f"{bands[-1]}+"]
+
+
+def elo_band(elo, bands=ELO_BANDS):
+    """
+    Label the band containing elo, or "unrated" for 0
+    """
+    if not elo:
+        return "unrated"
+    return elo_bands(bands)[bisect.bisect_right(bands, elo)]
+
+
+def balanced_quotas(total, bands=ELO_BANDS, time_controls=("bullet", "blitz", "rapid", "classical"),
+                    results=RESULTS):
+    """
+    Split a sample size evenly over every combination of the given strata
+
+    Returns:
+        Dictionary {(elo band, time-control class, result): quota} for
+        StratifiedSampler
+    """
+    strata = [(band, speed, result) for band in elo_bands(bands) for speed in time_controls for result in results]
+    base, extra = divmod(total, len(strata))
+    return {stratum: base + (number < extra) for number, stratum in enumerate(strata)}
+
+
+class GameRecord:
+    """
+    One game of the input, decoded lazily
+
+    Header values and the ply count are only computed when a stage asks
+    for them, so cheap predicates never touch the movetext.
+    """
+
+    __slots__ = ("buf", "view", "start", "end", "_split", "_header_block", "_headers", "_plies")
+
+    def __init__(self, buf, start, end, view=None):
+        self.buf = buf
+        self.view = view
+        self.start = start
+        self.end = end
+        self._split = None
+        self._header_block = None
+        self._headers = None
+        self._plies = None
+
+    @property
+    def split(self):
+        if self._split is None:
+            self._split = header_end(self.buf, self.start, self.end)
+        return self._split
+
+    @property
+    def raw(self):
+        """
+        Game bytes; a zero-copy memoryview when the pipeline provides one
+        """
+        source = self.view if self.view is not None else self.buf
+        return source[self.start:self.end]
+
+    @property
+    def header_block(self):
+        if self._header_block is None:
+            self._header_block = self.buf[self.start:self.split]
+        return self._header_block
+
+    @property
+    def movetext(self):
+        return self.buf[self.split:self.end]
+
+    def header(self, name):
+        """
+        Return one tag value by name (str), or None
+        """
+        if self._headers is not None:
+            return self._headers.get(name)
+        return header_value(self.header_block, name.encode('ascii'))
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = parse_headers(self.header_block)
+        return self._headers
+
+    @property
+    def plies(self):
+        if self._plies is None:
+            self._plies = count_plies(self.movetext)
+        return self._plies
+
+    @property
+    def white_elo(self):
+        return parse_elo(self.header("WhiteElo"))
+
+    @property
+    def black_elo(self):
+        return parse_elo(self.header("BlackElo"))
+
+    @property
+    def result(self):
+        return self.header("Result")
+
+
+class Stage:
+    """
+    Base class for pipeline stages
+
+    Subclasses implement process(game) and return False to drop the game.
+    Every stage counts games seen/kept and the time spent inside it.
+    """
+
+    name = "stage"
+
+    def __init__(self):
+        self.seen = 0
+        self.kept = 0
+        self.seconds = 0.0
+        # Set by stages (e.g. Limit) that will not accept further games
+        self.exhausted = False
+
+    def process(self, game):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {
+            "stage": self.name,
+            "seen": self.seen,
+            "kept": self.kept,
+            "dropped": self.seen - self.kept,
+            "seconds": self.seconds,
+            "games_per_s": self.seen / self.seconds if self.seconds else 0.0,
+        }
+
+
+class Predicate(Stage):
+    """
+    Stage that keeps games for which test(game) is true
+    """
+
+    def process(self, game):
+        return self.test(game)
+
+    def test(self, game):
+        raise NotImplementedError
+
+
+class EloRange(Predicate):
+    """
+    Keep games whose players are rated within [min_elo, max_elo]
+
+    Args:
+        min_elo: Lower bound (inclusive) or None
+        max_elo: Upper bound (inclusive) or None
+        both: Require both players in range (otherwise the average)
+    """
+
+    name = "elo_range"
+
+    def __init__(self, min_elo=None, max_elo=None, both=True):
+        super().__init__()
+        self.min_elo = min_elo
+        self.max_elo = max_elo
+        self.both = both
+
+    def test(self, game):
+        white, black = game.white_elo, game.black_elo
+        ratings = (white, black) if self.both else ((white + black) / 2,)
+        for elo in ratings:
+            if self.min_elo is not None and elo < self.min_elo:
+                return False
+            if self.max_elo is not None and elo > self.max_elo:
+                return False
+        return True
+
+
+class RatingGap(Predicate):
+    """
+    Keep games where the players' ratings differ by at most max_gap
+    """
+
+    name = "rating_gap"
+
+    def __init__(self, max_gap):
+        super().__init__()
+        self.max_gap = max_gap
+
+    def test(self, game):
+        return abs(game.white_elo - game.black_elo) <= self.max_gap
+
+
+class TimeControlClass(Predicate):
+    """
+    Keep games in the given speed classes (e.g. "blitz", "rapid")
+    """
+
+    name = "time_control"
+
+    def __init__(self, *classes):
+        super().__init__()
+        self.classes = set(classes)
+
+    def test(self, game):
+        return time_control_class(game.header("TimeControl")) in self.classes
+
+
+class ResultIs(Predicate):
+    """
+    Keep games with one of the given Result tags ("1-0", "0-1", "1/2-1/2")
+    """
+
+    name = "result"
+
+    def __init__(self, *results):
+        super().__init__()
+        self.results = set(results)
+
+    def test(self, game):
+        return game.result in self.results
+
+
+class EcoPrefix(Predicate):
+    """
+    Keep games whose ECO code starts with one of the prefixes (e.g. "B2", "C")
+    """
+
+    name = "eco"
+
+    def __init__(self, *prefixes):
+        super().__init__()
+        self.prefixes = tuple(prefixes)
+
+    def test(self, game):
+        return (game.header("ECO") or "").startswith(self.prefixes)
+
+
+class MinPlies(Predicate):
+    """
+    Keep games with at least min_plies half-moves
+    """
+
+    name = "min_plies"
+
+    def __init__(self, min_plies):
+        super().__init__()
+        self.min_plies = min_plies
+
+    def test(self, game):
+        return game.plies >= self.min_plies
+
+
+class Termination(Predicate):
+    """
+    Keep games with one of the given Termination tags (e.g. "Normal")
+    """
+
+    name = "termination"
+
+    def __init__(self, *values):
+        super().__init__()
+        self.values = set(values)
+
+    def test(self, game):
+        return game.header("Termination") in self.values
+
+
+class Limit(Stage):
+    """
+    Pass the first max_games games, then stop the pipeline
+    """
+
+    name = "limit"
+
+    def __init__(self, max_games):
+        super().__init__()
+        self.max_games = max_games
+
+    def process(self, game):
+        if self.kept >= self.max_games:
+            self.exhausted = True
+            return False
+        if self.kept + 1 >= self.max_games:
+            self.exhausted = True
+        return True
+
+
+class EveryNth(Stage):
+    """
+    Pass every n-th game
+    """
+
+    name = "every_nth"
+
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+
+    def process(self, game):
+        return self.seen % self.n == 0
+
+
+class RandomSample(Stage):
+    """
+    Pass each game independently with the given probability
+    """
+
+    name = "random_sample"
+
+    def __init__(self, rate, seed=None):
+        super().__init__()
+        self.rate = rate
+        self.random = random.Random(seed)
+
+    def process(self, game):
+        return self.random.random() < self.rate
+
+
+class StratifiedSampler(Stage):
+    """
+    Uniform random sample of each stratum in one pass (reservoir sampling)
+
+    Games are grouped by the Elo band of their average rating, their
+    time-control class and their result. Each stratum keeps a reservoir of
+    at most its quota; the n-th game of a stratum replaces a random slot
+    with probability quota / n, so every game of the stratum is equally
+    likely to be sampled wherever it appears in the input. Memory is
+    bounded by the quotas, not by the input size.
+
+    The sample is only known once the input ends, so the sampler passes
+    nothing downstream and close() writes the reservoirs to output_file in
+    input order. Place it last, after any predicates.
+
+    Args:
+        quotas: Games per stratum: one int for every stratum, or a dict
+                {(band, time_control, result): quota} such as the one
+                returned by balanced_quotas
+        output_file: PGN file written on close()
+        default: Quota of strata missing from a quotas dict
+        bands: Elo band boundaries
+        seed: Random seed, for a reproducible sample
+    """
+
+    name = "stratified_sample"
+
+    def __init__(self, quotas, output_file, default=0, bands=ELO_BANDS, seed=None):
+        super().__init__()
+        if isinstance(quotas, int):
+            quotas, default = {}, quotas
+        self.quotas = dict(quotas)
+        self.default = default
+        self.output_file = Path(output_file)
+        self.bands = bands
+        self.random = random.Random(seed)
+        self.reservoirs = {}
+        self.counts = {}
+        self.closed = False
+
+    def stratum(self, game):
+        white, black = game.white_elo, game.black_elo
+        elo = (white + black) / 2 if white and black else white or black
+        # A game without a Result tag counts as unfinished, like the PGN "*"
+        return (elo_band(elo, self.bands), time_control_class(game.header("TimeControl")), game.result or "*")
+
+    def process(self, game):
+        key = self.stratum(game)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        quota = self.quotas.get(key, self.default)
+        if not quota:
+            return False
+
+        reservoir = self.reservoirs.setdefault(key, [])
+        if len(reservoir) < quota:
+            reservoir.append((self.seen, bytes(game.raw)))
+        else:
+            slot = self.random.randrange(count)
+            if slot < quota:
+                reservoir[slot] = (self.seen, bytes(game.raw))
+        return False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        sample = sorted(entry for reservoir in self.reservoirs.values() for entry in reservoir)
+        with open(self.output_file, 'wb') as f_out:
+            for _, game in sample:
+                f_out.write(game)
+        self.kept = len(sample)
+
+    def strata(self):
+        """
+        Return {stratum: (games seen, games sampled)}
+        """
+        return {key: (count, len(self.reservoirs.get(key, ()))) for key, count in sorted(self.counts.items())}
+
+    def report(self):
+        """
+        Print games seen and sampled per stratum
+        """
+        print(f"🎯 Sampled {sum(len(r) for r in self.reservoirs.values())} of {self.seen} games "
+              f"from {len(self.counts)} strata")
+        print(f"   {'Elo':<10} {'Speed':<15} {'Result':<8} {'Seen':>10} {'Sampled':>8}")
+        for (band, speed, result), (count, sampled) in self.strata().items():
+            print(f"   {band:<10} {speed:<15} {result:<8} {count:>10} {sampled:>8}")
+
+
+class Sink(Stage):
+    """
+    Stage that consumes games; sinks never drop anything
+    """
+
+    def process(self, game):
+        self.consume(game)
+        return True
+
+    def consume(self, game):
+        raise NotImplementedError
+
+
+class PgnWriter(Sink):
+    """
+    Copy games to a PGN file byte for byte
+    """
+
+    name = "pgn_writer"
+
+    def __init__(self, output_file, buffer_size=4 << 20):
+        super().__init__()
+        self.output_file = Path(output_file)
+        self.f_out = open(self.output_file, 'wb', buffering=buffer_size)
+
+    def consume(self, game):
+        self.f_out.write(game.raw)
+
+    def close(self):
+        self.f_out.close()
+
+
+class TrainingRecordWriter(Sink):
+    """
+    Write one JSON line per game with its result and SAN moves
+
+    Moves come from the movetext tokens, so no board is replayed here;
+    positions are produced later by the encoder.
+    """
+
+    name = "training_records"
+
+    def __init__(self, output_file):
+        super().__init__()
+        self.output_file = Path(output_file)
+        self.f_out = open(self.output_file, 'w', encoding='utf-8')
+
+    def consume(self, game):
+        movetext = COMMENT_RE.sub(b" ", game.movetext)
+        while b"(" in movetext:
+            stripped = VARIATION_RE.sub(b" ", movetext)
+            if stripped == movetext:
+                break
+            movetext = stripped
+        record = {
+            "result": result_code(game.result),
+            "white_elo": game.white_elo,
+            "black_elo": game.black_elo,
+            "moves": [move.decode('ascii') for move in SAN_RE.findall(movetext)],
+        }
+        self.f_out.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.f_out.close()
+
+
+class StatsCollector(Sink):
+    """
+    Gather the dataset statistics that analyze_dataset used to compute
+    """
+
+    name = "stats"
+
+    def __init__(self, count_plies=False):
+        super().__init__()
+        self.count_plies = count_plies
+        self.elo_total = 0
+        self.elo_count = 0
+        self.elo_min = None
+        self.elo_max = None
+        self.total_plies = 0
+        self.time_controls = {}
+        self.results = {"1-0": 0, "0-1": 0, "1/2-1/2": 0}
+
+    def consume(self, game):
+        elo = game.header("WhiteElo")
+        if elo is not None and elo.isdigit():
+            elo = int(elo)
+            self.elo_total += elo
+            self.elo_count += 1
+            self.elo_min = elo if self.elo_min is None else min(self.elo_min, elo)
+            self.elo_max = elo if self.elo_max is None else max(self.elo_max, elo)
+
+        tc = game.header("TimeControl")
+        if tc is not None:
+            self.time_controls[tc] = self.time_controls.get(tc, 0) + 1
+
+        result = game.result
+        if result in self.results:
+            self.results[result] += 1
+
+        if self.count_plies:
+            self.total_plies += game.plies
+
+    def report(self):
+        """
+        Print the collected statistics
+        """
+        print(f"Total games: {self.seen}")
+        if self.elo_count:
+            print(f"Average ELO: {self.elo_total / self.elo_count:.0f}")
+            print(f"ELO range: {self.elo_min} - {self.elo_max}")
+        print(f"Time controls: {len(self.time_controls)} different types")
+        if self.count_plies and self.seen:
+            print(f"Average moves per game: {self.total_plies / self.seen:.1f}")
+
+
+class Pipeline:
+    """
+    Run games from a PGN file through a chain of stages in one pass
+
+    Each game visits the stages in order until one drops it. The run ends
+    early once a stage reports that it is exhausted (e.g. a Limit).
+
+    Example:
+        stats = StatsCollector()
+        Pipeline(EloRange(min_elo=1800), TimeControlClass("blitz"),
+                 PgnWriter("out.pgn"), stats).run("games.pgn")
+    """
+
+    def __init__(self, *stages):
+        self.stages = list(stages)
+        self.games_read = 0
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    def run(self, pgn_file):
+        """
+        Process every game in pgn_file and close the stages
+
+        Returns:
+            Number of games that passed all stages
+        """
+        began = time.perf_counter()
+        passed = 0
+
+        try:
+            with open_pgn(pgn_file) as buf:
+                view = memoryview(buf)
+                try:
+                    boundary = detect_boundary(buf)
+                    for start, end in iter_game_spans(buf, boundary=boundary):
+                        self.games_read += 1
+                        self.bytes_read += end - start
+                        if self._process(GameRecord(buf, start, end, view)):
+                            passed += 1
+                        if self.exhausted:
+                            break
+                finally:
+                    view.release()
+        finally:
+            self.close()
+            self.seconds += time.perf_counter() - began
+
+        return passed
+
+    def _process(self, game):
+        clock = time.perf_counter
+        for stage in self.stages:
+            stage.seen += 1
+            t0 = clock()
+            keep = stage.process(game)
+            stage.seconds += clock() - t0
+            if not keep:
+                return False
+            stage.kept += 1
+        return True
+
+    def feed(self, game_bytes):
+        """
+        Process one game given as bytes, e.g. from a GameSplitter
+
+        For streamed input, where there is no file to run(). Call close()
+        when the stream ends.
+
+        Returns:
+            True when the game passed all stages
+        """
+        began = time.perf_counter()
+        self.games_read += 1
+        self.bytes_read += len(game_bytes)
+        passed = self._process(GameRecord(game_bytes, 0, len(game_bytes)))
+        self.seconds += time.perf_counter() - began
+        return passed
+
+    @property
+    def exhausted(self):
+        """
+        True once a stage will not accept further games
+        """
+        return any(stage.exhausted for stage in self.stages)
+
+    def close(self):
+        for stage in self.stages:
+            stage.close()
+
+    def stats(self):
+        """
+        Return per-stage counters plus overall throughput
+        """
+        seconds = self.seconds or 1e-9
+        return {
+            "games_read": self.games_read,
+            "bytes_read": self.bytes_read,
+            "seconds": self.seconds,
+            "games_per_s": self.games_read / seconds,
+            "mb_per_s": self.bytes_read / (1024 * 1024) / seconds,
+            "stages": [stage.stats() for stage in self.stages],
+        }
+
+    def report(self):
+        """
+        Print per-stage counters and throughput
+        """
+        summary = self.stats()
+        print(f"⚙️  Pipeline: {summary['games_read']} games in {summary['seconds']:.2f}s "
+              f"({summary['games_per_s']:.0f} games/s, {summary['mb_per_s']:.1f} MB/s)")
+        for stage in summary["stages"]:
+            print(f"   {stage['stage']:<16} seen {stage['seen']:>9}  kept {stage['kept']:>9}  "
+                  f"dropped {stage['dropped']:>9}  {stage['games_per_s']:>12.0f} games/s")
@@ -0,0 +1,272 @@
+"""
+Compact binary training-record format
+Fixed-width position records that are memory-mapped and expanded to planes per batch
+"""
+
+import struct
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from encoder import (ENCODER_VERSION, HISTORY_STEPS, iter_encoded_games, planes_from_features)
+from pgn_scan import open_pgn, iter_game_spans, detect_boundary
+
+RECORD_MAGIC = b"CHSREC\x00\x00"
+RECORD_VERSION = 1
+
+# magic, format version, record size, encoder version, position count
+FILE_HEADER = struct.Struct("<8sHHIQ")
+FILE_HEADER_SIZE = 64
+
+# One position per record (108 bytes). Records of a game are stored
+# contiguously in move order, so history is found by stepping back.
+RECORD_DTYPE = np.dtype([
+    ("bitboards", "<u8", (12,)),  # piece bitboards in encoder.PIECE_ORDER
+    ("flags", "u1"),              # bit 0 white to move, bits 1-4 castling KQkq, FLAG_* bits
+    ("ep_file", "u1"),            # en-passant file + 1, 0 when none
+    ("rule50", "u1"),             # halfmove clock (clipped to 255)
+    ("repetitions", "u1"),        # earlier occurrences of this position (0-2)
+    ("fullmove", "<u2"),          # full move number
+    ("history", "<u2"),           # preceding records of the same game
+    ("policy", "<u2"),            # index into encoder.POLICY_MOVES
+    ("value", "i1"),              # result for the side to move: 1, 0, -1
+    ("score", "i1"),              # mean merged result * 100 when FLAG_MERGED is set
+])
+
+# Set by dedup.py. A duplicate record is kept in the shard as history for
+# the records after it, but is not sampled; the first occurrence of the
+# position carries the merged result of all occurrences in score.
+FLAG_DUPLICATE = 1 << 5
+FLAG_MERGED = 1 << 6
+
+RECORD_EXTENSION = ".rec"
+DEFAULT_SHARD_SIZE = 1 << 20      # positions per shard (about 108 MB)
+
+
+def positions_to_records(positions):
+    """
+    Convert encoder.game_positions output to a record array
+    """
+    count = len(positions["policy"])
+    scalars = positions["scalars"].astype(np.uint32)
+    records = np.zeros(count, dtype=RECORD_DTYPE)
+
+    records["bitboards"] = positions["bitboards"][:count]
+    records["flags"] = (scalars[:, 0] | (scalars[:, 2] << 1) | (scalars[:, 3] << 2)
+                        | (scalars[:, 4] << 3) | (scalars[:, 5] << 4))
+    ep = positions["ep_square"].astype(np.int16)
+    records["ep_file"] = np.where(ep >= 0, (ep & 7) + 1, 0)
+    records["rule50"] = np.minimum(scalars[:, 6], 255)
+    records["repetitions"] = positions["repetitions"][:count]
+    records["fullmove"] = np.minimum(scalars[:, 1], 65535)
+    records["history"] = np.minimum(np.arange(count), 65535)
+    records["policy"] = positions["policy"]
+    records["value"] = positions["value"]
+    return records
+
+
+def records_scalars(records):
+    """
+    Rebuild the encoder's (N, 7) constant-plane values from records
+    """
+    flags = records["flags"].astype(np.uint16)
+    return np.stack([
+        flags & 1,
+        records["fullmove"],
+        (flags >> 1) & 1,
+        (flags >> 2) & 1,
+        (flags >> 3) & 1,
+        (flags >> 4) & 1,
+        records["rule50"],
+    ], axis=1)
+
+
+def expand_planes(records, indices, dtype=np.float32):
+    """
+    Expand the records at the given indices into (N, 119, 8, 8) planes
+
+    History steps are gathered from the preceding records of the same
+    game, so only the requested batch is ever materialised as planes.
+
+    Args:
+        records: Record array (usually a memmap of a whole shard)
+        indices: 1-D array of record indices
+        dtype: Output dtype
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    steps = np.arange(HISTORY_STEPS)
+    available = records["history"][indices].astype(np.int64)
+    valid = steps[None, :] <= available[:, None]
+    rows = np.where(valid, indices[:, None] - steps[None, :], 0)
+
+    history_bitboards = records["bitboards"][rows]
+    history_bitboards[~valid] = 0
+    history_repetitions = records["repetitions"][rows]
+    history_repetitions[~valid] = 0
+
+    return planes_from_features(history_bitboards, history_repetitions,
+                                records_scalars(records[indices]), dtype)
+
+
+class RecordFile:
+    """
+    Read-only, memory-mapped view of one record shard
+
+    Nothing is copied on open; planes are built per batch with
+    batch(indices).
+    """
+
+    def __init__(self, path, writable=False):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            header = f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise ValueError(f"{self.path} is too short to be a record file")
+        magic, version, record_size, encoder_version, count = FILE_HEADER.unpack(header)
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"{self.path} is not a record file")
+        if version != RECORD_VERSION or record_size != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{self.path} has unsupported record format v{version} ({record_size} bytes)")
+        self.encoder_version = encoder_version
+
+        if count:
+            self.records = np.memmap(self.path, dtype=RECORD_DTYPE, mode='r+' if writable else 'r',
+                                     offset=FILE_HEADER_SIZE, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def sample_indices(self):
+        """
+        Indices of the records used as training samples (not duplicates)
+        """
+        duplicate = (self.records["flags"] & FLAG_DUPLICATE) != 0
+        if not duplicate.any():
+            return np.arange(len(self.records))
+        return np.flatnonzero(~duplicate)
+
+    def batch(self, indices, dtype=np.float32):
+        """
+        Return (planes, policy, value) for the given record indices
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        records = self.records[indices]
+        planes = expand_planes(self.records, indices, dtype)
+        merged = (records["flags"] & FLAG_MERGED) != 0
+        value = np.where(merged, records["score"] / 100, records["value"]).astype(np.float32)
+        return planes, records["policy"].astype(np.int64), value
+
+
+def write_records(path, records):
+    """
+    Write a complete record file in one go
+    """
+    path = Path(path)
+    header = FILE_HEADER.pack(RECORD_MAGIC, RECORD_VERSION, RECORD_DTYPE.itemsize,
+                              ENCODER_VERSION, len(records))
+    with open(path, 'wb') as f:
+        f.write(header.ljust(FILE_HEADER_SIZE, b"\x00"))
+        f.write(np.ascontiguousarray(records, dtype=RECORD_DTYPE).tobytes())
+    return path
+
+
+class RecordShardWriter:
+    """
+    Append games to record shards of at most shard_size positions
+
+    A game is never split across shards, so every record's history lives
+    in the same file.
+    """
+
+    def __init__(self, output_dir, shard_size=DEFAULT_SHARD_SIZE, prefix="shard"):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.chunks = []
+        self.pending = 0
+        self.paths = []
+        self.positions = 0
+
+    def add(self, positions):
+        """
+        Add one game (encoder.game_positions output)
+        """
+        records = positions_to_records(positions)
+        if self.pending and self.pending + len(records) > self.shard_size:
+            self._flush()
+        self.chunks.append(records)
+        self.pending += len(records)
+
+    def _flush(self):
+        path = self.output_dir / f"{self.prefix}_{len(self.paths):05d}{RECORD_EXTENSION}"
+        write_records(path, np.concatenate(self.chunks))
+        self.paths.append(path)
+        self.positions += self.pending
+        self.chunks = []
+        self.pending = 0
+
+    def close(self):
+        """
+        Write the last shard and return all shard paths
+        """
+        if self.pending:
+            self._flush()
+        return self.paths
+
+
+def encode_pgn(pgn_file, output_dir, shard_size=DEFAULT_SHARD_SIZE, max_games=None, prefix="shard"):
+    """
+    Encode every game of a PGN file into record shards
+
+    Args:
+        pgn_file: Input PGN
+        output_dir: Directory for the shards
+        shard_size: Maximum positions per shard
+        max_games: Stop after this many encoded games
+        prefix: Shard file name prefix
+
+    Returns:
+        Dictionary with games, skipped, positions, seconds, positions_per_s, shards
+    """
+    print(f"\n🧮 Encoding {pgn_file} -> {output_dir}")
+    began = time.perf_counter()
+    stats = {}
+    writer = RecordShardWriter(output_dir, shard_size, prefix)
+
+    with open_pgn(pgn_file) as buf:
+        spans = iter_game_spans(buf, boundary=detect_boundary(buf))
+        for positions in iter_encoded_games(buf, spans, stats):
+            writer.add(positions)
+            if stats["games"] % 1000 == 0:
+                elapsed = time.perf_counter() - began
+                print(f"  Encoded {stats['games']} games, "
+                      f"{(writer.positions + writer.pending) / elapsed:.0f} positions/s...")
+            if max_games is not None and stats["games"] >= max_games:
+                break
+
+    paths = writer.close()
+    elapsed = time.perf_counter() - began
+    size = sum(path.stat().st_size for path in paths)
+    stats.update({
+        "positions": writer.positions,
+        "bytes": size,
+        "seconds": elapsed,
+        "positions_per_s": writer.positions / elapsed if elapsed else 0.0,
+        "shards": [str(path) for path in paths],
+    })
+
+    print(f"✅ Encoded {stats['games']} games ({stats['skipped']} skipped)")
+    print(f"📊 Positions: {stats['positions']} in {len(paths)} shards "
+          f"({stats['positions_per_s']:.0f} positions/s, {size / (1024*1024):.2f} MB)")
+    return stats
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else Path("dataset") / "sample_training_dataset.pgn"
+    target = sys.argv[2] if len(sys.argv) > 2 else Path("dataset") / "encoded"
+    encode_pgn(source, target)
@@ -0,0 +1,403 @@
+"""
+Self-play game generation with batched Monte Carlo tree search
+Plays many games per process, evaluating the leaves of all of them in one model call per round
+"""
+
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+from pathlib import Path
+
+import chess
+import chess.polyglot
+import numpy as np
+
+from encoder import HISTORY_STEPS, board_bitboards, board_scalars, planes_from_features, policy_index
+from telemetry import stage
+
+DEFAULT_SIMULATIONS = 100
+DEFAULT_PARALLEL_GAMES = 32
+DEFAULT_MAX_PLIES = 300          # longer games are adjudicated as draws
+C_PUCT = 1.5
+DIRICHLET_ALPHA = 0.3
+DIRICHLET_WEIGHT = 0.25
+TEMPERATURE_PLIES = 30           # moves are sampled by visit count before this ply
+VIRTUAL_LOSS = 1.0
+
+
+def load_evaluator(model_path, threads=None):
+    """
+    Return a function mapping (N, 119, 8, 8) planes to (policy logits, values)
+
+    .onnx files run on onnxruntime; anything else is loaded as a ChessNet
+    state_dict for PyTorch.
+    """
+    if str(model_path).endswith(".onnx"):
+        from inference_server import load_session
+
+        session = load_session(model_path, threads)
+        input_name = session.get_inputs()[0].name
+
+        def evaluate(planes):
+            policy, value = session.run(None, {input_name: planes})
+            return policy, value.reshape(-1)
+        return evaluate
+
+    import torch
+    from train import ChessNet
+
+    if threads:
+        torch.set_num_threads(threads)
+    model = ChessNet()
+    model.load_state_dict(torch.load(model_path, map_location="cpu"))
+    model.eval()
+
+    def evaluate(planes):
+        with torch.inference_mode():
+            policy, value = model(torch.from_numpy(planes))
+        return policy.numpy(), value.numpy().reshape(-1)
+    return evaluate
+
+
+class Node:
+    """
+    One position in the search: priors and edge statistics of its legal moves
+
+    W holds values from the point of view of the side to move here.
+    """
+
+    __slots__ = ("moves", "priors", "raw_priors", "N", "W", "terminal")
+
+    def __init__(self, moves, priors, terminal=None):
+        self.moves = moves
+        self.priors = priors
+        self.raw_priors = priors
+        self.N = np.zeros(len(moves), dtype=np.float32)
+        self.W = np.zeros(len(moves), dtype=np.float32)
+        self.terminal = terminal
+
+    def select(self):
+        total = self.N.sum()
+        q = np.divide(self.W, self.N, out=np.zeros_like(self.W), where=self.N > 0)
+        u = C_PUCT * self.priors * math.sqrt(total + 1) / (1 + self.N)
+        return int(np.argmax(q + u))
+
+
+def _repetition_key(board):
+    # Same key as the encoder's repetition planes
+    return board_bitboards(board), board.turn, board.castling_rights, board.ep_square
+
+
+def _terminal_value(board, repetitions):
+    """
+    Value for the side to move if the game is over, else None
+    """
+    if board.is_checkmate():
+        return -1.0
+    if repetitions >= 2 or board.halfmove_clock >= 150 or board.is_insufficient_material() \
+            or not any(board.generate_legal_moves()):
+        return 0.0
+    return None
+
+
+class SelfPlayGame:
+    """
+    State of one game: the board, the encoder history and its search tree
+
+    The transposition table maps Zobrist keys to nodes, so a position
+    reached by different move orders is searched once and the subtree
+    under the chosen move is reused on the next turn.
+    """
+
+    def __init__(self, rng, max_plies=DEFAULT_MAX_PLIES):
+        self.rng = rng
+        self.max_plies = max_plies
+        self.board = chess.Board()
+        self.sans = []
+        self.history = [(board_bitboards(self.board), 0)]
+        self.seen = {_repetition_key(self.board): 1}
+        self.table = {}
+        self.result = None
+        self.termination = None
+
+    def leaf_features(self, board, path_positions):
+        """
+        Encoder inputs for a leaf: last 8 bitboards, repetition counts and scalars
+        """
+        steps = (self.history + path_positions)[-HISTORY_STEPS:][::-1]
+        bitboards = np.zeros((HISTORY_STEPS, 12), dtype=np.uint64)
+        repetitions = np.zeros(HISTORY_STEPS, dtype=np.uint8)
+        for step, (pieces, count) in enumerate(steps):
+            bitboards[step] = pieces
+            repetitions[step] = count
+        return bitboards, repetitions, board_scalars(board)
+
+    def select_leaf(self):
+        """
+        Walk down the tree from the root applying virtual loss
+
+        Returns:
+            (path, leaf) where path is a list of (node, move number) and
+            leaf is None when the walk ended in a known terminal node,
+            else (key, board, features)
+        """
+        board = self.board.copy(stack=False)
+        key = chess.polyglot.zobrist_hash(board)
+        path = []
+        path_positions = []
+        path_counts = {}
+
+        while True:
+            node = self.table.get(key)
+            if node is None:
+                if path:
+                    terminal = _terminal_value(board, path_positions[-1][1])
+                    if terminal is not None:
+                        if board.halfmove_clock < 150:
+                            # Mate, stalemate and dead positions do not depend on the path
+                            self.table[key] = Node([], np.zeros(0, dtype=np.float32), terminal)
+                        return path, terminal
+                return path, (key, board, self.leaf_features(board, path_positions))
+            if node.terminal is not None:
+                return path, node.terminal
+
+            number = node.select()
+            node.N[number] += VIRTUAL_LOSS
+            node.W[number] -= VIRTUAL_LOSS
+            path.append((node, number))
+            board.push(node.moves[number])
+            key = chess.polyglot.zobrist_hash(board)
+
+            repetition = _repetition_key(board)
+            count = self.seen.get(repetition, 0) + path_counts.get(repetition, 0)
+            path_counts[repetition] = path_counts.get(repetition, 0) + 1
+            path_positions.append((repetition[0], min(count, 2)))
+            if count >= 2:
+                # Threefold repetition inside the search is a draw
+                return path, 0.0
+
+    def expand(self, key, board, logits):
+        moves = list(board.legal_moves)
+        indices = [policy_index(move, board.turn) for move in moves]
+        scores = logits[indices].astype(np.float64)
+        priors = np.exp(scores - scores.max())
+        self.table[key] = Node(moves, (priors / priors.sum()).astype(np.float32))
+
+    @staticmethod
+    def backup(path, value):
+        """
+        Propagate a leaf value (for the side to move at the leaf) up the path
+        """
+        for node, number in reversed(path):
+            value = -value
+            node.N[number] += 1 - VIRTUAL_LOSS
+            node.W[number] += value + VIRTUAL_LOSS
+
+    def add_root_noise(self):
+        root = self.table.get(chess.polyglot.zobrist_hash(self.board))
+        if root is None:
+            return
+        noise = self.rng.dirichlet([DIRICHLET_ALPHA] * len(root.moves))
+        root.priors = ((1 - DIRICHLET_WEIGHT) * root.raw_priors + DIRICHLET_WEIGHT * noise).astype(np.float32)
+
+    def play_move(self):
+        """
+        Pick a move from the root visit counts and advance the game
+        """
+        root = self.table[chess.polyglot.zobrist_hash(self.board)]
+        root.priors = root.raw_priors
+        if len(self.sans) < TEMPERATURE_PLIES:
+            number = int(self.rng.choice(len(root.moves), p=root.N / root.N.sum()))
+        else:
+            number = int(np.argmax(root.N))
+        move = root.moves[number]
+        self.sans.append(self.board.san(move))
+        self.board.push(move)
+
+        repetition = _repetition_key(self.board)
+        count = self.seen.get(repetition, 0)
+        self.seen[repetition] = count + 1
+        self.history.append((repetition[0], min(count, 2)))
+
+        terminal = _terminal_value(self.board, count)
+        if terminal is not None:
+            if terminal < 0:
+                self.result = "0-1" if self.board.turn == chess.WHITE else "1-0"
+                self.termination = "Normal"
+            else:
+                self.result = "1/2-1/2"
+                self.termination = "Normal"
+        elif len(self.sans) >= self.max_plies:
+            self.result = "1/2-1/2"
+            self.termination = "Adjudication"
+
+    def pgn(self, round_number, date):
+        moves = []
+        for ply, san in enumerate(self.sans):
+            moves.append(f"{ply // 2 + 1}. {san}" if ply % 2 == 0 else san)
+        return (
+            f'[Event "Self-Play"]\n'
+            f'[Site "MCTS"]\n'
+            f'[Date "{date}"]\n'
+            f'[Round "{round_number}"]\n'
+            f'[White "ChessNet"]\n'
+            f'[Black "ChessNet"]\n'
+            f'[Result "{self.result}"]\n'
+            f'[TimeControl "-"]\n'
+            f'[Termination "{self.termination}"]\n'
+            f'\n'
+            f'{" ".join(moves)} {self.result}\n\n'
+        )
+
+
+def play_games(evaluate, count, simulations=DEFAULT_SIMULATIONS, seed=0, first_round=1,
+               max_plies=DEFAULT_MAX_PLIES):
+    """
+    Play count games at once in this process
+
+    Each round takes one leaf from every unfinished game and evaluates
+    them all with one call to evaluate.
+
+    Returns:
+        (PGN text, stats dictionary)
+    """
+    rng = np.random.default_rng(seed)
+    games = [SelfPlayGame(rng, max_plies) for _ in range(count)]
+    stats = {"games": count, "nodes": 0, "evaluations": 0, "batches": 0, "eval_seconds": 0.0, "plies": 0}
+    date = datetime.now().strftime("%Y.%m.%d")
+    began = time.perf_counter()
+
+    active = list(games)
+    while active:
+        # A game's root is expanded by its first simulation of a turn
+        visits = {id(game): 0 for game in active}
+        for game in active:
+            game.add_root_noise()
+        while True:
+            searching = [game for game in active if visits[id(game)] < simulations + 1]
+            if not searching:
+                break
+            leaves = []
+            for game in searching:
+                path, leaf = game.select_leaf()
+                visits[id(game)] += 1
+                stats["nodes"] += 1
+                if isinstance(leaf, float):
+                    game.backup(path, leaf)
+                else:
+                    leaves.append((game, path, leaf))
+            if not leaves:
+                continue
+
+            bitboards, repetitions, scalars = zip(*(leaf[2] for _, _, leaf in leaves))
+            planes = planes_from_features(np.array(bitboards), np.array(repetitions), np.array(scalars))
+            t0 = time.perf_counter()
+            logits, values = evaluate(planes)
+            stats["eval_seconds"] += time.perf_counter() - t0
+            stats["evaluations"] += len(leaves)
+            stats["batches"] += 1
+
+            for (game, path, (key, board, _)), game_logits, value in zip(leaves, logits, values):
+                if key not in game.table:
+                    game.expand(key, board, game_logits)
+                    if not path:
+                        game.add_root_noise()
+                game.backup(path, float(value))
+
+        for game in active:
+            game.play_move()
+            stats["plies"] += 1
+        active = [game for game in active if game.result is None]
+
+    stats["seconds"] = time.perf_counter() - began
+    text = "".join(game.pgn(first_round + number, date) for number, game in enumerate(games))
+    return text, stats
+
+
+def _play_batch(model_path, threads, count, simulations, seed, first_round, max_plies):
+    """
+    Worker entry point: load the model and play one batch of games
+    """
+    evaluate = load_evaluator(model_path, threads)
+    return play_games(evaluate, count, simulations, seed, first_round, max_plies)
+
+
+def generate_self_play(model_path, num_games=64, output_file=None, simulations=DEFAULT_SIMULATIONS,
+                       parallel_games=DEFAULT_PARALLEL_GAMES, workers=None, max_plies=DEFAULT_MAX_PLIES,
+                       seed=None):
+    """
+    Generate self-play games into a PGN file
+
+    Args:
+        model_path: Exported .onnx model or ChessNet .pth checkpoint
+        num_games: Games to play
+        output_file: Output PGN (defaults to dataset/self_play.pgn)
+        simulations: MCTS simulations per move
+        parallel_games: Games searched together in one process (the batch size)
+        workers: Worker processes (defaults to os.cpu_count())
+        max_plies: Games reaching this length are adjudicated as draws
+        seed: Seed for the Dirichlet noise and move sampling
+
+    Returns:
+        Stats dictionary including nodes_per_s and games_per_hour
+    """
+    if output_file is None:
+        data_dir = Path("dataset")
+        data_dir.mkdir(exist_ok=True)
+        output_file = data_dir / "self_play.pgn"
+    output_file = Path(output_file)
+    workers = workers or os.cpu_count() or 1
+    seed = random.randrange(2**32) if seed is None else seed
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    tasks = [(first, min(parallel_games, num_games - first)) for first in range(0, num_games, parallel_games)]
+    print(f"\n♟️  Self-play: {num_games} games, {simulations} simulations per move, "
+          f"{parallel_games} games per batch on {workers} workers")
+
+    began = time.perf_counter()
+    totals = {"games": 0, "nodes": 0, "evaluations": 0, "batches": 0, "plies": 0, "eval_seconds": 0.0}
+    with stage("self_play", total=num_games, unit="games_kept") as metrics, \
+            ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(output_file, 'w', encoding='utf-8', newline='\n') as f:
+        results = executor.map(_play_batch, repeat(str(model_path)), repeat(threads),
+                               [count for _, count in tasks], repeat(simulations),
+                               [seed + number for number in range(len(tasks))],
+                               [first + 1 for first, _ in tasks], repeat(max_plies))
+        for text, stats in results:
+            f.write(text)
+            for name in totals:
+                totals[name] += stats[name]
+            metrics.add(bytes_out=len(text), games_seen=stats["games"], games_kept=stats["games"],
+                        nodes=stats["nodes"])
+            elapsed = time.perf_counter() - began
+            print(f"  Played {totals['games']}/{num_games} games ({totals['nodes'] / elapsed:.0f} nodes/s)...")
+
+    elapsed = time.perf_counter() - began
+    totals["seconds"] = elapsed
+    totals["nodes_per_s"] = totals["nodes"] / elapsed
+    totals["games_per_hour"] = totals["games"] / elapsed * 3600
+    totals["mean_batch"] = totals["evaluations"] / totals["batches"] if totals["batches"] else 0.0
+
+    print(f"\n✅ {totals['games']} games ({totals['plies']} plies) in {elapsed:.1f}s")
+    print(f"📊 {totals['nodes_per_s']:.0f} nodes/s, {totals['games_per_hour']:.0f} games/hour, "
+          f"mean batch {totals['mean_batch']:.1f}, "
+          f"{totals['eval_seconds'] / elapsed / workers * 100:.0f}% of worker time in the model")
+    print(f"📁 Output file: {output_file}")
+    return totals
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    model = args[0] if args else Path("models") / "chess_model_web.onnx"
+    num_games = int(args[1]) if len(args) > 1 else 64
+    generate_self_play(model, num_games, options.get("output"),
+                       simulations=int(options.get("simulations", DEFAULT_SIMULATIONS)),
+                       parallel_games=int(options.get("parallel", DEFAULT_PARALLEL_GAMES)),
+                       workers=int(options["workers"]) if "workers" in options else None,
+                       seed=int(options["seed"]) if "seed" in options else None)
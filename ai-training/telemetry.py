@@ -0,0 +1,282 @@
+"""
+Structured telemetry for the dataset tools
+Per-stage counters, timers, rates and ETA written as JSON lines or a Prometheus textfile
+"""
+
+import cProfile
+import json
+import os
+import socket
+import sys
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+# Counters every stage reports, even when they stay at zero
+COUNTERS = ("bytes_in", "bytes_out", "games_seen", "games_kept", "games_dropped", "games_malformed")
+
+# Telemetry is configured from the environment so every script can be
+# instrumented in a batch job without new command-line flags
+ENV_JSONL = "CHESS_TELEMETRY_JSONL"        # path, or "-" for stderr
+ENV_PROMETHEUS = "CHESS_TELEMETRY_PROM"    # node_exporter textfile path
+ENV_PROFILE = "CHESS_TELEMETRY_PROFILE"    # "cprofile" or "tracemalloc"
+ENV_PROFILE_DIR = "CHESS_TELEMETRY_PROFILE_DIR"
+ENV_INTERVAL = "CHESS_TELEMETRY_INTERVAL"  # seconds between progress events
+
+DEFAULT_INTERVAL = 10.0
+DEFAULT_PROFILE_DIR = Path("telemetry")
+PROMETHEUS_PREFIX = "chess_dataset"
+TRACEMALLOC_TOP = 10
+
+
+class StageMetrics:
+    """
+    Counters and timer of one running stage
+
+    Args:
+        telemetry: Owning Telemetry
+        name: Stage name
+        total: Expected final value of the unit counter (enables ETA)
+        unit: Counter that measures progress towards total
+    """
+
+    def __init__(self, telemetry, name, total=None, unit="games_seen"):
+        self.telemetry = telemetry
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started = time.time()
+        self._began = time.perf_counter()
+        self._last_emit = self._began
+        self.extra = {}
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._began
+
+    def add(self, **counts):
+        """
+        Increment counters; emits a progress event at most once per interval
+        """
+        for name, count in counts.items():
+            self.counters[name] = self.counters.get(name, 0) + count
+        if self.telemetry.enabled:
+            now = time.perf_counter()
+            if now - self._last_emit >= self.telemetry.interval:
+                self._last_emit = now
+                self.telemetry.emit(self.snapshot("progress"))
+
+    def set_total(self, total, unit=None):
+        self.total = total
+        if unit:
+            self.unit = unit
+
+    def snapshot(self, event):
+        """
+        Return the stage state as a flat, JSON-serialisable dictionary
+        """
+        elapsed = self.elapsed
+        record = {
+            "ts": time.time(),
+            "run": self.telemetry.run_id,
+            "host": self.telemetry.host,
+            "stage": self.name,
+            "event": event,
+            "elapsed_s": round(elapsed, 6),
+        }
+        record.update(self.counters)
+        for name, value in self.counters.items():
+            record[f"{name}_per_s"] = value / elapsed if elapsed > 0 else 0.0
+
+        if self.total:
+            done = self.counters.get(self.unit, 0)
+            rate = done / elapsed if elapsed > 0 else 0.0
+            record["total"] = self.total
+            record["unit"] = self.unit
+            record["progress"] = min(done / self.total, 1.0)
+            record["eta_s"] = max(self.total - done, 0) / rate if rate else None
+        record.update(self.extra)
+        return record
+
+
+class Telemetry:
+    """
+    Collects stage metrics and writes them to the configured outputs
+
+    With no output configured the stage() context is still usable but
+    nothing is written, so instrumented code costs a few dictionary
+    updates per call.
+
+    Args:
+        jsonl: JSON-lines output path, "-" for stderr, or None
+        prometheus: Prometheus textfile path, or None
+        profile: None, "cprofile" or "tracemalloc" (applied to every stage)
+        profile_dir: Directory for .prof files
+        interval: Seconds between progress events per stage
+    """
+
+    def __init__(self, jsonl=None, prometheus=None, profile=None, profile_dir=DEFAULT_PROFILE_DIR,
+                 interval=DEFAULT_INTERVAL):
+        if profile not in (None, "", "cprofile", "tracemalloc"):
+            raise ValueError(f"Unknown profiler: {profile}")
+        self.jsonl = jsonl
+        self.prometheus = Path(prometheus) if prometheus else None
+        self.profile = profile or None
+        self.profile_dir = Path(profile_dir)
+        self.interval = interval
+        self.run_id = uuid.uuid4().hex[:12]
+        self.host = socket.gethostname()
+        self._latest = {}
+        self._profiling = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            jsonl=os.environ.get(ENV_JSONL) or None,
+            prometheus=os.environ.get(ENV_PROMETHEUS) or None,
+            profile=os.environ.get(ENV_PROFILE) or None,
+            profile_dir=os.environ.get(ENV_PROFILE_DIR) or DEFAULT_PROFILE_DIR,
+            interval=float(os.environ.get(ENV_INTERVAL) or DEFAULT_INTERVAL),
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.jsonl or self.prometheus)
+
+    @contextmanager
+    def stage(self, name, total=None, unit="games_seen"):
+        """
+        Time a stage and report its counters
+
+        Emits "start", periodic "progress" and a final "end" event. An
+        exception escaping the block is reported as an "error" event with
+        its type and message and then re-raised.
+
+        Example:
+            with telemetry.stage("filter", total=size, unit="bytes_in") as metrics:
+                ...
+                metrics.add(games_seen=1, bytes_in=len(game))
+        """
+        metrics = StageMetrics(self, name, total, unit)
+        self.emit(metrics.snapshot("start"))
+
+        # Nested stages are covered by the profile of the outermost one
+        profiler = None
+        started_tracing = False
+        if self.profile == "cprofile" and not self._profiling:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.profile == "tracemalloc":
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        event = "end"
+        try:
+            yield metrics
+        except BaseException as e:
+            event = "error"
+            metrics.extra["error_type"] = type(e).__name__
+            metrics.extra["error"] = str(e)
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                path = self.profile_dir / f"{self.run_id}_{name}.prof"
+                profiler.dump_stats(path)
+                metrics.extra["profile"] = str(path)
+            elif self.profile == "tracemalloc":
+                current, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics("lineno")[:TRACEMALLOC_TOP]
+                metrics.extra["traced_current_bytes"] = current
+                metrics.extra["traced_peak_bytes"] = peak
+                metrics.extra["traced_top"] = [
+                    {"where": str(stat.traceback[0]), "bytes": stat.size, "blocks": stat.count} for stat in top
+                ]
+                if started_tracing:
+                    tracemalloc.stop()
+            self.emit(metrics.snapshot(event))
+
+    def emit(self, record):
+        """
+        Write one event to every configured output
+        """
+        if not self.enabled:
+            return
+        if self.jsonl:
+            line = json.dumps(record, default=str) + "\n"
+            if self.jsonl == "-":
+                sys.stderr.write(line)
+                sys.stderr.flush()
+            else:
+                with open(self.jsonl, 'a', encoding='utf-8') as f:
+                    f.write(line)
+        if self.prometheus:
+            self._latest[record["stage"]] = record
+            self._write_prometheus()
+
+    def _write_prometheus(self):
+        """
+        Rewrite the textfile atomically with the latest state of every stage
+        """
+        lines = []
+        # Every counter has a matching "<name>_per_s" rate in the record
+        counters = sorted({name for record in self._latest.values() for name in record
+                           if f"{name}_per_s" in record})
+        for name in counters:
+            metric = f"{PROMETHEUS_PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for stage, record in sorted(self._latest.items()):
+                if name in record:
+                    lines.append(f'{metric}{{stage="{stage}"}} {record[name]}')
+
+        gauges = [("elapsed_seconds", "elapsed_s"), ("progress_ratio", "progress"), ("eta_seconds", "eta_s")]
+        for metric_name, field in gauges:
+            metric = f"{PROMETHEUS_PREFIX}_stage_{metric_name}"
+            lines.append(f"# TYPE {metric} gauge")
+            for stage, record in sorted(self._latest.items()):
+                if record.get(field) is not None:
+                    lines.append(f'{metric}{{stage="{stage}"}} {record[field]}')
+
+        metric = f"{PROMETHEUS_PREFIX}_stage_running"
+        lines.append(f"# TYPE {metric} gauge")
+        for stage, record in sorted(self._latest.items()):
+            running = 1 if record["event"] in ("start", "progress") else 0
+            lines.append(f'{metric}{{stage="{stage}"}} {running}')
+        metric = f"{PROMETHEUS_PREFIX}_stage_failed"
+        lines.append(f"# TYPE {metric} gauge")
+        for stage, record in sorted(self._latest.items()):
+            lines.append(f'{metric}{{stage="{stage}"}} {1 if record["event"] == "error" else 0}')
+
+        self.prometheus.parent.mkdir(parents=True, exist_ok=True)
+        scratch = self.prometheus.with_name(self.prometheus.name + ".tmp")
+        with open(scratch, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(scratch, self.prometheus)
+
+
+_telemetry = None
+
+
+def get_telemetry():
+    """
+    Return the process-wide Telemetry configured from the environment
+    """
+    global _telemetry
+    if _telemetry is None:
+        _telemetry = Telemetry.from_env()
+    return _telemetry
+
+
+def stage(name, total=None, unit="games_seen"):
+    """
+    Shorthand for get_telemetry().stage(...)
+    """
+    return get_telemetry().stage(name, total, unit)
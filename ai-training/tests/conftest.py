@@ -0,0 +1,83 @@
+import socket
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+# The training scripts import each other as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        site = self.server.site
+        body = site.files.get(self.path)
+        start = 0
+        if self.headers.get("Range", "").startswith("bytes="):
+            start = int(self.headers["Range"][6:].split("-")[0])
+        site.requests.append((self.path, start))
+
+        statuses = site.errors.get(self.path)
+        status = statuses.pop(0) if statuses else (404 if body is None else 206 if start else 200)
+        if status >= 400:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        payload = body[start:]
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(payload)))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        self.end_headers()
+        drops = site.drops.get(self.path)
+        if drops:
+            # Send part of the body, then cut the connection
+            self.wfile.write(payload[:drops.pop(0)])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalSite:
+    """
+    Files served over HTTP with Range support, scripted errors and dropped connections
+
+    Attributes:
+        files: {path: bytes}
+        errors: {path: [status, ...]} answered, in order, before the file is served
+        drops: {path: [bytes, ...]} sent by successive responses before the connection is cut
+        requests: (path, range start) of every request received
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.errors = {}
+        self.drops = {}
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.site = self
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+
+@pytest.fixture
+def http_site():
+    site = LocalSite()
+    thread = threading.Thread(target=site.server.serve_forever, daemon=True)
+    thread.start()
+    yield site
+    site.server.shutdown()
+    site.server.server_close()
@@ -0,0 +1,77 @@
+"""
+fetch_all against a local HTTP server
+"""
+
+import bz2
+import hashlib
+
+import pytest
+
+import async_fetcher
+from async_fetcher import FetchJob, fetch_all
+
+GAME = '[Event "g{number}"]\n[Result "1-0"]\n\n1. e4 e5 2. Qh5 Nc6 1-0\n\n'
+
+
+def _archive(games, per_stream=25):
+    text = [GAME.format(number=number).encode() for number in range(games)]
+    streams = [b"".join(text[start:start + per_stream]) for start in range(0, games, per_stream)]
+    return b"".join(text), b"".join(bz2.compress(stream) for stream in streams)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(async_fetcher, "MAX_BACKOFF", 0)
+
+
+def test_server_errors_are_retried(http_site, tmp_path):
+    text, http_site.files["/games.pgn.bz2"] = _archive(100)
+    http_site.errors["/games.pgn.bz2"] = [503, 429]
+    [result] = fetch_all([FetchJob(http_site.url("/games.pgn.bz2"), tmp_path / "games.pgn")], timeout=5)
+    assert (result["status"], result["retries"], result["games"]) == ("done", 2, 100)
+    assert (tmp_path / "games.pgn").read_bytes() == text
+
+
+def test_missing_file_is_not_retried(http_site, tmp_path):
+    [result] = fetch_all([FetchJob(http_site.url("/missing.pgn.bz2"), tmp_path / "games.pgn")], timeout=5)
+    assert result["status"] == "failed" and "404" in result["error"]
+    assert len(http_site.requests) == 1
+
+
+def test_tiny_network_chunks(http_site, tmp_path):
+    text, http_site.files["/games.pgn.bz2"] = _archive(30)
+    [result] = fetch_all([FetchJob(http_site.url("/games.pgn.bz2"), tmp_path / "games.pgn")], chunk_size=2,
+                         timeout=5)
+    assert (result["status"], result["games"]) == ("done", 30)
+    assert (tmp_path / "games.pgn").read_bytes() == text
+
+
+def test_resumes_with_range_after_a_dropped_connection(http_site, tmp_path):
+    text, archive = _archive(200)
+    http_site.files["/games.pgn.bz2"] = archive
+    http_site.drops["/games.pgn.bz2"] = [len(archive) // 3, len(archive) // 3]
+    job = FetchJob(http_site.url("/games.pgn.bz2"), tmp_path / "games.pgn",
+                   sha256=hashlib.sha256(archive).hexdigest())
+    [result] = fetch_all([job], chunk_size=256, timeout=5)
+
+    assert (result["status"], result["retries"], result["verified"]) == ("done", 2, True)
+    assert result["bytes_in"] == len(archive) and result["games"] == 200
+    assert (tmp_path / "games.pgn").read_bytes() == text
+    starts = [start for _, start in http_site.requests]
+    assert starts[0] == 0 and 0 < starts[1] < starts[2] < len(archive)
+
+
+def test_stops_after_max_games(http_site, tmp_path):
+    text, http_site.files["/games.pgn.bz2"] = _archive(200)
+    [result] = fetch_all([FetchJob(http_site.url("/games.pgn.bz2"), tmp_path / "games.pgn", max_games=37)],
+                         timeout=5)
+    assert (result["status"], result["games"]) == ("limit", 37)
+    assert (tmp_path / "games.pgn").read_bytes() == text[:text.index(b'[Event "g37"]')]
+
+
+def test_sha256_mismatch_fails_the_job(http_site, tmp_path):
+    _, http_site.files["/games.pgn.bz2"] = _archive(50)
+    job = FetchJob(http_site.url("/games.pgn.bz2"), tmp_path / "games.pgn", sha256="0" * 64)
+    [result] = fetch_all([job], timeout=5)
+    assert result["status"] == "failed" and "sha256 mismatch" in result["error"]
+    assert result["games"] == 50
@@ -0,0 +1,45 @@
+"""
+convert_parallel output directories with and without the artifact cache
+"""
+
+from artifact_cache import ArtifactCache
+from convert_parallel import MANIFEST_NAME, convert_parallel
+from data_loader import find_shards
+
+GAME = '[Event "t"]\n[Result "{result}"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 {result}\n\n'
+
+
+def _write_pgn(path, games):
+    path.write_text("".join(GAME.format(result=("1-0", "0-1", "1/2-1/2")[n % 3]) for n in range(games)),
+                    encoding="utf-8")
+    return path
+
+
+def _listed(manifest):
+    return sorted(name for chunk in manifest["chunks"] for name in chunk["files"])
+
+
+def test_cache_holds_and_restores_only_the_conversion(tmp_path):
+    pgn = _write_pgn(tmp_path / "games.pgn", 12)
+    cache = ArtifactCache(tmp_path / "cache")
+
+    first = tmp_path / "first"
+    first.mkdir()
+    (first / "notes.txt").write_text("unrelated", encoding="utf-8")
+    (first / "part_00099_000000.rec").write_bytes(b"stale")
+    manifest = convert_parallel(pgn, first, workers=1, games_per_chunk=4, shard_size=20, verbose=False, cache=cache)
+    assert manifest["positions"] == 72
+    assert [path.name for path in find_shards(first)] == _listed(manifest)
+    assert (first / "notes.txt").exists()
+
+    entry = cache.get(next(iter(cache.index)))
+    assert sorted(path.name for path in entry["path"].iterdir()) == sorted(_listed(manifest) + [MANIFEST_NAME])
+
+    second = tmp_path / "second"
+    second.mkdir()
+    (second / "part_00099_000000.rec").write_bytes(b"stale")
+    restored = convert_parallel(pgn, second, workers=1, games_per_chunk=4, shard_size=20, verbose=False, cache=cache)
+    assert cache.hits == 2
+    assert [path.name for path in find_shards(second)] == _listed(restored) == _listed(manifest)
+    for name in _listed(manifest):
+        assert (second / name).read_bytes() == (first / name).read_bytes()
@@ -0,0 +1,41 @@
+"""
+ShardDataset ordering across epochs and DataLoader workers
+"""
+
+import random
+
+import chess
+
+from data_loader import make_loader
+from encoder import game_positions
+from record_format import RecordShardWriter
+
+
+def _write_shards(output_dir, games=40):
+    rng = random.Random(0)
+    writer = RecordShardWriter(output_dir, shard_size=64, prefix="test")
+    for _ in range(games):
+        board = chess.Board()
+        moves = []
+        for _ in range(12):
+            move = rng.choice(list(board.legal_moves))
+            moves.append(move)
+            board.push(move)
+        writer.add(game_positions(chess.Board(), moves, 0))
+    return writer.close()
+
+
+def _epoch_policies(loader, dataset, epoch):
+    dataset.set_epoch(epoch)
+    return [policy.tolist() for _, policy, _ in loader]
+
+
+def test_set_epoch_reaches_worker_processes(tmp_path):
+    _write_shards(tmp_path)
+    loader, dataset = make_loader(tmp_path, batch_size=32, num_workers=2, shuffle_buffer=64,
+                                  prefetch_factor=2, pin_memory=False)
+    first = _epoch_policies(loader, dataset, 0)
+    second = _epoch_policies(loader, dataset, 1)
+    assert first != second
+    assert sorted(sum(first, [])) == sorted(sum(second, []))
+    assert _epoch_policies(loader, dataset, 0) == first
@@ -0,0 +1,30 @@
+"""
+dedup_shards flags and merged results across shards
+"""
+
+import chess
+import numpy as np
+
+from dedup import dedup_shards
+from encoder import game_positions
+from record_format import FLAG_DUPLICATE, FLAG_MERGED, RecordFile, RecordShardWriter
+
+
+def test_merges_repeated_positions_into_the_first_shard(tmp_path):
+    for number, (moves, value) in enumerate([("e4 e5", 1), ("e4 c5", 1), ("e4 e5", -1), ("d4 d5", 0)]):
+        writer = RecordShardWriter(tmp_path, prefix=f"game_{number}")
+        writer.add(game_positions(chess.Board(), moves.split(), value))
+        writer.close()
+
+    stats = dedup_shards(tmp_path, memory_keys=2, verbose=False)
+    assert (stats["positions"], stats["duplicates"], stats["distinct"], stats["merged"]) == (8, 5, 3, 2)
+
+    files = [RecordFile(path) for path in sorted(tmp_path.glob("*.rec"))]
+    first = files[0].records
+    assert (first["flags"] & FLAG_MERGED != 0).tolist() == [True, True]
+    start_values = [record_file.records["value"][0] for record_file in files]
+    assert first["score"][0] == round(np.mean(start_values) * 100)
+    after_e4 = [record_file.records["value"][1] for record_file in files[:3]]
+    assert first["score"][1] == round(np.mean(after_e4) * 100)
+    duplicates = [(record_file.records["flags"] & FLAG_DUPLICATE != 0).tolist() for record_file in files]
+    assert duplicates == [[False, False], [True, True], [True, True], [True, False]]
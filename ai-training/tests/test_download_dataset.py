@@ -0,0 +1,36 @@
+"""
+stream_lichess_games against a local stand-in for the Lichess database
+"""
+
+import bz2
+import hashlib
+
+import pytest
+
+from download_dataset import stream_lichess_games
+
+GAME = ('[Event "Rated Blitz game"]\n[Site "g{number}"]\n[WhiteElo "1900"]\n[BlackElo "1850"]\n'
+        '[Result "1-0"]\n[TimeControl "180+0"]\n\n{{ {digest} }} 1. e4 e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0\n\n')
+
+
+def _archive(games, per_stream=40):
+    # A digest per game keeps the archive from compressing to almost nothing
+    text = [GAME.format(number=number, digest=hashlib.sha256(str(number).encode()).hexdigest()).encode()
+            for number in range(games)]
+    streams = [b"".join(text[start:start + per_stream]) for start in range(0, games, per_stream)]
+    return text, b"".join(bz2.compress(stream) for stream in streams)
+
+
+@pytest.mark.parametrize("max_games", [137, None])
+def test_resumes_after_drops_and_stops_at_max_games(http_site, tmp_path, max_games):
+    games, archive = _archive(300)
+    http_site.files["/db.pgn.bz2"] = archive
+    http_site.drops["/db.pgn.bz2"] = [len(archive) // 5, len(archive) // 5]
+
+    output = stream_lichess_games(max_games=max_games, chunk_size=512, url=http_site.url("/db.pgn.bz2"),
+                                  output_file=tmp_path / "games.pgn", timeout=5)
+    assert output == tmp_path / "games.pgn"
+    assert output.read_bytes() == b"".join(games[:max_games])
+
+    starts = [start for _, start in http_site.requests]
+    assert starts[0] == 0 and 0 < starts[1] < starts[2] < len(archive)
@@ -0,0 +1,67 @@
+"""
+InferenceServer counters and the HTTP front end on a freshly exported model
+"""
+
+import asyncio
+import threading
+
+import chess
+import numpy as np
+import pytest
+
+from encoder import encode_board
+from export_model import export_onnx
+from inference_server import InferenceServer, make_app
+from train import ChessNet
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    return export_onnx(ChessNet(), tmp_path_factory.mktemp("model") / "model.onnx")
+
+
+def test_counters_under_concurrent_submits(model_path):
+    planes = encode_board(chess.Board())
+    threads, per_thread = 8, 50
+    with InferenceServer(model_path, max_batch_size=16, cache_size=0) as server:
+        def client():
+            for _ in range(per_thread):
+                server.submit(planes).result()
+
+        workers = [threading.Thread(target=client) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        server.evaluate_fens([chess.STARTING_FEN] * 3)
+        stats = server.stats()
+
+    assert stats["requests"] == threads * per_thread + 1
+    assert stats["positions"] == threads * per_thread + 3
+    assert server.batch_positions == threads * per_thread + 3
+    assert np.isfinite(stats["p99_ms"])
+
+
+async def _post(app, body):
+    from aiohttp.test_utils import TestClient, TestServer
+
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post("/evaluate", data=body, headers={"Content-Type": "application/json"})
+        return response.status, await response.json()
+
+
+@pytest.mark.parametrize("body", ['{"fen": "not a fen"}', "{}", '{"fens": []}', '{"fens": "x"}',
+                                  '{"fen": 3}', "[1, 2]", "not json", ""])
+def test_bad_requests_get_400(model_path, body):
+    with InferenceServer(model_path) as server:
+        status, answer = asyncio.run(_post(make_app(server), body))
+    assert status == 400 and "error" in answer
+
+
+def test_evaluate_endpoint(model_path):
+    with InferenceServer(model_path) as server:
+        status, answer = asyncio.run(_post(make_app(server), '{"fens": ["%s", "8/8/8/8/8/8/8/k6K w - - 0 1"]}'
+                                           % chess.STARTING_FEN))
+    assert status == 200
+    assert [result["fen"] for result in answer["results"]][1] == "8/8/8/8/8/8/8/k6K w - - 0 1"
+    assert chess.Move.from_uci(answer["results"][0]["best_move"]) in chess.Board().legal_moves
@@ -0,0 +1,40 @@
+"""
+ingest() against a local HTTP server
+"""
+
+import bz2
+
+from ingest import ingest, list_shards, load_manifest
+
+GAME = '[Event "g{number}"]\n[WhiteElo "2000"]\n[BlackElo "2000"]\n[Result "1-0"]\n\n1. e4 e5 2. Qh5 Nc6 1-0\n\n'
+
+
+def _archive(first, games, per_stream=20):
+    text = "".join(GAME.format(number=number) for number in range(first, first + games)).encode()
+    games = text.split(b"\n\n[")
+    pieces = [games[0]] + [b"[" + game for game in games[1:]]
+    pieces = [piece + b"\n\n" if index < len(pieces) - 1 else piece for index, piece in enumerate(pieces)]
+    streams = [b"".join(pieces[start:start + per_stream]) for start in range(0, len(pieces), per_stream)]
+    return text, b"".join(bz2.compress(stream) for stream in streams)
+
+
+def test_failed_source_does_not_stop_the_others(http_site, tmp_path):
+    text_a, http_site.files["/a.pgn.bz2"] = _archive(0, 100)
+    text_b, http_site.files["/b.pgn.bz2"] = _archive(100, 60)
+    http_site.drops["/a.pgn.bz2"] = [len(http_site.files["/a.pgn.bz2"]) // 2]
+    specs = [http_site.url(path) for path in ("/a.pgn.bz2", "/missing.pgn.bz2", "/b.pgn.bz2")]
+
+    result = ingest(specs, tmp_path, checkpoint_every=10, chunk_size=256, timeout=5)
+    assert list(result["failed"]) == ["missing"] and "404" in result["failed"]["missing"]
+    statuses = {name: entry["status"] for name, entry in load_manifest(tmp_path)["sources"].items()}
+    assert statuses == {"a": "complete", "missing": "failed", "b": "complete"}
+    assert b"".join(path.read_bytes() for path in list_shards(tmp_path)) == text_a + text_b
+    assert ("/a.pgn.bz2", 0) in http_site.requests and any(
+        path == "/a.pgn.bz2" and start > 0 for path, start in http_site.requests)
+
+    # Published later: the next run picks it up and only it
+    text_c, http_site.files["/missing.pgn.bz2"] = _archive(200, 30)
+    result = ingest(specs, tmp_path, timeout=5)
+    assert result["failed"] == {}
+    assert load_manifest(tmp_path)["sources"]["missing"]["status"] == "complete"
+    assert b"".join(path.read_bytes() for path in result["new_shards"]) == text_c
@@ -0,0 +1,25 @@
+"""
+Categorical columns of the metadata store past the 16-bit code range
+"""
+
+import numpy as np
+
+from metadata_store import build_store
+
+EVENTS = 70000
+
+
+def test_more_events_than_fit_in_16_bits(tmp_path):
+    pgn = tmp_path / "games.pgn"
+    with open(pgn, 'w', encoding='utf-8') as f:
+        for number in range(EVENTS):
+            f.write(f'[Event "Arena {number}"]\n[Termination "Normal"]\n[Result "1-0"]\n\n1. e4 1-0\n\n')
+    store = build_store(pgn, workers=1, verbose=False)
+
+    assert len(store) == EVENTS
+    assert store.labels("event", store["event"][[0, 65535, 65536, EVENTS - 1]]) == \
+        ["Arena 0", "Arena 65535", "Arena 65536", f"Arena {EVENTS - 1}"]
+    assert np.array_equal(store["event"], np.arange(EVENTS))
+    groups = store.group_by("event")
+    assert len(groups) == EVENTS and groups["Arena 65536"] == 1
+    assert store.group_by("termination") == {"Normal": EVENTS}
@@ -0,0 +1,149 @@
+"""
+mongo_export against an in-memory stand-in for the games collection
+"""
+
+import io
+from datetime import datetime, timedelta, timezone
+
+import chess
+import chess.pgn
+
+from mongo_export import export_games, load_state
+from record_format import RecordFile
+
+GAMES = [
+    (["e4", "e5", "Qh5", "Nc6", "Bc4", "Nf6", "Qxf7#"], "white"),
+    (["f3", "e5", "g4", "Qh4#"], "black"),
+    (["d4", "d5", "c4", "e6"], "draw"),
+    (["Nf3", "Nf6"], "ongoing"),
+    (["e4", "e5", "Ke3"], "draw"),           # illegal third move
+]
+
+
+class _Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, keys):
+        self.documents.sort(key=lambda document: tuple(document[name] for name, _ in keys))
+        return self
+
+    def limit(self, count):
+        self.documents = self.documents[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+def _matches(document, query):
+    for name, condition in query.items():
+        if name == "$or":
+            if not any(_matches(document, option) for option in condition):
+                return False
+        elif isinstance(condition, dict):
+            if not document[name] > condition["$gt"]:
+                return False
+        elif document[name] != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    """
+    The subset of a pymongo collection that export_games uses
+    """
+
+    def __init__(self):
+        self.documents = []
+        self.queries = 0
+
+    def insert(self, sans, result, number, start):
+        board = chess.Board()
+        for san in sans:
+            try:
+                board.push_san(san)
+            except ValueError:
+                break
+        self.documents.append({
+            "_id": f"{number:024x}",
+            "players": {"white": "alice", "black": 'bob "the rook"'},
+            # The client stores the final position with every move
+            "moves": [{"move": san, "fen": board.fen()} for san in sans],
+            "result": result,
+            "gameMode": "online",
+            "startTime": start,
+            "finalFEN": board.fen(),
+        })
+
+    def find(self, query, projection=None):
+        self.queries += 1
+        return _Cursor([dict(document) for document in self.documents if _matches(document, query)])
+
+
+def _fill(collection, first, count, start):
+    for number in range(first, first + count):
+        sans, result = GAMES[number % len(GAMES)]
+        # Several games share a start time, so the _id tie-break matters
+        collection.insert(sans, result, number, start + timedelta(seconds=number // 3))
+
+
+def _exported_ids(output_dir):
+    ids = []
+    for path in sorted(output_dir.glob("site_*.pgn")):
+        handle = io.StringIO(path.read_text(encoding="utf-8"))
+        while (game := chess.pgn.read_game(handle)) is not None:
+            ids.append(game.headers["GameId"])
+    return ids
+
+
+def test_incremental_exports_every_finished_game_once(tmp_path):
+    collection = FakeCollection()
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    _fill(collection, 0, 23, start)
+
+    first = export_games(collection, tmp_path, batch_size=4, verbose=False)
+    assert first["read"] == 23
+    assert first["ongoing"] == 4 and first["invalid"] == 4
+    assert collection.queries == 6
+
+    assert export_games(collection, tmp_path, batch_size=4, verbose=False)["read"] == 0
+
+    _fill(collection, 23, 7, start)
+    second = export_games(collection, tmp_path, batch_size=4, verbose=False)
+    assert second["read"] == 7
+
+    expected = [f"{number:024x}" for number in range(30) if number % len(GAMES) < 3]
+    assert sorted(_exported_ids(tmp_path)) == expected
+    assert load_state(tmp_path)["id"] == f"{29:024x}"
+
+
+def test_back_to_back_runs_keep_their_output(tmp_path):
+    collection = FakeCollection()
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for first in range(0, 9, 3):
+        _fill(collection, first, 3, start)
+        export_games(collection, tmp_path, verbose=False)
+    assert len(_exported_ids(tmp_path)) == 6
+
+
+def test_pgn_moves_and_headers(tmp_path):
+    collection = FakeCollection()
+    _fill(collection, 0, 3, datetime(2026, 1, 1, tzinfo=timezone.utc))
+    result = export_games(collection, tmp_path, verbose=False)
+
+    games = []
+    handle = io.StringIO(result["output"].read_text(encoding="utf-8"))
+    while (game := chess.pgn.read_game(handle)) is not None:
+        games.append(game)
+    assert [game.headers["Result"] for game in games] == ["1-0", "0-1", "1/2-1/2"]
+    assert games[0].headers["White"] == "alice"
+    assert [move.uci() for move in games[1].mainline_moves()] == ["f2f3", "e7e5", "g2g4", "d8h4"]
+
+
+def test_records_format(tmp_path):
+    collection = FakeCollection()
+    _fill(collection, 0, 5, datetime(2026, 1, 1, tzinfo=timezone.utc))
+    result = export_games(collection, tmp_path, fmt="records", verbose=False)
+    records = sum(len(RecordFile(path).records) for path in result["output"].glob("*.rec"))
+    assert records == result["positions"] == 7 + 4 + 4
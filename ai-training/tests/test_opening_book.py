@@ -0,0 +1,30 @@
+"""
+build_book statistics for legal and broken games
+"""
+
+import chess
+
+from opening_book import OpeningBook, build_book
+
+GAMES = [
+    '[Result "1-0"]\n\n1. e4 e5 2. Nf3 Nc6 1-0\n\n',
+    '[Result "0-1"]\n\n1. e4 c5 2. Nf3 d6 0-1\n\n',
+    # Illegal third ply: none of this game may reach the book
+    '[Result "1/2-1/2"]\n\n1. e4 e5 2. Ke3 Nc6 1/2-1/2\n\n',
+]
+
+
+def test_broken_games_add_nothing(tmp_path):
+    pgn = tmp_path / "games.pgn"
+    pgn.write_text("".join(GAMES), encoding="utf-8")
+    stats = build_book(pgn, tmp_path / "book.bin", depth=4, verbose=False)
+    assert (stats["games"], stats["skipped"]) == (2, 1)
+
+    book = OpeningBook(tmp_path / "book.bin")
+    board = chess.Board()
+    [first] = book.find(board)
+    assert (first["move"].uci(), first["games"], first["wins"], first["draws"], first["losses"]) == \
+        ("e2e4", 2, 1, 0, 1)
+    board.push_san("e4")
+    replies = {entry["move"].uci(): (entry["wins"], entry["draws"], entry["losses"]) for entry in book.find(board)}
+    assert replies == {"e7e5": (0, 0, 1), "c7c5": (1, 0, 0)}
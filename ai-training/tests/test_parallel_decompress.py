@@ -0,0 +1,55 @@
+"""
+decompress_parallel on small multi-stream archives
+"""
+
+import bz2
+import gzip
+
+import pytest
+
+import parallel_decompress
+from parallel_decompress import StreamDecompressor, decompress_parallel
+
+GAME = '[Event "g{number}"]\n[Result "1-0"]\n\n1. e4 e5 2. Qh5 Nc6 1-0\n\n'
+
+
+def _streams(compress, games=400, per_stream=25):
+    text = [GAME.format(number=number).encode() for number in range(games)]
+    pieces = [b"".join(text[start:start + per_stream]) for start in range(0, games, per_stream)]
+    return b"".join(pieces), b"".join(compress(piece) for piece in pieces)
+
+
+@pytest.mark.parametrize("compress", [bz2.compress, gzip.compress])
+def test_output_matches_and_stops_after_max_games(tmp_path, monkeypatch, compress):
+    # Small copy blocks put game boundaries across block edges
+    monkeypatch.setattr(parallel_decompress, "IO_BLOCK_SIZE", 64)
+    plain, packed = _streams(compress)
+    archive = tmp_path / "games.pgn.z"
+    archive.write_bytes(packed)
+
+    stats = decompress_parallel(archive, tmp_path / "all.pgn", workers=2, segment_size=300)
+    assert (tmp_path / "all.pgn").read_bytes() == plain
+    assert stats["games"] == 400 and stats["streams"] == 16 and stats["segments"] > 2
+
+    stats = decompress_parallel(archive, tmp_path / "some.pgn", max_games=123, workers=2, segment_size=300)
+    assert stats["games"] == 123
+    assert (tmp_path / "some.pgn").read_bytes() == plain[:plain.index(b'[Event "g123"]')]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["all.pgn", "games.pgn.z", "some.pgn"]
+
+
+def test_truncated_archive_fails(tmp_path):
+    _, packed = _streams(bz2.compress)
+    archive = tmp_path / "games.pgn.bz2"
+    archive.write_bytes(packed[:-20])
+    with pytest.raises(ValueError, match="Truncated"):
+        decompress_parallel(archive, tmp_path / "out.pgn", workers=1)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["games.pgn.bz2", "out.pgn"]
+
+
+@pytest.mark.parametrize("compress", [bz2.compress, gzip.compress, bytes])
+def test_stream_decompressor_detects_format_from_tiny_pieces(compress):
+    plain, packed = _streams(compress, games=60)
+    decompressor = StreamDecompressor("auto")
+    output = b"".join(decompressor.decompress(packed[start:start + 2]) for start in range(0, len(packed), 2))
+    assert output == plain
+    assert decompressor.bytes_in == len(packed)
@@ -0,0 +1,28 @@
+"""
+StratifiedSampler over games with and without the tags it stratifies on
+"""
+
+from pipeline import Pipeline, StratifiedSampler
+
+GAMES = [
+    '[Event "a"]\n[WhiteElo "1500"]\n[BlackElo "1500"]\n[TimeControl "180+0"]\n[Result "1-0"]\n\n1. e4 e5 1-0\n\n',
+    '[Event "b"]\n[WhiteElo "2000"]\n[TimeControl "600+5"]\n\n1. d4 d5 *\n\n',
+    '[Event "c"]\n[WhiteElo "2100"]\n[TimeControl "600+5"]\n[Result "0-1"]\n\n1. d4 Nf6 0-1\n\n',
+    '[Event "d"]\n[TimeControl "-"]\n[Result "*"]\n\n1. c4 *\n\n',
+]
+
+
+def test_strata_with_a_missing_result(tmp_path):
+    source = tmp_path / "games.pgn"
+    source.write_text("".join(GAMES), encoding="utf-8")
+    sampler = StratifiedSampler(5, tmp_path / "sample.pgn", seed=1)
+    Pipeline(sampler).run(source)
+
+    assert sampler.strata() == {
+        ("1400-1799", "blitz", "1-0"): (1, 1),
+        ("1800-2199", "rapid", "*"): (1, 1),
+        ("1800-2199", "rapid", "0-1"): (1, 1),
+        ("unrated", "correspondence", "*"): (1, 1),
+    }
+    sampler.report()
+    assert (tmp_path / "sample.pgn").read_text(encoding="utf-8") == "".join(GAMES)
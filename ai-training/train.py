@@ -0,0 +1,317 @@
+"""
+CPU-oriented training loop for ChessNet
+Trains on encoded record shards and reports throughput, per-phase step times and peak memory
+"""
+
+import json
+import resource
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from data_loader import make_loader
+from encoder import NUM_PLANES, POLICY_SIZE
+from telemetry import stage
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_LR = 0.001
+DEFAULT_LOG_EVERY = 50
+METRICS_FILE = Path("benchmarks") / "train_runs.jsonl"
+
+PHASES = ("data", "forward", "backward", "optimizer")
+
+
+class ChessNet(nn.Module):
+    """
+    The notebook's network: three 3x3 convolutions and linear policy/value heads
+
+    Layer names match the notebook, so its checkpoints load unchanged.
+    """
+
+    def __init__(self, channels=256):
+        super().__init__()
+        self.channels = channels
+        self.conv1 = nn.Conv2d(NUM_PLANES, channels, 3, padding=1)
+        self.conv2 = nn.Conv2d(channels, channels, 3, padding=1)
+        self.conv3 = nn.Conv2d(channels, channels, 3, padding=1)
+        self.fc1 = nn.Linear(channels * 8 * 8, POLICY_SIZE)  # Policy head
+        self.fc2 = nn.Linear(channels * 8 * 8, 1)            # Value head
+
+    def forward(self, x):
+        x = torch.relu(self.conv1(x))
+        x = torch.relu(self.conv2(x))
+        x = torch.relu(self.conv3(x))
+        # flatten (unlike view) also accepts channels_last activations
+        x = torch.flatten(x, 1)
+        policy = self.fc1(x)
+        value = torch.tanh(self.fc2(x))
+        return policy, value
+
+
+def synthetic_batches(batch_size, steps, seed=0):
+    """
+    Yield random (planes, policy, value) batches for measuring compute alone
+    """
+    generator = torch.Generator().manual_seed(seed)
+    planes = (torch.rand(batch_size, NUM_PLANES, 8, 8, generator=generator) < 0.1).float()
+    policy = torch.randint(POLICY_SIZE, (batch_size,), generator=generator)
+    value = torch.randint(-1, 2, (batch_size,), generator=generator).float()
+    for _ in range(steps):
+        yield planes, policy, value
+
+
+def configure_threads(threads=None, interop_threads=None):
+    """
+    Set PyTorch's intra-op and inter-op thread pools
+
+    The inter-op pool can only be sized before the first parallel
+    operation, so call this before building the model.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_interop_threads(interop_threads)
+        except RuntimeError as e:
+            print(f"⚠️  Inter-op threads unchanged: {e}")
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def _peak_memory_mb(device):
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / (1024 * 1024)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PhaseTimer:
+    """
+    Accumulate wall time per training phase
+
+    CUDA work is asynchronous, so the device is synchronised at each
+    phase boundary there; on the CPU the timings are exact as they are.
+    """
+
+    def __init__(self, device):
+        self.sync = torch.cuda.synchronize if device.type == "cuda" else None
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self._mark = time.perf_counter()
+
+    def start(self):
+        self._mark = time.perf_counter()
+
+    def lap(self, phase):
+        if self.sync:
+            self.sync()
+        now = time.perf_counter()
+        self.totals[phase] += now - self._mark
+        self._mark = now
+
+
+def train(shards=None, output_file="chess_model_trained.pth", epochs=1, batch_size=DEFAULT_BATCH_SIZE,
+          accumulation_steps=1, lr=DEFAULT_LR, channels_last=True, compile_model=False, bf16=False,
+          threads=None, interop_threads=None, num_workers=0, max_steps=None, synthetic_steps=100,
+          warmup_steps=2, device=None, log_every=DEFAULT_LOG_EVERY, metrics_file=METRICS_FILE, seed=0):
+    """
+    Train ChessNet and measure where the time goes
+
+    A step is one optimizer update over accumulation_steps micro-batches
+    of batch_size positions. Forward, backward, optimizer and data-wait
+    times are summed per step; the first warmup_steps steps (which include
+    torch.compile and allocator warm-up) are excluded from the rates.
+
+    Args:
+        shards: Record shard directory, file or list; None trains on
+                synthetic batches to measure compute throughput alone
+        output_file: Checkpoint path (state_dict, loadable by the notebook)
+        epochs: Passes over the shards
+        batch_size: Positions per micro-batch
+        accumulation_steps: Micro-batches per optimizer step
+        lr: Adam learning rate
+        channels_last: Use the NHWC memory layout for model and inputs
+        compile_model: Wrap the model in torch.compile
+        bf16: Run forward and loss under bfloat16 autocast
+        threads: Intra-op threads (defaults to PyTorch's choice)
+        interop_threads: Inter-op threads
+        num_workers: DataLoader worker processes
+        max_steps: Stop after this many optimizer steps
+        synthetic_steps: Micro-batches per epoch when shards is None
+        warmup_steps: Leading steps left out of the throughput figures
+        device: "cpu" or "cuda" (defaults to cpu)
+        log_every: Print a progress line every this many steps
+        metrics_file: JSON-lines file the run summary is appended to (None to skip)
+        seed: Seed for weights, shuffling and synthetic data
+
+    Returns:
+        Run summary dictionary
+    """
+    threads, interop_threads = configure_threads(threads, interop_threads)
+    torch.manual_seed(seed)
+    device = torch.device(device or "cpu")
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+    model = ChessNet().to(device, memory_format=memory_format)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    step_model = torch.compile(model) if compile_model else model
+    autocast = torch.autocast(device.type, dtype=torch.bfloat16) if bf16 else nullcontext()
+
+    dataset = None
+    if shards is not None:
+        loader, dataset = make_loader(shards, batch_size=batch_size, num_workers=num_workers, seed=seed,
+                                      drop_last=True)
+
+    print("🚀 Training ChessNet")
+    print(f"🎯 Model parameters: {sum(p.numel() for p in model.parameters()):,}")
+    print(f"🎯 Device {device}, {threads} threads ({interop_threads} inter-op), batch {batch_size} x "
+          f"{accumulation_steps}, channels_last={channels_last}, compile={compile_model}, bf16={bf16}")
+
+    timer = PhaseTimer(device)
+    measured = dict.fromkeys(PHASES, 0.0)
+    steps = 0
+    micro = 0
+    samples = 0
+    measured_samples = 0
+    loss_total = 0.0
+    began = time.perf_counter()
+
+    model.train()
+    optimizer.zero_grad(set_to_none=True)
+    with stage("train", total=max_steps, unit="steps") as metrics:
+        for epoch in range(epochs):
+            if dataset is not None:
+                dataset.set_epoch(epoch)
+                batches = loader
+            else:
+                batches = synthetic_batches(batch_size, synthetic_steps, seed + epoch)
+
+            timer.start()
+            for planes, policy, value in batches:
+                planes = planes.to(device, non_blocking=True).contiguous(memory_format=memory_format)
+                policy = policy.to(device, non_blocking=True)
+                value = value.to(device, non_blocking=True)
+                timer.lap("data")
+
+                with autocast:
+                    policy_logits, value_out = step_model(planes)
+                    loss = F.cross_entropy(policy_logits.float(), policy) + \
+                        F.mse_loss(value_out.float().squeeze(1), value)
+                timer.lap("forward")
+
+                (loss / accumulation_steps).backward()
+                timer.lap("backward")
+                micro += 1
+                samples += len(policy)
+                loss_total += loss.item()
+
+                if micro % accumulation_steps:
+                    continue
+
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+                timer.lap("optimizer")
+                steps += 1
+                step_samples = batch_size * accumulation_steps
+                metrics.add(steps=1, samples=step_samples)
+
+                if steps == warmup_steps:
+                    # Rates start from here, after compilation and warm-up
+                    baseline = dict(timer.totals)
+                elif steps > warmup_steps:
+                    measured_samples += step_samples
+                if log_every and steps % log_every == 0:
+                    print(f"  step {steps}: loss {loss_total / micro:.4f}")
+
+                if max_steps and steps >= max_steps:
+                    break
+            if max_steps and steps >= max_steps:
+                break
+
+    elapsed = time.perf_counter() - began
+    if steps > warmup_steps:
+        start = baseline if warmup_steps else dict.fromkeys(PHASES, 0.0)
+        measured = {phase: timer.totals[phase] - start[phase] for phase in PHASES}
+    measured_steps = max(steps - warmup_steps, 0)
+    measured_seconds = sum(measured.values())
+
+    checkpoint = Path(output_file)
+    checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(model.state_dict(), checkpoint)
+
+    summary = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "torch": torch.__version__,
+        "device": str(device),
+        "threads": threads,
+        "interop_threads": interop_threads,
+        "batch_size": batch_size,
+        "accumulation_steps": accumulation_steps,
+        "channels_last": channels_last,
+        "compile": compile_model,
+        "bf16": bf16,
+        "source": "synthetic" if shards is None else str(shards),
+        "steps": steps,
+        "samples": samples,
+        "seconds": elapsed,
+        "loss": loss_total / micro if micro else None,
+        "samples_per_s": measured_samples / measured_seconds if measured_seconds else 0.0,
+        "step_ms": {phase: measured[phase] / measured_steps * 1000 if measured_steps else 0.0
+                    for phase in PHASES},
+        "peak_memory_mb": _peak_memory_mb(device),
+        "checkpoint": str(checkpoint),
+    }
+    if metrics_file:
+        metrics_file = Path(metrics_file)
+        metrics_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(metrics_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(summary) + "\n")
+
+    print_training_report(summary)
+    return summary
+
+
+def print_training_report(summary):
+    """
+    Print throughput, the per-phase step breakdown and peak memory
+    """
+    step_ms = summary["step_ms"]
+    total = sum(step_ms.values())
+    print(f"\n✅ {summary['steps']} steps, {summary['samples']} positions in {summary['seconds']:.1f}s "
+          f"(mean loss {summary['loss']:.4f})" if summary["loss"] is not None else "\n⚠️  No batches")
+    print(f"📊 {summary['samples_per_s']:.0f} samples/s, {total:.1f} ms per step")
+    for phase in PHASES:
+        share = step_ms[phase] / total * 100 if total else 0.0
+        print(f"   {phase:<10}{step_ms[phase]:9.1f} ms  {share:5.1f}%")
+    print(f"📊 Peak memory {summary['peak_memory_mb']:.0f} MB")
+    print(f"💾 Model saved as: {summary['checkpoint']}")
+
+
+if __name__ == "__main__":
+    options = {}
+    shards = None
+    for arg in sys.argv[1:]:
+        key, _, value = arg.partition("=")
+        if key in ("--epochs", "--batch-size", "--accumulate", "--threads", "--interop-threads",
+                   "--workers", "--max-steps", "--synthetic-steps"):
+            name = {"--accumulate": "accumulation_steps", "--workers": "num_workers"}.get(
+                key, key[2:].replace("-", "_"))
+            options[name] = int(value)
+        elif key == "--lr":
+            options["lr"] = float(value)
+        elif key == "--compile":
+            options["compile_model"] = True
+        elif key == "--bf16":
+            options["bf16"] = True
+        elif key == "--no-channels-last":
+            options["channels_last"] = False
+        elif key == "--device":
+            options["device"] = value
+        elif key == "--output":
+            options["output_file"] = value
+        else:
+            shards = arg
+    train(shards, **options)
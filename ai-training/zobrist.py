@@ -0,0 +1,91 @@
+"""
+Vectorised Polyglot Zobrist hashing
+Computes chess.polyglot.zobrist_hash() for whole arrays of encoded positions at once
+"""
+
+import chess
+import chess.polyglot
+import numpy as np
+
+from encoder import PIECE_ORDER
+
+POLYGLOT_RANDOM = np.array(chess.polyglot.POLYGLOT_RANDOM_ARRAY, dtype=np.uint64)
+POLYGLOT_CASTLING = 768       # white O-O, white O-O-O, black O-O, black O-O-O
+POLYGLOT_EP_FILE = 772
+POLYGLOT_TURN = 780
+
+
+def _build_byte_tables():
+    """
+    Precompute, per piece bitboard and byte position, the XOR of the
+    Polyglot keys of every square set in each possible byte value
+    """
+    bit_values = (np.arange(256)[:, None] >> np.arange(8)[None, :]) & 1
+    tables = np.zeros((12, 8, 256), dtype=np.uint64)
+    for plane, (color, piece_type) in enumerate(PIECE_ORDER):
+        piece_index = (piece_type - 1) * 2 + (1 if color == chess.WHITE else 0)
+        square_keys = POLYGLOT_RANDOM[64 * piece_index:64 * piece_index + 64].reshape(8, 8)
+        for byte in range(8):
+            selected = np.where(bit_values.astype(bool), square_keys[byte][None, :], np.uint64(0))
+            tables[plane, byte] = np.bitwise_xor.reduce(selected, axis=1)
+    return tables
+
+
+BYTE_TABLES = _build_byte_tables()
+
+FILE_MASKS = np.array([chess.BB_FILES[file] for file in range(8)], dtype=np.uint64)
+RANK_4 = np.uint64(chess.BB_RANK_4)
+RANK_5 = np.uint64(chess.BB_RANK_5)
+
+
+def position_keys(bitboards, white_to_move, castling, ep_file):
+    """
+    Polyglot keys for arrays of positions
+
+    Args:
+        bitboards: (N, 12) uint64 piece bitboards in encoder.PIECE_ORDER
+        white_to_move: (N,) bool
+        castling: (N, 4) bool rights in Polyglot order (K, Q, k, q)
+        ep_file: (N,) en-passant file + 1, 0 when there is no en-passant square
+
+    Returns:
+        (N,) uint64 keys, equal to chess.polyglot.zobrist_hash() of each board
+    """
+    bitboards = np.ascontiguousarray(bitboards, dtype="<u8")
+    count = len(bitboards)
+    keys = np.zeros(count, dtype=np.uint64)
+
+    byte_values = bitboards.view(np.uint8).reshape(count, 12, 8)
+    for plane in range(12):
+        for byte in range(8):
+            keys ^= BYTE_TABLES[plane, byte][byte_values[:, plane, byte]]
+
+    castling = np.asarray(castling, dtype=bool)
+    for right in range(4):
+        keys[castling[:, right]] ^= POLYGLOT_RANDOM[POLYGLOT_CASTLING + right]
+
+    white_to_move = np.asarray(white_to_move, dtype=bool)
+    keys[white_to_move] ^= POLYGLOT_RANDOM[POLYGLOT_TURN]
+
+    # The en-passant file only counts when a pawn of the side to move
+    # stands next to the pawn that just advanced two squares
+    ep_file = np.asarray(ep_file, dtype=np.int64)
+    has_ep = np.flatnonzero(ep_file > 0)
+    if len(has_ep):
+        file = ep_file[has_ep] - 1
+        white = white_to_move[has_ep]
+        pawns = np.where(white, bitboards[has_ep, 6] & RANK_5, bitboards[has_ep, 0] & RANK_4)
+        neighbours = (np.where(file > 0, FILE_MASKS[np.maximum(file - 1, 0)], np.uint64(0))
+                      | np.where(file < 7, FILE_MASKS[np.minimum(file + 1, 7)], np.uint64(0)))
+        hashed = (pawns & neighbours) != 0
+        keys[has_ep[hashed]] ^= POLYGLOT_RANDOM[POLYGLOT_EP_FILE + file[hashed]]
+    return keys
+
+
+def record_keys(records):
+    """
+    Polyglot keys of record_format records
+    """
+    flags = records["flags"]
+    castling = ((flags[:, None] >> np.arange(1, 5, dtype=np.uint8)[None, :]) & 1).astype(bool)
+    return position_keys(records["bitboards"], (flags & 1).astype(bool), castling, records["ep_file"])